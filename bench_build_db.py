@@ -0,0 +1,48 @@
+# rebuild of generic-heavy code with the build database: cold, unchanged and with one function edited
+import contextlib
+import io
+import sys
+import tempfile
+import time
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from codegen2 import gen_c_code
+from build_db import BuildDatabase
+from bench_templates import gen_source, MAIN
+
+
+def measure(sources: List[str], directory: Optional[str]) -> Tuple[float, str, int]:
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(sources, storage, workers=1)
+    build = BuildDatabase(directory) if directory is not None else None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid = storage.is_valid(build=build)
+    code = gen_c_code(storage, build=build)
+    t = time.perf_counter() - start
+    assert valid
+    if build is None:
+        return t, code, 0
+    build.save()
+    return t, code, build.hits
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    source = gen_source() + MAIN
+    edited = source.replace('point<i32>(7);', 'point<i32>(8);', 1)
+    assert edited != source
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, src in (('cold', source), ('unchanged', source), ('one edited', edited)):
+            sources = read_sources('./build-in') + [src]
+            clean, code, _ = measure(sources, None)
+            t, build_code, hits = measure(sources, directory)
+            assert build_code == code
+            print(f"{name:10}: {t:8.3f} s, without database {clean:8.3f} s, {hits} functions reused")
+
+
+if __name__ == '__main__':
+    main()
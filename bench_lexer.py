@@ -0,0 +1,64 @@
+# ply Lexer vs StreamLexer on generated 100k line sources
+import time
+
+from lexer import Lexer, StreamLexer
+
+LINES = 100_000
+RUNS = 3
+
+
+def gen_code() -> str:
+    lines = ['package bench;', '']
+    n = 0
+    while len(lines) < LINES:
+        lines.append(f'i32 f{n}(i32 a, f64* b) {{')
+        lines.append(f'    // line comment {n}')
+        lines.append(f'    var s = a * 0x{n:x} + {n}i64 - b[{n % 7}] / 2.5f32;')
+        lines.append(f'    if (s >= {n} && s != 0) {{ return s << 2; }}')
+        lines.append(f'    /* block')
+        lines.append(f'       comment */ var c = \'x\'; var t = "str {n}\\n";')
+        lines.append(f'    return a;')
+        lines.append('}')
+        n += 1
+    return '\n'.join(lines[:LINES]) + '\n'
+
+
+def gen_table() -> str:
+    # machine-generated array literal, one line per row
+    row = ', '.join(str(i) for i in range(16))
+    return 'package table;\n' + ''.join(f'    {row},\n' for _ in range(LINES))
+
+
+def run(lexer, data: str) -> int:
+    lexer.lineno = 0
+    lexer.input(data)
+    count = 0
+    while lexer.token():
+        count += 1
+    return count
+
+
+def measure(lexer, data: str) -> float:
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        run(lexer, data)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    l = Lexer()
+    l.build()
+    for name, data in [('code', gen_code()), ('table', gen_table())]:
+        tokens = run(l.lexer, data)
+        assert tokens == run(StreamLexer(), data)
+        ply_time = measure(l.lexer, data)
+        stream_time = measure(StreamLexer(), data)
+        print(f"{name:6} {tokens:8} tokens  ply {ply_time:7.3f} s  stream {stream_time:7.3f} s  "
+              f"x{ply_time / stream_time:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# analysis of generic-heavy code: serial vs function bodies in worker processes
+import contextlib
+import io
+import os
+import sys
+import time
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from codegen2 import gen_c_code
+from bench_templates import gen_source, MAIN
+
+
+def measure(sources: List[str], workers: int) -> Tuple[float, str]:
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(sources, storage, workers=1)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid = storage.is_valid(workers=workers)
+    t = time.perf_counter() - start
+    assert valid
+    return t, gen_c_code(storage, eliminate_dead_code=False)
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    sources = read_sources('./build-in') + [gen_source() + MAIN]
+    print(f"{os.cpu_count()} cpus")
+
+    serial, code = measure(sources, 1)
+    print(f"workers=1: {serial:8.3f} s")
+    for workers in sorted({2, 4, os.cpu_count() or 1} - {1}):
+        t, parallel_code = measure(sources, workers)
+        assert parallel_code == code
+        print(f"workers={workers}: {t:8.3f} s  speedup {serial / t:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# front end on a generated project: one process vs process pool
+import os
+import sys
+import time
+
+from helpers2 import *
+from frontend import parse_all
+
+FILES = 200
+FUNCTIONS = 40
+
+TEMPLATE = '''
+struct point{n}_{i}<T> {{
+    internal T x;
+    internal T y;
+}}
+
+point{n}_{i}<T> point{n}_{i}<T>(T x, T y) {{
+    return point{n}_{i}<T> {{x, y}};
+}}
+
+T sum{n}_{i}<T>(point{n}_{i}<T>* p) {{
+    var s = p.x + p.y;
+    if (s > 0) {{
+        return s;
+    }}
+    return p.x - p.y;
+}}
+'''
+
+
+def gen_sources() -> List[str]:
+    sources = []
+    for n in range(FILES):
+        s = f'package gen{n};\n\nusing std;\n'
+        for i in range(FUNCTIONS):
+            s += TEMPLATE.format(n=n, i=i)
+        sources.append(s)
+    return sources
+
+
+def measure(sources: List[str], workers: int) -> float:
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    start = time.perf_counter()
+    parse_all(sources, storage, workers=workers)
+    return time.perf_counter() - start
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    sources = gen_sources()
+    lines = sum(s.count('\n') for s in sources)
+    print(f"{FILES} files, {lines} lines, {os.cpu_count()} cpus")
+
+    serial = measure(sources, 1)
+    print(f"workers=1: {serial:8.3f} s")
+    for workers in sorted({2, 4, os.cpu_count() or 1} - {1}):
+        t = measure(sources, workers)
+        print(f"workers={workers}: {t:8.3f} s  speedup {serial / t:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
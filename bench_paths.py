@@ -0,0 +1,71 @@
+# package resolution with the old hash-on-every-call Path vs interned Path
+import time
+
+from helpers2 import hash_faq6, Path
+
+PACKAGES = 100
+LOOKUPS = 500
+
+
+class LegacyPath:
+    def __init__(self, nodes):
+        self.nodes = nodes.copy()
+
+    def __hash__(self):
+        return hash_faq6(["path"] + self.nodes)
+
+    def __add__(self, other):
+        return LegacyPath(self.nodes + other.nodes)
+
+    def __eq__(self, other):
+        return hash(self) == hash(other)
+
+
+def resolve(packages, by_path, imports, path):
+    # what packages_by_path does for one lookup: direct, package relative and every import
+    trace_from = packages[0]
+    found = []
+    for p in [path, trace_from + path] + [i + path for i in imports]:
+        if trace_from == p:
+            found.append(trace_from)
+            continue
+        for other in packages:
+            if other == p:
+                found.append(other)
+                break
+    return found
+
+
+def resolve_dict(packages, by_path, imports, path):
+    trace_from = packages[0]
+    found = []
+    for p in [path, trace_from + path] + [i + path for i in imports]:
+        pack = trace_from if trace_from == p else by_path.get(p)
+        if pack is not None:
+            found.append(pack)
+    return found
+
+
+def measure(path_cls, lookup) -> float:
+    packages = [path_cls(['project', f'module{i}']) for i in range(PACKAGES)]
+    imports = [path_cls(['std']), path_cls(['std', 'collections']), path_cls(['project'])]
+    by_path = {p: p for p in packages}
+    wanted = [path_cls([f'module{i % PACKAGES}']) for i in range(LOOKUPS)]
+    start = time.perf_counter()
+    for path in wanted:
+        lookup(packages, by_path, imports, path)
+    return time.perf_counter() - start
+
+
+def main():
+    legacy = measure(LegacyPath, resolve)
+    interned = measure(Path, resolve)
+    interned_dict = measure(Path, resolve_dict)
+    print(f"{LOOKUPS} lookups among {PACKAGES} packages")
+    print(f"legacy Path, scan:    {legacy:8.3f} s")
+    print(f"interned Path, scan:  {interned:8.3f} s  x{legacy / interned:.1f}")
+    print(f"interned Path, dict:  {interned_dict:8.3f} s  x{legacy / interned_dict:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# answers of the query engine against the whole pipeline, on generic-heavy code with one function edited
+import contextlib
+import io
+import os
+import sys
+import time
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from queries import QueryEngine
+from bench_templates import gen_source, MAIN
+
+NAME = 'gen.fl'
+
+
+def pipeline(sources: List[str]) -> float:
+    start = time.perf_counter()
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(sources, storage, workers=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert storage.is_valid()
+    return time.perf_counter() - start
+
+
+def timed(name: str, engine: QueryEngine, query: Callable[[], Any]) -> Any:
+    checks = engine.executions.get('check', 0)
+    start = time.perf_counter()
+    value = query()
+    t = time.perf_counter() - start
+    print(f"{name:28}: {t * 1000:9.2f} ms, {engine.executions.get('check', 0) - checks} functions analyzed")
+    return value
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    source = gen_source() + MAIN
+    edited = source.replace('point<i32>(7);', 'point<i32>(8);', 1)
+    assert edited != source
+
+    print(f"{'whole pipeline':28}: {pipeline(read_sources('./build-in') + [source]) * 1000:9.2f} ms")
+
+    engine = QueryEngine()
+    for n in sorted(os.listdir('./build-in')):
+        with open(os.path.join('./build-in', n)) as file:
+            engine.set_source(n, file.read())
+    engine.set_source(NAME, source)
+
+    assert timed('check f0, cold', engine, lambda: engine.check(NAME, 'gen:f0()'))[0]
+    timed('check f0, again', engine, lambda: engine.check(NAME, 'gen:f0()'))
+    raw = RawType(Path([]), 'point', 0, [RawType(Path([]), 'i64', 0, [])])
+    timed('resolve point<i64>', engine, lambda: engine.resolve_type(raw, NAME))
+
+    engine.set_source(NAME, edited)
+    assert timed('check f0, f7 edited', engine, lambda: engine.check(NAME, 'gen:f0()'))[0]
+    assert timed('check f7, f7 edited', engine, lambda: engine.check(NAME, 'gen:f7()'))[0]
+    timed('resolve point<i64>, edited', engine, lambda: engine.resolve_type(raw, NAME))
+
+
+if __name__ == '__main__':
+    main()
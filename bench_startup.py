@@ -0,0 +1,58 @@
+# time-to-first-parse of a fresh interpreter, frozen tables vs FATLANG_PARSER_DEBUG=1
+import os
+import subprocess
+import sys
+import time
+
+RUNS = 10
+
+FIRST_PARSE = '''
+from helpers2 import *
+from parser3 import parse
+storage = GlobalStorage()
+storage.add_package(BUILD_IN_PACK)
+with open('./src/other.fl', 'r') as file:
+    parse(file.read(), storage)
+'''
+
+
+def measure(env: dict) -> float:
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', FIRST_PARSE], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    bare = measure_interpreter()
+
+    env = dict(os.environ)
+    env.pop('FATLANG_PARSER_DEBUG', None)
+    fast = measure(env)
+
+    env['FATLANG_PARSER_DEBUG'] = '1'
+    debug = measure(env)
+
+    print(f"interpreter only:   {bare * 1000:8.1f} ms")
+    print(f"frozen tables:      {fast * 1000:8.1f} ms")
+    print(f"debug tables:       {debug * 1000:8.1f} ms")
+    print(f"compiler overhead:  {(fast - bare) * 1000:8.1f} ms vs {(debug - bare) * 1000:8.1f} ms")
+
+
+def measure_interpreter() -> float:
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# "did you mean" suggestions of a broken build: name index against fuzz.ratio over every visible symbol
+import contextlib
+import io
+import random
+import sys
+import time
+
+from fuzzywuzzy import fuzz
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+
+FUNCTIONS = 2000
+STRUCTS = 200
+ERRORS = 300
+
+WORDS = ['get', 'set', 'read', 'write', 'value', 'buffer', 'node', 'tree', 'list', 'count', 'size', 'next',
+         'parse', 'token', 'item', 'index', 'find', 'update', 'create', 'destroy', 'copy', 'move', 'length']
+
+
+def gen_name(rnd: random.Random) -> str:
+    return ''.join(w.capitalize() if i else w for i, w in enumerate(rnd.sample(WORDS, rnd.randint(2, 3))))
+
+
+def typo(rnd: random.Random, name: str) -> str:
+    i = rnd.randrange(len(name))
+    return name[:i] + name[i + 1:]
+
+
+def gen_source() -> str:
+    rnd = random.Random(1)
+    functions = sorted({gen_name(rnd) for _ in range(FUNCTIONS)})
+    structs = sorted({gen_name(rnd).capitalize() for _ in range(STRUCTS)})
+    src = 'package broken;\n\nusing std;\n\n'
+    src += ''.join(f'struct {s} {{\n    internal i32 v;\n}}\n\n' for s in structs)
+    src += ''.join(f'i32 {f}(i32 a) {{\n    return a;\n}}\n\n' for f in functions)
+    src += 'i32 main() {\n'
+    for n in range(ERRORS):
+        if n % 2:
+            src += f'    {typo(rnd, rnd.choice(structs))} v{n} = 1;\n'
+        else:
+            src += f'    var v{n} = {typo(rnd, rnd.choice(functions))}({n});\n'
+    return src + '    return 0;\n}\n'
+
+
+def scan_functions(name: str, current_package: Package) -> List[FunctionData]:
+    return [f for f in functions_by_path(Path([]), current_package) if fuzz.ratio(name, f.name) >= MIN_SAME_RATIO]
+
+
+def scan_structs(name: str, package: Package) -> List[StructData]:
+    return [s for s in structs_by_path(Path([]), package) if fuzz.ratio(name, s.name) >= MIN_SAME_RATIO]
+
+
+def measure(sources: List[str]) -> Tuple[float, str]:
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(sources, storage, workers=1)
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        storage.is_valid()
+    return time.perf_counter() - start, out.getvalue()
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    sources = read_sources('./build-in') + [gen_source()]
+
+    indexed, indexed_out = measure(sources)
+    module = sys.modules['helpers2']
+    functions, structs = module.find_same_functions, module.find_same_structs
+    module.find_same_functions, module.find_same_structs = scan_functions, scan_structs
+    try:
+        scanned, scanned_out = measure(sources)
+    finally:
+        module.find_same_functions, module.find_same_structs = functions, structs
+
+    assert indexed_out == scanned_out
+    print(f"{FUNCTIONS} functions, {STRUCTS} structs, {indexed_out.count('Do you mean')} suggestions")
+    print(f"scan:  {scanned:8.3f} s")
+    print(f"index: {indexed:8.3f} s  x{scanned / indexed:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# analysis of generic-heavy code with and without the instantiation cache
+import contextlib
+import io
+import sys
+import time
+
+import helpers2
+from helpers2 import *
+from frontend import parse_all, read_sources
+
+FUNCTIONS = 300
+
+HEADER = '''package gen;
+
+using std;
+using std:box;
+
+struct point<T> {
+    internal T x;
+}
+
+point<T> point<T>(T x) {
+    return point<T> {x};
+}
+
+T getX<T>(point<T>* p) {
+    return p.x;
+}
+'''
+
+# for benches that generate C, gen_c_code starts from main
+MAIN = '''
+i32 main() {
+    return f0();
+}
+'''
+
+FUNCTION = '''
+i32 f{n}() {{
+    var p = point<i32>({n});
+    var q = point<i64>({n}i64);
+    var b = box<i32>(p.getX());
+    var c = box<i64>(q.getX());
+    return b.getValue() + p.getX();
+}}
+'''
+
+
+def gen_source() -> str:
+    return HEADER + ''.join(FUNCTION.format(n=n) for n in range(FUNCTIONS))
+
+
+def measure(sources: List[str]) -> Tuple[float, GlobalStorage]:
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(sources, storage, workers=1)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid = storage.is_valid()
+    assert valid
+    return time.perf_counter() - start, storage
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    sources = read_sources('./build-in') + [gen_source()]
+
+    cached, storage = measure(sources)
+    instantiate = helpers2.instantiate
+    helpers2.instantiate = lambda src, templates, create: create(templates)
+    try:
+        uncached, _ = measure(sources)
+    finally:
+        helpers2.instantiate = instantiate
+
+    print(f"{FUNCTIONS} functions, {storage.instantiation_hits} hits, {storage.instantiation_misses} misses")
+    print(f"without cache: {uncached:8.3f} s")
+    print(f"with cache:    {cached:8.3f} s  x{uncached / cached:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import sys
+
+from helpers2 import *
+from parse_cache import gen_salt
+from reachability import data_packages, function_callees, function_types
+
+DB_FORMAT = '1'
+
+# records are dropped when any of this modules changes
+_SALT_SOURCES = ['helpers2.py', 'parser3.py', 'lexer.py', 'codegen2.py', 'reachability.py', 'build_db.py']
+
+# A record of a function is reused when the function has the same source at the same place, package
+# lookups made for it give the same packages and interfaces of packages it depends on are the same.
+# Its body isn't analyzed then: applied datas it tried to register are registered again at its place
+# in order of functions, and its C fragment is taken as it was generated.
+# Offsets are part of generated names, so an edit invalidates functions after it in the same file.
+
+PackageKey = Tuple[Path, int]
+DataRef = tuple
+TypeRef = tuple
+
+
+class FunctionRecord:
+    def __init__(self, lookups: Dict[Tuple[PackageKey, Path], List[PackageKey]], interfaces: Dict[PackageKey, str],
+                 applied: List[DataRef], callees: List[DataRef], types: List[TypeRef], output: str,
+                 fragment: Tuple[str, str]):
+        self.lookups = lookups
+        self.interfaces = interfaces
+        self.applied = applied
+        self.callees = callees
+        self.types = types
+        self.output = output
+        self.fragment = fragment
+
+
+def _data_ref(d: Data) -> DataRef:
+    if isinstance(d, AppliedFunctionData):
+        return 'applied', _data_ref(d.src_function), tuple([_type_ref(t) for t in d.applied_templates])
+    elif isinstance(d, AppliedStructData):
+        return 'applied', _data_ref(d.src_sd), tuple([_type_ref(t) for t in d.applied_templates])
+    elif isinstance(d, FunctionData):
+        return 'function', d.hash
+    elif isinstance(d, StructData):
+        return 'struct', d.hash
+    raise ValueError(d)
+
+
+def _type_ref(t: TypeData) -> TypeRef:
+    return _data_ref(t.data), t.pointer_level, t.raw.pointer_level, t.is_const
+
+
+def _package_keys(storage: GlobalStorage) -> Dict[Package, PackageKey]:
+    # packages can share a path, the first one with it is looked up
+    keys: Dict[Package, PackageKey] = {}
+    counts: Dict[Path, int] = {}
+    for p in storage.all_packages:
+        n = counts.get(p.path, 0)
+        counts[p.path] = n + 1
+        keys[p] = (p.path, n)
+    return keys
+
+
+def interface_lines(p: Package, structs: List[StructDeclaration], functions: List[FunctionDeclaration]) -> List[str]:
+    # what analysis of a body sees of a package: imports, structs with fields and signatures
+    lines = [f"import {i}" for i in p.imports] + [f"struct {s}" for s in p.struct_datas]
+    for s in structs:
+        fields = ','.join([f"{m} {t} {n}" for m, t, n in s.fields])
+        lines.append(f"declaration {s.data} {s.data.hash} {s.is_extern()} {fields}")
+    for f in functions:
+        d = f.data
+        lines.append(f"function {d} {d.type} {d.hash} {d.is_safe} {f.is_extern()}")
+    return lines
+
+
+def _interfaces(storage: GlobalStorage, keys: Dict[Package, PackageKey]) -> Dict[PackageKey, str]:
+    structs: Dict[Package, List[StructDeclaration]] = {p: [] for p in storage.all_packages}
+    functions: Dict[Package, List[FunctionDeclaration]] = {p: [] for p in storage.all_packages}
+    for s in storage.struct_declarations:
+        structs[s.data.package].append(s)
+    for f in storage.function_declarations:
+        functions[f.data.package].append(f)
+    return {keys[p]: hashlib.sha256('\n'.join(interface_lines(p, structs[p], functions[p])).encode()).hexdigest()
+            for p in storage.all_packages}
+
+
+class BuildDatabase:
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, 'functions.pkl')
+        self.salt = gen_salt(DB_FORMAT, _SALT_SOURCES)
+        self.records: Dict[str, FunctionRecord] = self._load()
+        self.hits = 0
+        self.misses = 0
+
+        self.storage: Optional[GlobalStorage] = None
+        self.package_keys: Dict[Package, PackageKey] = {}
+        self.packages: Dict[PackageKey, Package] = {}
+        self.interfaces: Dict[PackageKey, str] = {}
+        # lookups of validate_types by requesting package, signatures and declared types depend on them
+        self.signature_lookups: Dict[Package, Set[Tuple[Package, Path]]] = {}
+        self.datas: Dict[DataRef, Data] = {}
+
+        self.keys: Dict[FunctionDeclaration, str] = {}
+        self.reusable: Dict[FunctionDeclaration, FunctionRecord] = {}
+        self.reused: Dict[FunctionDeclaration, FunctionRecord] = {}
+        # function -> output, applied datas and lookups of its analysis
+        self.analyzed: Dict[FunctionDeclaration, Tuple[str, List[Data], Set[Tuple[Package, Path]]]] = {}
+        self.fragments: Dict[FunctionDeclaration, Tuple[str, str]] = {}
+
+    def _load(self) -> Dict[str, FunctionRecord]:
+        try:
+            with open(self.path, 'rb') as file:
+                salt, records = pickle.load(file)
+        except Exception:
+            # no database yet or a broken one, it'll be written again
+            return {}
+        return records if salt == self.salt else {}
+
+    def _key(self, f: FunctionDeclaration) -> Optional[str]:
+        p = f.data.package
+        if f.is_template() or f.is_extern() or f.position is None or p.sources is None:
+            return None
+        start, end = pos_start(f.position), pos_end(f.position)
+        path, n = self.package_keys[p]
+        h = hashlib.sha256(self.salt)
+        h.update(f"{path}/{n}:{start}:{end}\n".encode())
+        h.update(p.sources[start:end + 1].encode())
+        return h.hexdigest()
+
+    def prepare(self, storage: GlobalStorage, lookups: Set[Tuple[Package, Path]]):
+        # types are resolved, bodies aren't analyzed yet
+        self.storage = storage
+        # records can't refer to packages of another storage
+        drop_foreign_arr_types(storage)
+        self.package_keys = _package_keys(storage)
+        self.packages = {k: p for p, k in self.package_keys.items()}
+        self.interfaces = _interfaces(storage, self.package_keys)
+        self.signature_lookups = {}
+        for key in lookups:
+            self.signature_lookups.setdefault(key[0], set()).add(key)
+        self.datas = {}
+        for p in storage.all_packages:
+            for d in p.function_datas:
+                self.datas.setdefault(('function', d.hash), d)
+            for d in p.struct_datas:
+                self.datas.setdefault(('struct', d.hash), d)
+
+        for f in storage.function_declarations:
+            key = self._key(f)
+            if key is None:
+                continue
+            self.keys[f] = key
+            record = self.records.get(key)
+            if record is not None and self._is_up_to_date(record):
+                self.reusable[f] = record
+
+    def _is_up_to_date(self, record: FunctionRecord) -> bool:
+        for k, interface in record.interfaces.items():
+            if self.interfaces.get(k) != interface:
+                return False
+        for (trace, path), packs in record.lookups.items():
+            p = self.packages.get(trace)
+            if p is None or [self.package_keys[i] for i in self.storage.resolve_packages(path, p)] != packs:
+                return False
+        return True
+
+    def _data(self, ref: DataRef) -> Data:
+        if ref[0] == 'applied':
+            return self._data(ref[1]).apply_template([self._type(t) for t in ref[2]])
+        return self.datas[ref]
+
+    def _type(self, ref: TypeRef) -> TypeData:
+        data_ref, pointer_level, raw_pointer_level, is_const = ref
+        data = self._data(data_ref)
+        templates = data.applied_templates if isinstance(data, AppliedStructData) else []
+        t = TypeData.new_data(data, pointer_level, templates, is_const)
+        if t.raw.pointer_level != raw_pointer_level:
+            t = t.copy()
+            t.raw.pointer_level = raw_pointer_level
+        return t
+
+    def _replay(self, record: FunctionRecord) -> bool:
+        for ref in record.applied:
+            try:
+                d = self._data(ref)
+            except KeyError:
+                # what isn't there anymore is registered by analysis
+                return False
+            if d.hash not in d.package.applied_hashes:
+                d.package.register(d)
+        return True
+
+    def is_reusable(self, f: FunctionDeclaration) -> bool:
+        return f in self.reusable
+
+    def analyze(self, f: FunctionDeclaration) -> bool:
+        if f not in self.keys:
+            return f.is_valid()
+        record = self.reusable.get(f)
+        if record is not None and self._replay(record):
+            self.hits += 1
+            self.reused[f] = record
+            sys.stdout.write(record.output)
+            return True
+
+        storage = self.storage
+        storage.applied_log, storage.lookup_log = [], set()
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                valid = f.is_valid()
+        finally:
+            applied, lookups = storage.applied_log, storage.lookup_log
+            storage.applied_log, storage.lookup_log = None, None
+            sys.stdout.write(out.getvalue())
+        self.record(f, valid, out.getvalue(), applied, lookups)
+        return valid
+
+    def record(self, f: FunctionDeclaration, valid: bool, output: str, applied: List[Data],
+               lookups: Set[Tuple[Package, Path]]):
+        if f not in self.keys:
+            return
+        self.misses += 1
+        if valid:
+            self.analyzed[f] = (output, applied, lookups)
+
+    def callees(self, f: FunctionDeclaration) -> List[FunctionData]:
+        record = self.reused.get(f)
+        if record is None:
+            return function_callees(f)
+        return [self._data(ref) for ref in record.callees]
+
+    def types(self, f: FunctionDeclaration) -> List[TypeData]:
+        record = self.reused.get(f)
+        if record is None:
+            return function_types(f)
+        return [self._type(ref) for ref in record.types]
+
+    def fragment(self, f: FunctionDeclaration) -> Optional[Tuple[str, str]]:
+        record = self.reused.get(f)
+        return record.fragment if record is not None else None
+
+    def needs_fragment(self, f: FunctionDeclaration) -> bool:
+        return f in self.analyzed and f not in self.fragments
+
+    def add_fragment(self, f: FunctionDeclaration, fragment: Tuple[str, str]):
+        if f in self.analyzed:
+            self.fragments[f] = fragment
+
+    def _new_record(self, f: FunctionDeclaration, output: str, applied: List[Data],
+                    lookups: Set[Tuple[Package, Path]], fragment: Tuple[str, str]) -> Optional[FunctionRecord]:
+        callees = function_callees(f)
+        types = function_types(f)
+        if any([t.is_raw() for t in types]):
+            return None
+        lookups = lookups | self.signature_lookups.get(f.data.package, set())
+
+        packages: Set[Package] = {f.data.package}
+        record_lookups: Dict[Tuple[PackageKey, Path], List[PackageKey]] = {}
+        for trace, path in lookups:
+            packs = self.storage.resolve_packages(path, trace)
+            record_lookups[(self.package_keys[trace], path)] = [self.package_keys[p] for p in packs]
+            packages.add(trace)
+            packages.update(packs)
+        for d in applied + callees + [t.data for t in types]:
+            packages.update(data_packages(d))
+        interfaces = {self.package_keys[p]: self.interfaces[self.package_keys[p]] for p in packages}
+
+        return FunctionRecord(record_lookups, interfaces, [_data_ref(d) for d in applied],
+                              [_data_ref(c) for c in callees], [_type_ref(t) for t in types], output, fragment)
+
+    def save(self):
+        # records of functions which aren't in this build anymore are dropped
+        records = {self.keys[f]: r for f, r in self.reused.items()}
+        for f, (output, applied, lookups) in self.analyzed.items():
+            fragment = self.fragments.get(f)
+            if fragment is None:
+                continue
+            record = self._new_record(f, output, applied, lookups, fragment)
+            if record is not None:
+                records[self.keys[f]] = record
+        try:
+            data = pickle.dumps((self.salt, records), pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, self.path)
+        self.records = records
@@ -1,18 +1,35 @@
 from helpers2 import *
+from reachability import Reachability, function_callees, function_types
 
 STORAGE: Optional[GlobalStorage] = None
 
+# build-in types declared in gcc_gens/std.h
+STD_H_TYPES = {'i32', 'ui32', 'i64', 'ui64', 'usize', 'void', 'f32', 'f64', 'char', 'bool'}
+
+# mangled C name -> symbol it was generated for
+_symbols: Dict[str, str] = {}
+
+
+def _mangle(d: Union[FunctionData, StructData]) -> str:
+    # registration catches equal hashes, names of different kinds of symbols can be the same still
+    name = f"{d.name}_H{d.str_hash()}"
+    key = symbol_key(d)
+    first = _symbols.setdefault(name, key)
+    if first != key:
+        raise SymbolCollisionException(first, key, f"C name {name}")
+    return name
+
 
 def gen_func_name(f: Union[FunctionData, FunctionDeclaration]) -> str:
     if isinstance(f, FunctionDeclaration):
         if f.is_extern():
             return f.data.name
         else:
-            return f"{f.data.name}_H{f.data.str_hash()}"
+            return _mangle(f.data)
     elif isinstance(f, FunctionData):
         fd = STORAGE.get_declaration_by_data(f)
         if not fd.is_extern():
-            return f"{f.name}_H{f.str_hash()}"
+            return _mangle(f)
         else:
             return f.name
     else:
@@ -26,11 +43,11 @@ def gen_type_name(t: [TypeData, StructData]) -> str:
         sd = STORAGE.get_declaration_by_data(t)
         if sd:
             if not sd.is_extern():
-                return f"{t.name}_H{t.str_hash()}"
+                return _mangle(t)
             else:
                 return f"struct {t.name}"
         else:
-            return f"{t.name}_H{t.str_hash()}"
+            return _mangle(t)
     else:
         raise ValueError(t)
 
@@ -130,7 +147,7 @@ def gen_expr(expr: Expression) -> str:
         n = str(expr.type)
         return f'({gen_type_name(get_char_arr_t())}){{"{n}",{len(n) - 1}}}'
     elif isinstance(expr, ArrayCreationExpression):
-        n = f"A{expr.function_body.function.data.package.path.str_hash()}_{''.join([str(i) for i in expr.position])}"
+        n = f"A{expr.function_body.function.data.package.path.str_hash()}_{pos_start(expr.position):x}_{pos_end(expr.position):x}"
         global_additive += f"const {gen_type_name(expr.exprs[0].get_out_type())} {n}[]={{{','.join([gen_expr(e) for e in expr.exprs])}}};\n"
         return f"({gen_type_name(expr.get_out_type())}){{ {n}, {len(expr.exprs)} }}"
     elif isinstance(expr, VariableDestroyExpression):
@@ -160,10 +177,38 @@ def gen_function_declaration(f: FunctionDeclaration) -> str:
     return header + "{" + ';'.join(body) + ";};\n"
 
 
-def gen_c_code(storage: GlobalStorage):
+def gen_function_fragment(f: FunctionDeclaration) -> Tuple[str, str]:
+    # definition of the function and global arrays it adds
+    global global_additive
+    additive, global_additive = global_additive, ''
+    try:
+        return gen_function_declaration(f), global_additive
+    finally:
+        global_additive = additive
+
+
+def gen_c_code(storage: GlobalStorage, eliminate_dead_code: bool = True, build: Optional['BuildDatabase'] = None):
+    # build database gives fragments of functions it didn't analyze again and gets new ones
     global STORAGE, global_additive
     global_additive = ''
     STORAGE = storage
+    _symbols.clear()
+
+    main_f: Optional[FunctionDeclaration] = None
+    for i in storage.function_declarations:
+        if i.data.name == "main":
+            main_f = i
+            break
+
+    # only what main can reach is generated
+    callees, types = (build.callees, build.types) if build is not None else (function_callees, function_types)
+    reach = Reachability(storage, callees, types).run([main_f]) if eliminate_dead_code and main_f else None
+
+    def is_struct_used(s: StructDeclaration) -> bool:
+        return reach is None or reach.is_struct_reachable(s)
+
+    def is_function_used(f: FunctionDeclaration) -> bool:
+        return reach is None or reach.is_function_reachable(f)
 
     _generated_structs: List[Union[StructData, AppliedStructData]] = []
 
@@ -174,23 +219,27 @@ def gen_c_code(storage: GlobalStorage):
     for s in storage.struct_declarations:
         if not s.is_extern():
             if not s.is_template():
-                struct_definitions.append(gen_struct_definition(s))
+                if is_struct_used(s):
+                    struct_definitions.append(gen_struct_definition(s))
             else:
                 for a in storage.applied_struct_declarations[s]:
-                    struct_definitions.append(gen_struct_definition(a))
+                    if is_struct_used(a):
+                        struct_definitions.append(gen_struct_definition(a))
     for f in storage.function_declarations:
         if not f.is_extern():
             if not f.is_template():
-                function_definitions.append(gen_function_definition(f))
+                if is_function_used(f):
+                    function_definitions.append(gen_function_definition(f))
             else:
                 for a in storage.applied_function_declarations[f]:
-                    function_definitions.append(gen_function_definition(a))
+                    if is_function_used(a):
+                        function_definitions.append(gen_function_definition(a))
 
     # with generation order
     for s in storage.struct_declarations:
         if not s.is_extern():
             if not s.is_template():
-                if s.data not in _generated_structs:
+                if s.data not in _generated_structs and is_struct_used(s):
                     for _, t, _ in s.fields:
                         # struct A { A* a; }
                         if t.data != s.data and t.data not in _generated_structs and t.data not in BUILD_IN_PACK.struct_datas:
@@ -201,7 +250,7 @@ def gen_c_code(storage: GlobalStorage):
                     _generated_structs.append(s.data)
             else:
                 for a in storage.applied_struct_declarations[s]:
-                    if a.data not in _generated_structs:
+                    if a.data not in _generated_structs and is_struct_used(a):
                         for _, t, _ in a.fields:
                             if t.data != a.data and t.data not in _generated_structs and t.data not in BUILD_IN_PACK.struct_datas:
                                 decl = STORAGE.get_declaration_by_data(t.data).apply_template(t.templates)
@@ -210,21 +259,45 @@ def gen_c_code(storage: GlobalStorage):
                         struct_declarations.append(gen_struct_declaration(a))
                         _generated_structs.append(a.data)
 
+    def gen_function(f: FunctionDeclaration) -> str:
+        global global_additive
+        fragment = build.fragment(f) if build is not None else None
+        if fragment is None:
+            fragment = gen_function_fragment(f)
+            if build is not None:
+                build.add_fragment(f, fragment)
+        global_additive += fragment[1]
+        return fragment[0]
+
     for f in storage.function_declarations:
         if not f.is_extern():
             if not f.is_template():
-                function_declarations.append(gen_function_declaration(f))
+                if is_function_used(f):
+                    function_declarations.append(gen_function(f))
             else:
                 for a in storage.applied_function_declarations[f]:
-                    function_declarations.append(gen_function_declaration(a))
+                    if is_function_used(a):
+                        function_declarations.append(gen_function_declaration(a))
 
-    main_f: Optional[FunctionDeclaration] = None
-    for i in storage.function_declarations:
-        if i.data.name == "main":
-            main_f = i
-            break
     header = "#include \"all.h\"\n"
+    if SYMBOL_HASH != 'faq6':
+        # std.h has typedefs only for faq6 names of build-in types
+        for s in BUILD_IN_PACK.struct_datas:
+            if s.name in STD_H_TYPES:
+                header += f"typedef {s.name} {gen_type_name(s)};\n"
     main_f_str = f"\nint main(){{return {gen_func_name(main_f.data)}();}}"
 
+    if build is not None:
+        # unused functions are kept in the database too, their symbols don't take part in collisions
+        symbols = dict(_symbols)
+        for f in storage.function_declarations:
+            if not f.is_extern() and not f.is_template() and not is_function_used(f) and build.needs_fragment(f):
+                try:
+                    build.add_fragment(f, gen_function_fragment(f))
+                except SymbolCollisionException:
+                    pass
+        _symbols.clear()
+        _symbols.update(symbols)
+
     return header + ''.join(struct_definitions) + ''.join(struct_declarations) + global_additive + ''.join(
         function_definitions) + ''.join(function_declarations) + main_f_str
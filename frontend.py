@@ -0,0 +1,65 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers2 import *
+from parser3 import ParserSession
+from parse_cache import ParseCache, PackageSnapshot
+
+# less files than that are parsed faster than the pool starts
+MIN_PARALLEL_FILES = 8
+
+
+def _parse_worker(source: str) -> Optional[bytes]:
+    session = ParserSession()
+    session.parse(source)
+    try:
+        return pickle.dumps(session.snapshot(), pickle.HIGHEST_PROTOCOL)
+    except RecursionError:
+        # too deep to ship back, main process parses it by itself
+        return None
+
+
+def read_sources(directory: str) -> List[str]:
+    sources = []
+    for i in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, i), 'r') as file:
+            sources.append(file.read())
+    return sources
+
+
+def parse_all(sources: List[str], storage: GlobalStorage, cache: Optional[ParseCache] = None,
+              workers: Optional[int] = None) -> List[Package]:
+    # packages are added to storage in order of sources, no matter which worker was first
+    snapshots: List[Optional[PackageSnapshot]] = [None] * len(sources)
+    missed = []
+    for n, source in enumerate(sources):
+        if cache is not None:
+            snapshots[n] = cache.load(source)
+        if snapshots[n] is None:
+            missed.append(n)
+    missed_set = set(missed)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and len(missed) >= MIN_PARALLEL_FILES:
+        with ProcessPoolExecutor(min(workers, len(missed))) as pool:
+            chunksize = max(1, len(missed) // (workers * 4))
+            results = pool.map(_parse_worker, [sources[n] for n in missed], chunksize=chunksize)
+            for n, data in zip(missed, results):
+                if data is not None:
+                    snapshots[n] = pickle.loads(data)
+
+    packs = []
+    for n, source in enumerate(sources):
+        snapshot = snapshots[n]
+        if snapshot is None:
+            session = ParserSession(storage)
+            packs.append(session.parse(source))
+            snapshot = session.snapshot()
+        else:
+            packs.append(snapshot.install(storage))
+        if cache is not None and n in missed_set:
+            cache.store(source, snapshot)
+    return packs
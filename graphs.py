@@ -0,0 +1,159 @@
+import json
+
+from helpers2 import *
+from reachability import DeclarationIndex, function_callees
+
+
+class Graph:
+    # nodes are declarations by hash of their data, edges are counted: caller -> callee -> calls count
+    def __init__(self):
+        self.nodes: Dict[int, Declaration] = {}
+        self.edges: Dict[int, Dict[int, int]] = {}
+        self.reverse_edges: Dict[int, Dict[int, int]] = {}
+
+    def add_node(self, d: Declaration):
+        h = d.data.hash
+        if h not in self.nodes:
+            self.nodes[h] = d
+            self.edges[h] = {}
+            self.reverse_edges[h] = {}
+
+    def add_edge(self, src: Declaration, dst: Declaration):
+        self.add_node(src)
+        self.add_node(dst)
+        s, d = src.data.hash, dst.data.hash
+        self.edges[s][d] = self.edges[s].get(d, 0) + 1
+        self.reverse_edges[d][s] = self.reverse_edges[d].get(s, 0) + 1
+
+    def successors(self, d: Declaration) -> List[Declaration]:
+        return [self.nodes[i] for i in self.edges.get(d.data.hash, {})]
+
+    def predecessors(self, d: Declaration) -> List[Declaration]:
+        return [self.nodes[i] for i in self.reverse_edges.get(d.data.hash, {})]
+
+    def count(self, src: Declaration, dst: Declaration) -> int:
+        return self.edges.get(src.data.hash, {}).get(dst.data.hash, 0)
+
+    def strongly_connected_components(self) -> List[List[Declaration]]:
+        # Tarjan's algorithm without recursion, components come callees first
+        index: Dict[int, int] = {}
+        low: Dict[int, int] = {}
+        on_stack: Set[int] = set()
+        stack: List[int] = []
+        components: List[List[Declaration]] = []
+
+        for root in self.nodes:
+            if root in index:
+                continue
+            work = [(root, iter(self.edges[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.edges[child])))
+                        break
+                    elif child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            i = stack.pop()
+                            on_stack.discard(i)
+                            component.append(self.nodes[i])
+                            if i == node:
+                                break
+                        components.append(component)
+        return components
+
+    def cycles(self) -> List[List[Declaration]]:
+        # components with more than one node or with an edge to itself
+        return [c for c in self.strongly_connected_components()
+                if len(c) > 1 or c[0].data.hash in self.edges[c[0].data.hash]]
+
+    def to_dot(self, name: str) -> str:
+        lines = [f'digraph {name} {{']
+        for h, d in self.nodes.items():
+            lines.append(f'    n{h} [label={json.dumps(str(d))}];')
+        for s, dsts in self.edges.items():
+            for d, n in dsts.items():
+                lines.append(f'    n{s} -> n{d}' + (f' [label="{n}"];' if n > 1 else ';'))
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'nodes': [{'id': h, 'name': str(d)} for h, d in self.nodes.items()],
+            'edges': [{'from': s, 'to': d, 'count': n} for s, dsts in self.edges.items() for d, n in dsts.items()],
+        }, indent=1)
+
+
+class CallGraph(Graph):
+    def __init__(self, storage: GlobalStorage,
+                 callees: Callable[[FunctionDeclaration], List[FunctionData]] = function_callees):
+        super().__init__()
+        index = DeclarationIndex(storage)
+        for f in self.function_declarations(storage):
+            self.add_node(f)
+            if f.is_extern():
+                continue
+            for c in callees(f):
+                decl = index.function_declaration(c)
+                if decl is not None:
+                    self.add_edge(f, decl)
+
+    @staticmethod
+    def function_declarations(storage: GlobalStorage) -> List[FunctionDeclaration]:
+        # templates have no checked bodies, their applied declarations are in graph instead
+        functions = []
+        for f in storage.function_declarations:
+            if f.is_template():
+                functions += storage.applied_function_declarations[f]
+            else:
+                functions.append(f)
+        return functions
+
+    def callers(self, f: FunctionDeclaration) -> List[FunctionDeclaration]:
+        return self.predecessors(f)
+
+    def callees(self, f: FunctionDeclaration) -> List[FunctionDeclaration]:
+        return self.successors(f)
+
+
+class StructGraph(Graph):
+    # struct -> structs of its fields
+    def __init__(self, storage: GlobalStorage):
+        super().__init__()
+        index = DeclarationIndex(storage)
+        for s in self.struct_declarations(storage):
+            self.add_node(s)
+            for _, t, _ in s.fields:
+                decl = index.struct_declaration(t.data) if isinstance(t, TypeData) and t.data else None
+                if decl is not None:
+                    self.add_edge(s, decl)
+
+    @staticmethod
+    def struct_declarations(storage: GlobalStorage) -> List[StructDeclaration]:
+        structs = []
+        for s in storage.struct_declarations:
+            if s.is_template():
+                structs += storage.applied_struct_declarations[s]
+            else:
+                structs.append(s)
+        return structs
+
+    def dependencies(self, s: StructDeclaration) -> List[StructDeclaration]:
+        return self.successors(s)
+
+    def dependents(self, s: StructDeclaration) -> List[StructDeclaration]:
+        return self.predecessors(s)
@@ -1,7 +1,13 @@
-from typing import List, Union, Tuple, Optional, Any, Dict
+from typing import List, Union, Tuple, Optional, Any, Dict, Callable, Set
+from bisect import bisect_right
+from collections import Counter
+from itertools import chain
+import hashlib
+import os
+import zlib
+from weakref import WeakValueDictionary
 import traceback
 import re
-from fuzzywuzzy import fuzz
 import settings as st
 
 settings = st.SettingsSwitch()
@@ -31,50 +37,103 @@ def hash_faq6(s):
     return hash & 0xFFFFFFFF
 
 
-def pos_hash(pos: Tuple[int, int, int, int]):
-    return hash_faq6([str(i) for i in pos])
+def _symbol_bytes(s) -> bytes:
+    # unlike faq6 parts are separated, so ['ab', 'c'] and ['a', 'bc'] differ
+    if isinstance(s, str):
+        return s.encode()
+    elif isinstance(s, list):
+        return '\x1f'.join(s).encode()
+    else:
+        raise ValueError
+
+
+def hash_blake2b(s):
+    return int.from_bytes(hashlib.blake2b(_symbol_bytes(s), digest_size=4).digest(), 'little')
+
+
+def hash_crc32(s):
+    return zlib.crc32(_symbol_bytes(s))
+
+
+# all hashes are 32 bit: they are the _H suffix of C names and typeid values.
+# faq6 keeps names of previous builds, others are faster. Choose it before anything is parsed
+SYMBOL_HASH_BACKENDS = {
+    'faq6': hash_faq6,
+    'blake2b': hash_blake2b,
+    'crc32': hash_crc32,
+}
+SYMBOL_HASH = os.environ.get('FATLANG_SYMBOL_HASH', 'faq6')
+_symbol_hash_backend = SYMBOL_HASH_BACKENDS[SYMBOL_HASH]
+_symbol_hashes: Dict[Union[str, Tuple[str, ...]], int] = {}
+
+
+def symbol_hash(s) -> int:
+    key = s if isinstance(s, str) else tuple(s)
+    h = _symbol_hashes.get(key)
+    if h is None:
+        h = _symbol_hash_backend(s)
+        _symbol_hashes[key] = h
+    return h
+
+
+# position is one int: start offset << 32 | end offset, where end is the offset of the last token.
+# It's always read together with the package of its file, lines are looked up in Package.line_of
+Position = int
+
+
+def make_pos(start: int, end: int) -> Position:
+    return (start << 32) | end
+
+
+def pos_start(pos: Position) -> int:
+    return (pos >> 32) & 0xFFFFFFFF
+
+
+def pos_end(pos: Position) -> int:
+    return pos & 0xFFFFFFFF
+
+
+def pos_hash(pos: Position):
+    return symbol_hash([str(pos_start(pos)), str(pos_end(pos))])
 
 
 def log_error(e: 'AnalyzerException', package: 'Package',
               object: Optional[Union['FunctionDeclaration', 'StructDeclaration']] = None):
     print("AnalyzerException at")
-    lines = package.get_source_fragment(e.pos()[1], e.pos()[3], e.pos()[0], e.pos()[2])
-    fragment = f'\t{e.pos()[0] - 1}--> ' + lines[0]
+    lines = package.get_source_fragment(e.pos())
+    line = package.line_of(pos_start(e.pos()))
+    fragment = f'\t{line - 1}--> ' + lines[0]
     for i, l in enumerate(lines[1:]):
-        fragment += f'\n\t{e.pos()[0] + i}--> ' + l
+        fragment += f'\n\t{line + i}--> ' + l
     if object is not None:
-        print(f"\t{e.str_pos()} -> {str(object)} -> {e.what()}")
+        print(f"\t{e.str_pos(package)} -> {str(object)} -> {e.what()}")
     else:
-        print(f"\t{e.str_pos()} -> {str(package.path)} -> {e.what()}")
+        print(f"\t{e.str_pos(package)} -> {str(package.path)} -> {e.what()}")
     print(fragment)
 
 
-def gen_variable_name(pos):
-    return f'GEN{pos[0]}{pos[1]}{pos[2]}{pos[3]}'
+def gen_variable_name(pos: Position):
+    return f'GEN{pos_start(pos):x}_{pos_end(pos):x}'
 
 
 def packages_by_path(path: 'Path', trace_from: 'Package') -> List['Package']:
-    packs = set()
-
-    def _get_package(path: Path):
-        if trace_from.path == path:
-            return trace_from
-        for p in trace_from.other_packages:
-            if p.path == path:
-                return p
-        return None
+    if trace_from.storage is None:
+        return [trace_from] if trace_from.path == path else []
+    return trace_from.storage.resolve_packages(path, trace_from)
 
-    p = _get_package(path)
-    if p:
-        packs.add(p)
-    p = _get_package(trace_from.path + path)
-    if p:
-        packs.add(p)
-    for i in trace_from.imports:
-        p = _get_package(i + path)
-        if p:
-            packs.add(p)
-    return list(packs)
+
+def functions_by_name(path: 'Path', current_package: 'Package', name: str, arity: int) -> List['FunctionData']:
+    functions = []
+    for p in packages_by_path(path, current_package):
+        functions += p.function_index.get((name, arity), [])
+    return functions
+
+
+def structs_by_name(path: 'Path', current_package: 'Package', name: str) -> List['StructData']:
+    structs = []
+    for p in packages_by_path(path, current_package):
+        structs += p.struct_index.get(name, [])
+    return structs
 
 
 def functions_by_path(path: 'Path', current_package: 'Package') -> List['FunctionData']:
@@ -97,46 +156,152 @@ def structs_by_path(path: 'Path', current_package: 'Package') -> List['StructDat
 MIN_SAME_RATIO = 67
 
 
+class NameIndex:
+    # inverted index: (letter, n) -> names with at least n such letters, so one query counts common letters
+    # of all names at once. Both SequenceMatcher and Levenshtein ratios are at most
+    # 2 * common letters / sum of lengths, fuzz.ratio is called only for names passing that bound
+    def __init__(self, names: List[str] = ()):
+        self.names: List[str] = []
+        self.lengths: List[int] = []
+        self.ids: Dict[str, int] = {}
+        self.postings: Dict[Tuple[str, int], List[int]] = {}
+        # query -> names with ratio >= MIN_SAME_RATIO, dropped when a name is added
+        self.matches: Dict[str, Set[str]] = {}
+        for name in names:
+            self.add(name)
+
+    @staticmethod
+    def _letters(name: str) -> List[Tuple[str, int]]:
+        counts: Dict[str, int] = {}
+        letters = []
+        for c in name:
+            counts[c] = counts.get(c, 0) + 1
+            letters.append((c, counts[c]))
+        return letters
+
+    def add(self, name: str):
+        if name in self.ids:
+            return
+        self.ids[name] = len(self.names)
+        for letter in self._letters(name):
+            self.postings.setdefault(letter, []).append(len(self.names))
+        self.names.append(name)
+        self.lengths.append(len(name))
+        self.matches = {}
+
+    def same(self, name: str) -> Set[str]:
+        matches = self.matches.get(name)
+        if matches is not None:
+            return matches
+        matches = set()
+        common = Counter(chain.from_iterable(self.postings.get(letter, ()) for letter in self._letters(name)))
+        for i, n in common.items():
+            other = self.names[i]
+            # ratio is rounded, 66.5 can become 67
+            if 200 * n >= (MIN_SAME_RATIO - 0.5) * (self.lengths[i] + len(name)):
+                # fuzzywuzzy is slow to import, it's needed only for error messages
+                from fuzzywuzzy import fuzz
+                if fuzz.ratio(name, other) >= MIN_SAME_RATIO:
+                    matches.add(other)
+        self.matches[name] = matches
+        return matches
+
+
+def _name_index(package: 'Package', structs: bool, datas: List[Union['FunctionData', 'StructData']]) -> NameIndex:
+    if package.storage is None:
+        return NameIndex([d.name for d in datas])
+    return package.storage.struct_name_index() if structs else package.storage.function_name_index()
+
+
 def find_same_functions(name: str, current_package: 'Package') -> List['FunctionData']:
-    same_list: List['FunctionData'] = []
     functions = functions_by_path(Path([]), current_package)
-    for f in functions:
-        if fuzz.ratio(name, f.name) >= MIN_SAME_RATIO:
-            same_list.append(f)
-
-    return same_list
+    same = _name_index(current_package, False, functions).same(name)
+    return [f for f in functions if f.name in same]
 
 
 def find_same_structs(name: str, package: 'Package') -> List['StructData']:
-    same_list: List['StructData'] = []
     structs = structs_by_path(Path([]), package)
-    for s in structs:
-        if fuzz.ratio(name, s.name) >= MIN_SAME_RATIO:
-            same_list.append(s)
-    return same_list
+    same = _name_index(package, True, structs).same(name)
+    return [s for s in structs if s.name in same]
+
+
+def _type_key(t: 'TypeData') -> Optional[Tuple[int, int, int, bool]]:
+    if t.is_raw():
+        return None
+    return t.hash, t.pointer_level, t.raw.pointer_level, t.is_const
+
+
+def instantiate(src: 'Data', templates: List['TypeData'], create: Callable[[List['TypeData']], 'Data']):
+    # the same template with the same types is applied only once per storage
+    storage = src.package.storage
+    if storage is None:
+        return create(templates)
+
+    keys = [_type_key(t) for t in templates]
+    if None in keys:
+        return create(templates)
+
+    key = (type(src), src.hash, tuple(keys))
+    applied = storage.instantiations.get(key)
+    if applied is None:
+        storage.instantiation_misses += 1
+        applied = create(templates)
+        storage.instantiations[key] = applied
+    else:
+        storage.instantiation_hits += 1
+    return applied
 
 
 def find_function(package: 'Package', path: 'Path', name: str, templates: List['TypeData'],
                   arg_types: List['TypeData'], allow_auto_pack=settings.get_current().allow_auto_pack):
+    storage = package.storage
+    if storage is None:
+        return _find_function(package, path, name, templates, arg_types, allow_auto_pack)
+
+    keys = [_type_key(t) for t in templates] + [_type_key(t) for t in arg_types]
+    if None in keys:
+        # raw types can be resolved differently later
+        return _find_function(package, path, name, templates, arg_types, allow_auto_pack)
+
+    key = (package, path, name, len(templates), tuple(keys), allow_auto_pack)
+    functions = storage.found_functions.get(key)
+    if functions is None:
+        storage.find_function_misses += 1
+        functions = _find_function(package, path, name, templates, arg_types, allow_auto_pack)
+        storage.found_functions[key] = functions
+    else:
+        storage.find_function_hits += 1
+    return functions[:]
+
+
+def _find_function(package: 'Package', path: 'Path', name: str, templates: List['TypeData'],
+                   arg_types: List['TypeData'], allow_auto_pack: bool):
     # TODO: fix cast
     fi = FunctionImage(name, arg_types, templates)
 
-    functions = functions_by_path(path, package)
+    # only overloads with the same name and arity can be equal to the image
+    functions = functions_by_name(path, package, name, len(arg_types))
 
     if allow_auto_pack:
         functions_1 = []
         for f in functions:
             if f.name == fi.name and len(f.arg_types) == len(fi.arg_types):
-
-                ts: List[TypeData] = [i.copy() for i in arg_types]
-                for t, ft in zip(ts, f.arg_types):
+                # arguments that are passed by pointer, without copying them
+                packed = 0
+                for i, (t, ft) in enumerate(zip(arg_types, f.arg_types)):
                     if t.pointer_level + 1 == ft.pointer_level if ft.pointer_level is not None else ft.raw.pointer_level:
-                        t.pointer_level += 1
-                        t.raw.pointer_level += 1
-                        t.gen_hash()
-
-                new_fi = FunctionImage(name, ts, templates)
-                if f == new_fi:
+                        packed |= 1 << i
+
+                m = f.match_image(name, templates, arg_types, packed)
+                if m is None:
+                    ts: List[TypeData] = [i.copy() for i in arg_types]
+                    for i, t in enumerate(ts):
+                        if packed >> i & 1:
+                            t.pointer_level += 1
+                            t.raw.pointer_level += 1
+                            t.gen_hash()
+                    m = f._eq_image(FunctionImage(name, ts, templates))
+                if m:
                     functions_1.append(f)
         return functions_1
     else:
@@ -148,40 +313,55 @@ def find_function(package: 'Package', path: 'Path', name: str, templates: List['
 
 
 class VisibilityStack:
+    # levels keep variables in order of registration, bindings are name -> variables of that name, innermost last
     def __init__(self):
-        self.levels: List[List[VariableData]] = []
+        self.levels: List[Dict[str, VariableData]] = []
+        self.bindings: Dict[str, List[VariableData]] = {}
 
     def push_level(self):
-        self.levels.append([])
+        self.levels.append({})
 
     def pop_level(self):
-        return self.levels.pop(-1)
+        level = self.levels.pop(-1)
+        for name in level:
+            self._unbind(name)
+        return list(level.values())
 
     def take_level(self):
-        return self.levels[-1][:]
+        return list(self.levels[-1].values())
+
+    def variables(self) -> List['VariableData']:
+        # innermost level first
+        return [v for level in reversed(self.levels) for v in level.values()]
 
     def register_variable(self, v: 'VariableData'):
-        if v not in self.levels[-1]:
-            self.levels[-1].append(v)
+        level = self.levels[-1]
+        if v.name not in level:
+            level[v.name] = v
+            self.bindings.setdefault(v.name, []).append(v)
         else:
             raise KeyError
 
     def find_variable(self, name) -> Optional['VariableData']:
-        for level in reversed(self.levels):
-            for v in level:
-                if v.name == name:
-                    return v
-        return None
+        chain = self.bindings.get(name)
+        return chain[-1] if chain else None
 
     def destroy_variable(self, name):
-        for v in self.levels[-1]:
-            if v.name == name:
-                self.levels[-1].remove(v)
-                return
-        raise ValueError
+        level = self.levels[-1]
+        if name not in level:
+            raise ValueError
+        del level[name]
+        self._unbind(name)
+
+    def _unbind(self, name):
+        chain = self.bindings[name]
+        chain.pop(-1)
+        if not chain:
+            del self.bindings[name]
 
     def clear(self):
         self.levels.clear()
+        self.bindings.clear()
 
 
 class PrintColor:
@@ -198,32 +378,53 @@ class PrintColor:
 
 
 class AnalyzerException(Exception):
-    def __init__(self, text: str = None, position: Optional[Tuple[int, int, int, int]] = None, *args):
+    def __init__(self, text: str = None, position: Optional[Position] = None, *args):
         super().__init__(text, position, *args)
 
     def what(self) -> str:
         # print(traceback.format_exc())
         return self.args[0] if self.args[0] is not None else '[no text]'
 
-    def str_pos(self):
-        return f"line {self.args[1][0] + 1}:{self.args[1][1]}"
+    def str_pos(self, package: 'Package'):
+        start = pos_start(self.args[1])
+        return f"line {package.line_of(start) + 1}:{start}"
 
     def pos(self):
         return self.args[1]
 
 
 class Path:
-    def __init__(self, nodes: List[str]):
-        self.nodes = nodes.copy()
+    # paths are interned: equal nodes give the same immutable object, so they are compared by identity
+    __slots__ = ('nodes', '_hash', '_str_hash')
+    _interned: Dict[Tuple[str, ...], 'Path'] = {}
+
+    def __new__(cls, nodes: List[str]):
+        # empty node (root path, ':name') never changed the hash, so it was equal to no node
+        key = tuple(i for i in nodes if i)
+        path = cls._interned.get(key)
+        if path is None:
+            path = super().__new__(cls)
+            h = symbol_hash(["path"] + list(key))
+            object.__setattr__(path, 'nodes', key)
+            object.__setattr__(path, '_hash', h)
+            object.__setattr__(path, '_str_hash', str(h))
+            path = cls._interned.setdefault(key, path)
+        return path
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Path is immutable")
+
+    def __reduce__(self):
+        return Path, (list(self.nodes),)
 
     def get_nodes(self) -> List[str]:
-        return self.nodes[:]
+        return list(self.nodes)
 
     def __hash__(self):
-        return hash_faq6(["path"] + self.nodes)
+        return self._hash
 
     def str_hash(self):
-        return str(hash(self))
+        return self._str_hash
 
     def __add__(self, other):
         if isinstance(other, Path):
@@ -236,7 +437,7 @@ class Path:
 
     def __eq__(self, other):
         if isinstance(other, Path):
-            return hash(self) == hash(other)
+            return self is other
         else:
             raise ValueError(other)
 
@@ -248,7 +449,7 @@ class BadTemplateException(Exception):
 
 class RawType:
     def __init__(self, path: Path, name: str, pointer_level: int, template_types: List['RawType'],
-                 src_pack: Optional['Package'] = None, position: Optional[Tuple[int, int, int, int]] = None, is_const: bool = False):
+                 src_pack: Optional['Package'] = None, position: Optional[Position] = None, is_const: bool = False):
         self.name = name
         self.pointer_level = pointer_level
         self.templates: List['RawType'] = template_types
@@ -262,8 +463,7 @@ class RawType:
         self.src_pack = src_pack
 
     def gen_hash(self):
-        self.hash = hash_faq6(["rawtype", self.path.str_hash(), self.name] + [i.str_hash() for i in
-                                                                              self.templates])
+        self.hash = _raw_hash(self.path, self.name, tuple([i.hash for i in self.templates]))
 
     def is_constant(self):
         return self.is_const
@@ -291,6 +491,8 @@ class RawType:
         return str(self.hash)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, RawType):
             return self.hash == other.hash
         else:
@@ -309,7 +511,44 @@ class RawType:
         return self.hash
 
     def copy(self):
-        return RawType(self.path, self.name, self.pointer_level, self.templates, self.src_pack, self.position)
+        # the same as RawType(...) without constness, but the hash isn't recalculated
+        t = RawType.__new__(RawType)
+        t.__dict__.update(self.__dict__)
+        t.is_const = False
+        return t
+
+
+# path of types made by TypeData, names in it are resolved already
+EMPTY_PATH = Path([])
+
+# symbol_hash isn't free, every distinct type is hashed once
+_raw_hashes: Dict[Tuple[Path, str, Tuple[int, ...]], int] = {}
+_type_hashes: Dict[Tuple[int, int], int] = {}
+
+
+def _raw_hash(path: Path, name: str, template_hashes: Tuple[int, ...]) -> int:
+    key = (path, name, template_hashes)
+    h = _raw_hashes.get(key)
+    if h is None:
+        h = symbol_hash(["rawtype", path.str_hash(), name] + [str(i) for i in template_hashes])
+        _raw_hashes[key] = h
+    return h
+
+
+def _applied_struct_hash(src_hash: int, template_hashes: List[int]) -> int:
+    return symbol_hash(["applied-struct", str(src_hash)] + [str(i) for i in template_hashes])
+
+
+def _type_hash(data_hash: int, pointer_level: int) -> int:
+    key = (data_hash, pointer_level)
+    h = _type_hashes.get(key)
+    if h is None:
+        h = symbol_hash(["type", str(data_hash), str(pointer_level)])
+        _type_hashes[key] = h
+    return h
+
+# resolved types shared by new_data and with_pointer_level, only while someone uses them
+_interned_types: 'WeakValueDictionary[Tuple[int, int, bool, Tuple[int, ...]], TypeData]' = WeakValueDictionary()
 
 
 class FunctionImage:
@@ -341,7 +580,6 @@ class TypeData(Data):
         self.trace_package = trace_package
         self.pointer_level = pointer_level
         self.hash = 0
-        self.is_mut = False
         self.is_const = is_const
 
         if not self.is_raw():
@@ -352,22 +590,13 @@ class TypeData(Data):
 
     def is_constant(self):
         return self.is_const
-    
-    def is_mutable(self):
-        return not self.is_const and self.is_mut
-
-    def set_mutable(self):
-        self.is_mut = True
-
-    def set_immutable(self):
-        self.is_mut = False
 
     def is_pointer(self):
         return self.pointer_level != 0
 
     def gen_hash(self):
         if not self.is_raw():
-            self.hash = hash_faq6(["type", self.data.str_hash(), str(self.pointer_level)])
+            self.hash = _type_hash(self.data.hash, self.pointer_level)
         else:
             self.hash = self.raw.hash
 
@@ -382,9 +611,18 @@ class TypeData(Data):
 
     @staticmethod
     def new_data(data: Union['StructData'], pointer_level: int, template_types: List['TypeData'], is_const: bool):
+        # result is shared between equal types, use copy() to change it
         if not isinstance(data, StructData):
             raise StateException(data)
-        return TypeData(data, None, None, template_types, pointer_level, is_const)
+        key = (data.hash, pointer_level, is_const, tuple([t.hash for t in template_types]))
+        t = _interned_types.get(key)
+        if t is None or t.data is not data:
+            t = TypeData(data, None, None, template_types, pointer_level, is_const)
+            _interned_types[key] = t
+        return t
+
+    def with_pointer_level(self, pointer_level: int) -> 'TypeData':
+        return TypeData.new_data(self.data, pointer_level, self.templates, self.is_const)
 
     @staticmethod
     def new_raw_templates(raw_type: RawType, templates: Dict[RawType, 'TypeData']) -> 'TypeData':
@@ -420,7 +658,22 @@ class TypeData(Data):
     def make_not_raw(self):
         if self.is_raw():
             self.pointer_level = self.raw.pointer_level
-            structs = structs_by_path(self.raw.path, self.trace_package)
+            storage = self.trace_package.storage if self.trace_package is not None else None
+            key = None
+            if storage is not None and not self.templates:
+                key = (self.trace_package, self.raw.path, self.raw.name, _raw_shape(self.raw.templates))
+                resolved = storage.resolved_types.get(key)
+                if resolved is not None:
+                    storage.resolved_type_hits += 1
+                    self.data, self.templates = resolved
+                    if storage.applied_log is not None and isinstance(self.data, AppliedStructData):
+                        # the miss tried to register it
+                        storage.applied_log.append(self.data)
+                    self.gen_hash()
+                    return
+                storage.resolved_type_misses += 1
+
+            structs = structs_by_name(self.raw.path, self.trace_package, self.raw.name)
             si = StructImage(self.raw.name, self.raw.templates)
 
             c = structs.count(si)
@@ -453,6 +706,8 @@ class TypeData(Data):
                 except KeyError:
                     pass
 
+            if key is not None:
+                storage.resolved_types[key] = (self.data, self.templates)
             self.gen_hash()
 
     def is_valid(self) -> bool:
@@ -467,6 +722,8 @@ class TypeData(Data):
         self.is_valid()
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, TypeData):
             if other.is_const and other.pointer_level != 0 and not self.is_const:
                 return False
@@ -489,6 +746,147 @@ class TypeData(Data):
         return TypeData(self.data, self.trace_package, self.raw.copy(), self.templates, self.pointer_level, self.is_const)
 
 
+def _raw_shape(templates: List[RawType]) -> tuple:
+    # the whole tree, a raw hash isn't updated when templates are substituted into it
+    return tuple([(t.path, t.name, t.pointer_level, t.is_const, _raw_shape(t.templates)) for t in templates])
+
+
+def _pointer_level(t: Union['TypeData', RawType]) -> int:
+    if isinstance(t, TypeData) and t.pointer_level is not None:
+        return t.pointer_level
+    return t.raw.pointer_level if isinstance(t, TypeData) else t.pointer_level
+
+
+class TemplateUnifier:
+    # deduces templates of a function from types of its arguments.
+    # Template hash -> (type, pointer level) it's bound to, types are built only in result()
+    def __init__(self, function: 'FunctionData'):
+        self.function = function
+        self.substitution: Dict[int, Tuple[Union[TypeData, RawType], int]] = {}
+        # (pattern, type, pointer level) pairs unified already, shared subtrees are walked once
+        self.unified: Set[Tuple[int, int, int]] = set()
+
+    def _template(self, t: Union[TypeData, RawType]) -> Optional[RawType]:
+        if isinstance(t, RawType):
+            for i in self.function.template_types:
+                if i.hash == t.hash:
+                    return i
+        return None
+
+    def _struct(self, t: Union[TypeData, RawType]) -> Union['StructData', str]:
+        # struct the type is made of, its name when it can't be resolved uniquely
+        if isinstance(t, TypeData):
+            if not t.is_raw():
+                data = t.data
+                while isinstance(data, AppliedStructData):
+                    data = data.src_sd
+                return data
+            package = t.trace_package
+            t = t.raw
+        else:
+            package = t.src_pack if t.src_pack is not None else self.function.package
+        if package is None:
+            return t.name
+        found = None
+        for s in structs_by_name(t.path, package, t.name):
+            if len(s.template_types) == len(t.templates):
+                if found is not None:
+                    return t.name
+                found = s
+        return found if found is not None else t.name
+
+    @staticmethod
+    def _templates(t: Union[TypeData, RawType]) -> List[Union[TypeData, RawType]]:
+        if isinstance(t, TypeData):
+            return t.templates if t.templates is not None else t.raw.templates
+        return t.templates
+
+    def _occurs(self, template: RawType, t: Union[TypeData, RawType]) -> bool:
+        # only types that aren't resolved yet can refer to templates
+        if isinstance(t, TypeData):
+            if not t.is_raw():
+                return False
+            t = t.raw
+        if t.hash == template.hash:
+            return True
+        for i in t.templates:
+            if self._occurs(template, i):
+                return True
+        return False
+
+    def _same(self, bound: Tuple[Union[TypeData, RawType], int], t: Union[TypeData, RawType], pointer_level: int):
+        # TypeData.__eq__ of the types both would be built to
+        b, b_pointer_level = bound
+        if b is t and b_pointer_level == pointer_level:
+            return True
+        if t.is_const and pointer_level != 0 and not b.is_const:
+            return False
+        if b_pointer_level != pointer_level:
+            return False
+        if isinstance(b, TypeData) and not b.is_raw() and isinstance(t, TypeData) and not t.is_raw():
+            return b.data.hash == t.data.hash
+        b_raw = b.raw if isinstance(b, TypeData) else b
+        t_raw = t.raw if isinstance(t, TypeData) else t
+        return (isinstance(b, RawType) or b.is_raw()) and (isinstance(t, RawType) or t.is_raw()) and \
+            b_raw.hash == t_raw.hash
+
+    def unify(self, pattern: Union[TypeData, RawType], t: Union[TypeData, RawType], pointer_level: int) -> bool:
+        template = self._template(pattern)
+        if template is not None:
+            pointer_level -= pattern.pointer_level
+            if pointer_level < 0:
+                return False
+            bound = self.substitution.get(template.hash)
+            if bound is None:
+                if self._occurs(template, t):
+                    return False
+                self.substitution[template.hash] = (t, pointer_level)
+                return True
+            return self._same(bound, t, pointer_level)
+
+        # pointer levels of not template parts are checked when the template is applied
+        key = (id(pattern), id(t), pointer_level)
+        if key in self.unified:
+            return True
+        s = self._struct(pattern)
+        o = self._struct(t)
+        if isinstance(s, str) or isinstance(o, str):
+            if (s if isinstance(s, str) else s.name) != (o if isinstance(o, str) else o.name):
+                return False
+        elif s.hash != o.hash:
+            return False
+
+        pattern_templates = self._templates(pattern)
+        templates = self._templates(t)
+        if len(pattern_templates) != len(templates):
+            return False
+        for i, j in zip(pattern_templates, templates):
+            if not self.unify(i, j, _pointer_level(j)):
+                return False
+        self.unified.add(key)
+        return True
+
+    def result(self) -> Optional[List[TypeData]]:
+        templates = []
+        for template in self.function.template_types:
+            bound = self.substitution.get(template.hash)
+            if bound is None:
+                return None
+            t, pointer_level = bound
+            if isinstance(t, RawType):
+                raw = t.copy()
+                raw.pointer_level = pointer_level
+                t = TypeData.new_raw(t.src_pack, raw)
+            elif not t.is_raw():
+                if t.pointer_level != pointer_level:
+                    t = t.with_pointer_level(pointer_level)
+            elif t.raw.pointer_level != pointer_level:
+                t = t.copy()
+                t.raw.pointer_level = pointer_level
+            templates.append(t)
+        return templates
+
+
 class FunctionData(Data):
     def __init__(self, package: 'Package', type_: Union[TypeData, RawType], name: str,
                  arg_types: List[Union[RawType, TypeData]],
@@ -505,7 +903,7 @@ class FunctionData(Data):
         self.gen_hash()
 
     def gen_hash(self):
-        self.hash = self.hash = hash_faq6(
+        self.hash = self.hash = symbol_hash(
             ["function", self.package.path.str_hash(), self.name, str(len(self.template_types))] +
             [i.str_hash() for i in self.arg_types] +
             [str(i.pointer_level if i.pointer_level is not None else i.raw.pointer_level) for i in self.arg_types])
@@ -523,6 +921,9 @@ class FunctionData(Data):
                 t.update_types()
 
     def apply_template(self, templates: List[TypeData]) -> 'AppliedFunctionData':
+        return instantiate(self, templates, self._apply_template)
+
+    def _apply_template(self, templates: List[TypeData]) -> 'AppliedFunctionData':
         if len(templates) == len(self.template_types):
             templates_dict = {}
             for i, j in zip(self.template_types, templates):
@@ -548,77 +949,170 @@ class FunctionData(Data):
             raise BadTemplateException
 
     def try_generate_template(self, arg_types: List[TypeData]) -> List[TypeData]:
-        if len(self.arg_types) == len(arg_types):
-            templates: Dict[RawType, TypeData] = {}
-
-            def recursive(t: Union[TypeData, RawType], o: TypeData):
-                if isinstance(t, RawType) and t in self.template_types:
-                    if t not in templates:
-                        if t.pointer_level == 0:
-                            templates[t] = o
-                        else:
-                            c = o.copy()
-                            delta = t.pointer_level
-                            if c.pointer_level - delta < 0:
-                                raise BadTemplateException
-                            else:
-                                c.pointer_level -= delta
-                                c.raw.pointer_level -= delta
-                            templates[t] = c
-                    else:
-                        if templates[t] != o:
-                            raise BadTemplateException
+        if len(self.arg_types) != len(arg_types):
+            raise ValueError
+        templates = self.deduce_templates(arg_types)
+        if templates is None:
+            raise BadTemplateException
+        return templates
+
+    def deduce_templates(self, arg_types: List[TypeData], packed: int = 0) -> Optional[List[TypeData]]:
+        # templates in order of template_types, None if arguments don't fit. packed is the same as in match_image
+        storage = self.package.storage
+        key = None
+        if storage is not None:
+            keys = [_type_key(t) if isinstance(t, TypeData) else None for t in arg_types]
+            if None not in keys:
+                key = (self.hash, packed, tuple(keys))
+                if key in storage.deduced_templates:
+                    templates = storage.deduced_templates[key]
+                    return templates[:] if templates is not None else None
+
+        unifier = TemplateUnifier(self)
+        templates = None
+        for i in range(len(arg_types)):
+            o = arg_types[i]
+            if not unifier.unify(self.arg_types[i], o, _pointer_level(o) + (packed >> i & 1)):
+                break
+        else:
+            templates = unifier.result()
+
+        if key is not None:
+            storage.deduced_templates[key] = templates
+            if templates is not None:
+                return templates[:]
+        return templates
+
+    def _substituted_type(self, r: RawType, templates: List[TypeData]) -> Optional[Tuple[int, int, bool, int, bool]]:
+        # hash, raw hash, constness, pointer level of TypeData.new_raw_templates(r, ...) and is it resolved already.
+        # None when it can't be told without building the type
+        for i in range(len(self.template_types) - 1, -1, -1):
+            if self.template_types[i].hash == r.hash:
+                s = templates[i]
+                if s.is_raw() or r.templates:
+                    return None
+                pointer_level = s.raw.pointer_level + r.pointer_level
+                return _type_hash(s.data.hash, pointer_level), s.raw.hash, s.is_const, pointer_level, True
+        if not r.templates:
+            raw_hash = r.hash
+        else:
+            raw_hashes = []
+            for t in r.templates:
+                st = self._substituted_type(t, templates)
+                if st is None:
+                    return None
+                raw_hashes.append(st[1])
+            raw_hash = _raw_hash(r.path, r.name, tuple(raw_hashes))
+        return raw_hash, raw_hash, False, r.pointer_level, False
+
+    def _applied_type(self, r: RawType, templates: List[TypeData]) -> Optional[Tuple[int, bool]]:
+        # hash and constness of an argument type after apply_template, the same as make_not_raw does
+        st = self._substituted_type(r, templates)
+        if st is None:
+            return None
+        h, _, is_const, pointer_level, resolved = st
+        if not resolved:
+            if r.src_pack is None:
+                return None
+            data = None
+            for s in structs_by_name(r.path, r.src_pack, r.name):
+                if len(s.template_types) == len(r.templates):
+                    if data is not None:
+                        return None
+                    data = s
+            if data is None:
+                return None
+            data_hash = data.hash
+            if data.is_template():
+                template_hashes = []
+                for t in r.templates:
+                    template_hashes.append(self._substituted_type(t, templates)[0])
+                data_hash = _applied_struct_hash(data_hash, template_hashes)
+            h = _type_hash(data_hash, pointer_level)
+        if pointer_level > 1 and not settings.get_current().allow_pointer_of_pointer:
+            return None
+        return h, is_const
+
+    def match_image(self, name: str, templates: List[TypeData], arg_types: List[TypeData],
+                    packed: int = 0) -> Optional[bool]:
+        # the same as comparing with FunctionImage(name, arg_types, templates), but nothing is applied.
+        # Bit i of packed means that pointer level of the argument i is raised by one (auto pack).
+        # None when only applying the template can tell
+        if self.name != name:
+            return False
+        if len(self.template_types) == len(templates):
+            if len(self.arg_types) != len(arg_types):
+                return False
+            for i in range(len(arg_types)):
+                ft = self.arg_types[i]
+                o = arg_types[i]
+                if not isinstance(o, TypeData) or o.is_raw():
+                    return None
+                if isinstance(ft, RawType):
+                    if not self.is_template():
+                        return None
+                    a = self._applied_type(ft, templates)
+                    if a is None:
+                        return None
+                    h, is_const = a
+                elif ft.is_raw():
+                    return None
                 else:
-                    tc = t.raw.copy() if isinstance(t, TypeData) else t.copy()
-                    tc.templates = []
-                    tc.gen_hash()
-
-                    oc = o.raw.copy()
-                    oc.templates = []
-                    oc.path = Path([])  # <- костыль
-                    oc.gen_hash()
-                    # TODO: fix if pathes are different in raw but type the same returns false
-                    if tc != oc:
-                        raise BadTemplateException
-                    if t.templates:
-                        for i, j in zip(t.templates, o.templates):
-                            recursive(i, j)
-
-            for a, other_a in zip(self.arg_types, arg_types):
-                recursive(a, other_a)
-
-            return list(templates.values())
+                    h, is_const = ft.hash, ft.is_const
+                o_pointer_level = o.pointer_level
+                o_hash = o.hash
+                if packed >> i & 1:
+                    o_pointer_level += 1
+                    o_hash = _type_hash(o.data.hash, o_pointer_level)
+                if o.is_const and o_pointer_level != 0 and not is_const:
+                    return False
+                if h != o_hash:
+                    return False
+            return True
+        elif len(templates) == 0:  # if implicit templates
+            if len(self.arg_types) != len(arg_types):
+                return False
+            for o in arg_types:
+                if not isinstance(o, TypeData):
+                    return None
+            return self.deduce_templates(arg_types, packed) is not None
         else:
-            raise ValueError
+            return False
 
     def __eq__(self, other):
         if isinstance(other, FunctionData):
             return self.hash == other.hash
         elif isinstance(other, FunctionImage):
-            if self.name == other.name:
-                if len(self.template_types) == len(other.templates):
-                    if self.is_template():
-                        try:
-                            f = self.apply_template(other.templates)
-                        except BadTemplateException:
-                            return False
-                    else:
-                        f = self
-                    return f.arg_types == other.arg_types
-                elif len(other.templates) == 0:  # if implicit templates
-                    try:
-                        self.try_generate_template(other.arg_types)
-                        return True
-                    except BadTemplateException:
-                        return False
-                    except ValueError:
-                        return False
-                else:
+            m = self.match_image(other.name, other.templates, other.arg_types)
+            if m is None:
+                return self._eq_image(other)
+            return m
+        else:
+            raise ValueError
+
+    def _eq_image(self, other: FunctionImage) -> bool:
+        # applies the template, for types match_image can't check
+        if self.name != other.name:
+            return False
+        if len(self.template_types) == len(other.templates):
+            if self.is_template():
+                try:
+                    f = self.apply_template(other.templates)
+                except BadTemplateException:
                     return False
             else:
+                f = self
+            return f.arg_types == other.arg_types
+        elif len(other.templates) == 0:  # if implicit templates
+            try:
+                self.try_generate_template(other.arg_types)
+                return True
+            except BadTemplateException:
+                return False
+            except ValueError:
                 return False
         else:
-            raise ValueError
+            return False
 
     def is_template(self):
         return len(self.template_types) > 0
@@ -641,7 +1135,7 @@ class AppliedFunctionData(FunctionData):
         super().__init__(package, type, name, arg_types, [], src_func.is_safe)
 
     def gen_hash(self):
-        self.hash = self.hash = hash_faq6(
+        self.hash = self.hash = symbol_hash(
             ["templated-function", self.package.path.str_hash(), self.name] +
             [i.str_hash() for i in self.arg_types] + [i.str_hash() for i in self.applied_templates] +
             [str(i.pointer_level if i.pointer_level is not None else i.raw.pointer_level) for i in self.arg_types])
@@ -666,7 +1160,7 @@ class StructData(Data):
         self.gen_hash()
 
     def gen_hash(self):
-        self.hash = hash_faq6(["struct", self.package.path.str_hash(), self.name])
+        self.hash = symbol_hash(["struct", self.package.path.str_hash(), self.name])
 
     def __hash__(self):
         return self.hash
@@ -692,6 +1186,9 @@ class StructData(Data):
         return len(self.template_types) > 0
 
     def apply_template(self, templates: List[TypeData]) -> 'AppliedStructData':
+        return instantiate(self, templates, self._apply_template)
+
+    def _apply_template(self, templates: List[TypeData]) -> 'AppliedStructData':
         return AppliedStructData(self.package, self.name, self, templates)
 
     def update_types(self):
@@ -705,8 +1202,7 @@ class AppliedStructData(StructData):
         super().__init__(package, typename, [a.raw for a in applied_templates])
 
     def gen_hash(self):
-        self.hash = hash_faq6(
-            ["applied-struct", self.src_sd.str_hash()] + [t.str_hash() for t in self.applied_templates])
+        self.hash = _applied_struct_hash(self.src_sd.hash, [t.hash for t in self.applied_templates])
 
     def __eq__(self, other):
         if isinstance(other, AppliedStructData):
@@ -725,7 +1221,7 @@ class VariableData(Data):
         self.name = name
         self.type = type
 
-        self.hash = hash_faq6(["variable", name])
+        self.hash = symbol_hash(["variable", name])
 
     def __hash__(self):
         return self.hash
@@ -743,6 +1239,50 @@ class VariableData(Data):
         self.type.update_types()
 
 
+class SymbolCollisionException(Exception):
+    def __init__(self, first: str, second: str, what: str):
+        # all arguments are kept, so it's raised again after a worker process
+        super().__init__(first, second, what)
+
+    def __str__(self):
+        return f"symbols {self.args[0]} and {self.args[1]} have the same {self.args[2]}"
+
+
+def _symbol_type(t: Union[TypeData, RawType]) -> str:
+    # constness isn't a part of hashes, types differing only in it are the same
+    if isinstance(t, RawType):
+        return str(t)
+    if t.is_raw():
+        return str(t.raw)
+    return f"{symbol_key(t.data)}{'*' * t.pointer_level}"
+
+
+def symbol_key(d: Union[FunctionData, StructData]) -> str:
+    # doesn't depend on hashes, so different symbols have different keys
+    if isinstance(d, AppliedFunctionData):
+        return f"{symbol_key(d.src_function)}[{','.join([_symbol_type(t) for t in d.applied_templates])}]"
+    elif isinstance(d, AppliedStructData):
+        return f"{symbol_key(d.src_sd)}[{','.join([_symbol_type(t) for t in d.applied_templates])}]"
+    elif isinstance(d, FunctionData):
+        return f"function {d.package.path}:{d.name}<{len(d.template_types)}>" \
+               f"({','.join([_symbol_type(t) for t in d.arg_types])})"
+    elif isinstance(d, StructData):
+        return f"struct {d.package.path}:{d.name}"
+    raise ValueError(d)
+
+
+def check_symbol(registered: Union[FunctionData, StructData], d: Union[FunctionData, StructData]):
+    # d has the hash of registered one, it's fine only if it is the same symbol
+    if registered is not d:
+        first, second = symbol_key(registered), symbol_key(d)
+        if first != second:
+            raise SymbolCollisionException(first, second, f"hash {d.hash}")
+
+
+# less functions than that are analyzed faster than the pool starts
+MIN_PARALLEL_FUNCTIONS = 32
+
+
 class GlobalStorage:
     def __init__(self):
         self.function_declarations: List[FunctionDeclaration] = []
@@ -751,26 +1291,140 @@ class GlobalStorage:
         self.applied_function_declarations: Dict[FunctionDeclaration, List[AppliedFunctionDeclarationContainer]] = {}
         self.applied_struct_declarations: Dict[StructDeclaration, List[AppliedStructDeclaration]] = {}
 
+        # data hash -> first declaration registered with it
+        self.function_declarations_by_hash: Dict[int, FunctionDeclaration] = {}
+        self.struct_declarations_by_hash: Dict[int, StructDeclaration] = {}
+
         self.all_packages: List[Package] = []
+        # first package registered with the path wins, as in lookups through other_packages
+        self.path_to_package: Dict[Path, Package] = {}
+        # (requesting package, path) -> packages, dropped when a package is added or removed
+        self._resolved_packages: Dict[Tuple[Package, Path], List[Package]] = {}
+        # find_function results, dropped when a function or a package is added
+        self.found_functions: Dict[tuple, List[FunctionData]] = {}
+        self.find_function_hits = 0
+        self.find_function_misses = 0
+        # (kind, template hash, applied type keys) -> applied data, dropped when a package or a struct is added
+        self.instantiations: Dict[tuple, Data] = {}
+        self.instantiation_hits = 0
+        self.instantiation_misses = 0
+        # deduce_templates results, dropped together with instantiations
+        self.deduced_templates: Dict[tuple, Optional[List[TypeData]]] = {}
+        # (trace package, raw path, raw name, raw shape) -> (struct, templates) of make_not_raw, dropped together with instantiations
+        self.resolved_types: Dict[tuple, Tuple[StructData, List[TypeData]]] = {}
+        self.resolved_type_hits = 0
+        self.resolved_type_misses = 0
+        # names of functions and structs for "did you mean", built on the first error
+        self.function_names: Optional[NameIndex] = None
+        self.struct_names: Optional[NameIndex] = None
+
+        # applied datas in order of registration, each gets its declaration once
+        self.pending_applied_functions: List[AppliedFunctionData] = []
+        self.pending_applied_structs: List[AppliedStructData] = []
+        self.declared_applied_functions: Dict[int, AppliedFunctionData] = {}
+        self.declared_applied_structs: Dict[int, AppliedStructData] = {}
+        # applied datas of both kinds in order of register attempts, repeated ones too.
+        # Kept only while a body is analyzed by a worker or for the build database
+        self.applied_log: Optional[List[Data]] = None
+        # (requesting package, path) of package lookups, kept as applied_log
+        self.lookup_log: Optional[Set[Tuple['Package', Path]]] = None
 
         self._late_create_casts: List[Tuple['Package', RawType, Tuple[RawType, str], 'FunctionBody']] = []
 
-    def add_package(self, p: 'Package'):
-        for i in self.all_packages:
-            i.other_packages.append(p)
-        p.other_packages = self.all_packages[:]
-        self.all_packages.append(p)
+    def add_package(self, p: 'Package', index: Optional[int] = None):
+        # a package added again goes to its old place, order of packages is order of lookups
+        self.all_packages.insert(len(self.all_packages) if index is None else index, p)
+        self._link_packages()
         p.storage = self
+        for applied in p.applied_function_datas.values():
+            self.pending_applied_functions.extend(applied)
+        for applied in p.applied_struct_datas.values():
+            self.pending_applied_structs.extend(applied)
+
+    def remove_package(self, p: 'Package'):
+        # with its declarations and every applied data or declaration made of its structs or functions
+        def made_of(d: Optional[Data]) -> bool:
+            if isinstance(d, AppliedFunctionData):
+                return made_of(d.src_function) or any([made_of(t.data) for t in d.applied_templates])
+            elif isinstance(d, AppliedStructData):
+                return made_of(d.src_sd) or any([made_of(t.data) for t in d.applied_templates])
+            return d is not None and d.package is p
+
+        self.all_packages.remove(p)
+        self._link_packages()
+        self.function_declarations = [i for i in self.function_declarations if i.data.package is not p]
+        self.struct_declarations = [i for i in self.struct_declarations if i.data.package is not p]
+        self.function_declarations_by_hash = {}
+        for f in self.function_declarations:
+            self.function_declarations_by_hash.setdefault(f.data.hash, f)
+        self.struct_declarations_by_hash = {}
+        for s in self.struct_declarations:
+            self.struct_declarations_by_hash.setdefault(s.data.hash, s)
+        self.applied_function_declarations = {k: [a for a in v if not made_of(a.data)]
+                                              for k, v in self.applied_function_declarations.items()
+                                              if k.data.package is not p}
+        self.applied_struct_declarations = {k: [a for a in v if not made_of(a.data)]
+                                            for k, v in self.applied_struct_declarations.items()
+                                            if k.data.package is not p}
+        for i in self.all_packages:
+            i.applied_hashes = {h: d for h, d in i.applied_hashes.items() if not made_of(d)}
+            for applied in list(i.applied_function_datas.values()) + list(i.applied_struct_datas.values()):
+                applied[:] = [d for d in applied if not made_of(d)]
+        self.pending_applied_functions = [d for d in self.pending_applied_functions if not made_of(d)]
+        self.pending_applied_structs = [d for d in self.pending_applied_structs if not made_of(d)]
+        self.declared_applied_functions = {h: d for h, d in self.declared_applied_functions.items() if not made_of(d)}
+        self.declared_applied_structs = {h: d for h, d in self.declared_applied_structs.items() if not made_of(d)}
+        self._late_create_casts = [c for c in self._late_create_casts if c[0] is not p]
+
+    def _link_packages(self):
+        for i in self.all_packages:
+            i.other_packages = [j for j in self.all_packages if j is not i]
+        self.path_to_package = {}
+        for i in self.all_packages:
+            self.path_to_package.setdefault(i.path, i)
+        self._resolved_packages = {}
+        self.found_functions = {}
+        self.instantiations = {}
+        self.deduced_templates = {}
+        self.resolved_types = {}
+        self.function_names = None
+        self.struct_names = None
+
+    def function_name_index(self) -> NameIndex:
+        if self.function_names is None:
+            self.function_names = NameIndex([f.name for p in self.all_packages for f in p.function_datas])
+        return self.function_names
+
+    def struct_name_index(self) -> NameIndex:
+        if self.struct_names is None:
+            self.struct_names = NameIndex([s.name for p in self.all_packages for s in p.struct_datas])
+        return self.struct_names
+
+    def resolve_packages(self, path: Path, trace_from: 'Package') -> List['Package']:
+        key = (trace_from, path)
+        if self.lookup_log is not None:
+            self.lookup_log.add(key)
+        packs = self._resolved_packages.get(key)
+        if packs is None:
+            # the path itself, relative to the package and relative to every import
+            packs = []
+            for p in [path, trace_from.path + path] + [i + path for i in trace_from.imports]:
+                pack = trace_from if trace_from.path == p else self.path_to_package.get(p)
+                if pack is not None and pack not in packs:
+                    packs.append(pack)
+            self._resolved_packages[key] = packs
+        return packs
 
     def get_declaration_by_data(self, data: Data) -> Union['FunctionDeclaration', 'StructDeclaration']:
+        # applied datas are equal to the data they were applied from
         if isinstance(data, StructData):
-            for i in self.struct_declarations:
-                if i.data == data:
-                    return i
+            while isinstance(data, AppliedStructData):
+                data = data.src_sd
+            return self.struct_declarations_by_hash.get(data.hash)
         elif isinstance(data, FunctionData):
-            for i in self.function_declarations:
-                if i.data == data:
-                    return i
+            while isinstance(data, AppliedFunctionData):
+                data = data.src_function
+            return self.function_declarations_by_hash.get(data.hash)
         else:
             raise ValueError(data)
 
@@ -783,6 +1437,7 @@ class GlobalStorage:
         elif isinstance(v, StructDeclaration):
             if v not in self.struct_declarations:
                 self.struct_declarations.append(v)
+                check_symbol(self.struct_declarations_by_hash.setdefault(v.data.hash, v).data, v.data)
                 if v.is_template():
                     self.applied_struct_declarations[v] = []
                 v.data.package.register(v.data)
@@ -796,6 +1451,7 @@ class GlobalStorage:
         elif isinstance(v, FunctionDeclaration):
             if v not in self.function_declarations:
                 self.function_declarations.append(v)
+                check_symbol(self.function_declarations_by_hash.setdefault(v.data.hash, v).data, v.data)
                 if v.is_template():
                     self.applied_function_declarations[v] = []
                 v.data.package.register(v.data)
@@ -810,36 +1466,32 @@ class GlobalStorage:
 
     def _get_created_applied_functions(self) -> List['AppliedFunctionDeclarationContainer']:
         decls = []
-        for package in self.all_packages:
-            for template in package.applied_function_datas:
-                declaration = self.get_declaration_by_data(template)
-                for applied in package.applied_function_datas[template]:
-                    found = False
-                    for t in self.applied_function_declarations[declaration]:
-                        if applied == t.data:
-                            found = True
-                            break
-                    if not found:
-                        a = declaration.apply_template(applied.applied_templates)
-                        decls.append(a)
-                        self.register(a)
+        pending, self.pending_applied_functions = self.pending_applied_functions, []
+        for applied in pending:
+            declared = self.declared_applied_functions.get(applied.hash)
+            if declared is not None:
+                check_symbol(declared, applied)
+                continue
+            declaration = self.get_declaration_by_data(applied.src_function)
+            a = declaration.apply_template(applied.applied_templates)
+            decls.append(a)
+            self.register(a)
+            self.declared_applied_functions[applied.hash] = applied
         return decls
 
     def _get_created_applied_structs(self) -> List['AppliedStructDeclaration']:
         decls = []
-        for package in self.all_packages:
-            for template in package.applied_struct_datas:
-                decl = self.get_declaration_by_data(template)
-                for applied in package.applied_struct_datas[template]:
-                    found = False
-                    for t in self.applied_struct_declarations[decl]:
-                        if applied == t.data:
-                            found = True
-                            break
-                    if not found:
-                        a = decl.apply_template(applied.applied_templates)
-                        decls.append(a)
-                        self.register(a)
+        pending, self.pending_applied_structs = self.pending_applied_structs, []
+        for applied in pending:
+            declared = self.declared_applied_structs.get(applied.hash)
+            if declared is not None:
+                check_symbol(declared, applied)
+                continue
+            decl = self.get_declaration_by_data(applied.src_sd)
+            a = decl.apply_template(applied.applied_templates)
+            decls.append(a)
+            self.register(a)
+            self.declared_applied_structs[applied.hash] = applied
         return decls
 
     def validate_types(self):
@@ -850,8 +1502,10 @@ class GlobalStorage:
         for sd in self.applied_function_declarations:
             sd.update_types()
 
-    def is_valid(self) -> bool:
-        for c in self._late_create_casts:
+    def declare_casts(self):
+        # casts wait for packages they use, each is declared once
+        casts, self._late_create_casts = self._late_create_casts, []
+        for c in casts:
             to = TypeData.new_raw(c[0], c[1])
             try:
                 to.update_types()
@@ -860,11 +1514,32 @@ class GlobalStorage:
             d = FunctionDeclaration(c[0], c[1], f'__cast_{str(to).replace(":", "_")}', [c[2]], [], c[3])
             self.register(d)
 
-        self.validate_types()
+    def is_valid(self, build: Optional['BuildDatabase'] = None, workers: int = 1) -> bool:
+        # with the build database, functions it has up to date results for aren't analyzed again.
+        # Bodies of non-template functions are analyzed by worker processes if there are enough of them
+        self.declare_casts()
+
+        if build is not None:
+            # signatures and declared types of bodies are looked up here, not in analysis
+            self.lookup_log = set()
+            try:
+                self.validate_types()
+            finally:
+                lookups, self.lookup_log = self.lookup_log, None
+            build.prepare(self, lookups)
+        else:
+            self.validate_types()
 
         valid = True
-        for i in self.function_declarations:
-            if not i.is_template():
+        functions = [i for i in self.function_declarations if not i.is_template()]
+        if workers > 1 and len(functions) >= MIN_PARALLEL_FUNCTIONS:
+            from parallel_analysis import analyze_functions
+            valid *= analyze_functions(self, functions, workers, build)
+        elif build is not None:
+            for i in functions:
+                valid *= build.analyze(i)
+        else:
+            for i in functions:
                 valid *= i.is_valid()
 
         for i in self.struct_declarations:
@@ -892,102 +1567,174 @@ class Package:
         self.imports: List[Path] = imports
         self.function_datas: List[FunctionData] = []
         self.struct_datas: List[StructData] = []
+        # (name, arguments count) -> overloads and name -> structs, the same objects as in lists above
+        self.function_index: Dict[Tuple[str, int], List[FunctionData]] = {}
+        self.struct_index: Dict[str, List[StructData]] = {}
         self.other_packages: List[Package] = []
         self.storage: Optional[GlobalStorage] = None
 
         self.applied_function_datas: Dict[FunctionData, List[AppliedFunctionData]] = {}
         self.applied_struct_datas: Dict[StructData, List[AppliedStructData]] = {}
+        # hash -> each data in the two dicts above
+        self.applied_hashes: Dict[int, Data] = {}
 
         self.sources: Optional[str] = None
-
-    def get_source_fragment(self, start_pos: int, end_pos: int, start_line: int, end_line: int) -> List[str]:
-        if self.sources is None:
-            raise ValueError
-        copy = self.sources[:start_pos] + PrintColor.UNDERLINE + self.sources[
-                                                                 start_pos:end_pos + 1] + PrintColor.END + PrintColor.BOLD + self.sources[
-                                                                                                                             end_pos + 1:]
-        lines = copy.splitlines()
-        lines = lines[max(start_line - 2, 0):min(end_line + 3, len(lines))]
+        self._line_starts: Optional[List[int]] = None
+
+    def __reduce_ex__(self, protocol):
+        # build-in package is shared by every storage, so it's pickled by reference
+        if self is BUILD_IN_PACK:
+            return 'BUILD_IN_PACK'
+        return super().__reduce_ex__(protocol)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['storage'] = None
+        state['other_packages'] = []
+        state['_line_starts'] = None
+        return state
+
+    def line_starts(self) -> List[int]:
+        if self._line_starts is None:
+            if self.sources is None:
+                raise ValueError
+            starts = [0]
+            i = self.sources.find('\n')
+            while i != -1:
+                starts.append(i + 1)
+                i = self.sources.find('\n', i + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def line_of(self, offset: int) -> int:
+        return bisect_right(self.line_starts(), offset) - 1
+
+    def get_source_fragment(self, pos: Position) -> List[str]:
+        start_pos, end_pos = pos_start(pos), pos_end(pos)
+        starts = self.line_starts()
+        # two lines around, without copying the whole source
+        first = max(self.line_of(start_pos) - 2, 0)
+        last = self.line_of(end_pos) + 3
+        offset = starts[first]
+        text = self.sources[offset:starts[last] if last < len(starts) else len(self.sources)]
+        start_pos -= offset
+        end_pos -= offset
+        text = text[:start_pos] + PrintColor.UNDERLINE + text[start_pos:end_pos + 1] + PrintColor.END + \
+               PrintColor.BOLD + text[end_pos + 1:]
+        lines = text.splitlines()
         for i in range(len(lines)):
             lines[i] = PrintColor.BOLD + lines[i] + PrintColor.END
         return lines
 
     def register(self, v: Data):
         if isinstance(v, AppliedFunctionData):
-            if v not in self.applied_function_datas[v.src_function]:
-                self.applied_function_datas[v.src_function].append(v)
-            else:
+            if self.storage is not None and self.storage.applied_log is not None:
+                self.storage.applied_log.append(v)
+            registered = self.applied_hashes.get(v.hash)
+            if registered is not None:
+                # cached instantiations are registered again as the same object
+                if registered is not v:
+                    check_symbol(registered, v)
                 raise KeyError(str(v))
+            self.applied_hashes[v.hash] = v
+            self.applied_function_datas[v.src_function].append(v)
+            if self.storage is not None:
+                self.storage.pending_applied_functions.append(v)
         elif isinstance(v, FunctionData):
-            if v not in self.function_datas:
+            overloads = self.function_index.setdefault((v.name, len(v.arg_types)), [])
+            registered = [i for i in overloads if i == v]
+            if not registered:
+                overloads.append(v)
                 self.function_datas.append(v)
+                if self.storage is not None:
+                    self.storage.found_functions = {}
+                    if self.storage.function_names is not None:
+                        self.storage.function_names.add(v.name)
                 if v.is_template():
                     self.applied_function_datas[v] = []
             else:
+                check_symbol(registered[0], v)
                 raise KeyError(str(v))
         elif isinstance(v, AppliedStructData):
-            if v not in self.applied_struct_datas[v.src_sd]:
-                self.applied_struct_datas[v.src_sd].append(v)
-            else:
+            if self.storage is not None and self.storage.applied_log is not None:
+                self.storage.applied_log.append(v)
+            registered = self.applied_hashes.get(v.hash)
+            if registered is not None:
+                # cached instantiations are registered again as the same object
+                if registered is not v:
+                    check_symbol(registered, v)
                 raise KeyError(str(v))
+            self.applied_hashes[v.hash] = v
+            self.applied_struct_datas[v.src_sd].append(v)
+            if self.storage is not None:
+                self.storage.pending_applied_structs.append(v)
         elif isinstance(v, StructData):
-            if v not in self.struct_datas:
+            structs = self.struct_index.setdefault(v.name, [])
+            registered = [i for i in structs if i == v]
+            if not registered:
+                structs.append(v)
                 self.struct_datas.append(v)
+                if self.storage is not None:
+                    # types in instantiations can be resolved to the new struct now
+                    self.storage.instantiations = {}
+                    self.storage.deduced_templates = {}
+                    self.storage.resolved_types = {}
+                    if self.storage.struct_names is not None:
+                        self.storage.struct_names.add(v.name)
                 if v.is_template():
                     self.applied_struct_datas[v] = []
             else:
+                check_symbol(registered[0], v)
                 raise KeyError(str(v))
         else:
             raise ValueError
 
     def get_function_data(self, fd: FunctionImage):
-        for f in self.function_datas:
+        for f in self.function_index.get((fd.name, len(fd.arg_types)), []):
             if f == fd:
                 return f
         return None
 
     def get_struct_data(self, name):
-        for s in self.struct_datas:
-            if s.name == name:
-                return s
-        return None
+        structs = self.struct_index.get(name)
+        return structs[0] if structs else None
 
 
 BUILD_IN_PACK = Package(Path([]), [])
 
 VOID_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "void", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "void", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "void", []))
 
 NOTYPE_T = TypeData.new_data(StructData(BUILD_IN_PACK, "notype", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "notype", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "notype", []))
 
 I32_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "i32", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "i32", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "i32", []))
 I64_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "i64", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "i64", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "i64", []))
 UI32_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "ui32", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "ui32", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "ui32", []))
 UI64_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "ui64", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "ui64", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "ui64", []))
 
 # SIZE_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "size", []), 0, [])
-# BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "size", []))
+# BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "size", []))
 USIZE_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "usize", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "usize", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "usize", []))
 
 F32_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "f32", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "f32", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "f32", []))
 F64_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "f64", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "f64", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "f64", []))
 
 CHAR_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "char", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "char", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "char", []))
 
 BOOL_T: Optional[TypeData] = TypeData.new_data(StructData(BUILD_IN_PACK, "bool", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "bool", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "bool", []))
 
 TYPE_T = TypeData.new_data(StructData(BUILD_IN_PACK, "type", []), 0, [], False)
-BUILD_IN_PACK.struct_datas.append(StructData(BUILD_IN_PACK, "type", []))
+BUILD_IN_PACK.register(StructData(BUILD_IN_PACK, "type", []))
 
 CHAR_ARR_T: Optional[TypeData] = None
 ARR_T: Optional[TypeData] = None
@@ -1011,6 +1758,15 @@ def find_char_arr_t(storage: GlobalStorage):
         CHAR_ARR_T.make_not_raw()
 
 
+def drop_foreign_arr_types(storage: GlobalStorage):
+    # array types are found once per process, ones of an earlier storage are found again
+    global ARR_T, CHAR_ARR_T
+    if ARR_T is not None and ARR_T.trace_package not in storage.all_packages:
+        ARR_T = None
+    if CHAR_ARR_T is not None and CHAR_ARR_T.trace_package not in storage.all_packages:
+        CHAR_ARR_T = None
+
+
 def get_arr_t():
     global ARR_T
     return ARR_T
@@ -1057,7 +1813,7 @@ class StructDeclaration(Declaration):
 
     def __init__(self, package: Package, name: str, fields: List[Tuple[str, RawType, str]], methods: list,
                  templates: List[RawType], is_extern: bool = False,
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         self.data = StructData(package, name, templates, is_extern)
         self.fields: List[Tuple[str, Union[TypeData, RawType], str]] = fields[:]
         for i, (mod, t, n) in enumerate(self.fields):
@@ -1123,16 +1879,19 @@ class StateException(Exception):
 class FunctionDeclaration(Declaration):
     def update_types(self):
         if not self.is_template():
-            try:
-                self.data.update_types()
-            except AnalyzerException as e:
-                log_error(e, self.data.package, self)
+            self.update_signature_types()
             if self.body is not None:
                 self.body.update_types()
 
+    def update_signature_types(self):
+        try:
+            self.data.update_types()
+        except AnalyzerException as e:
+            log_error(e, self.data.package, self)
+
     def __init__(self, package: Package, return_type: RawType, name: str,
                  argument_declaration: List[Tuple[RawType, str]], templates: List[RawType],
-                 body: Optional['FunctionBody'], is_safe: bool = True, position: Tuple[int, int, int, int] = None):
+                 body: Optional['FunctionBody'], is_safe: bool = True, position: Position = None):
 
         self.position = position
         self.arguments: List[Tuple[Union[RawType, TypeData], str]] = argument_declaration
@@ -1304,25 +2063,23 @@ class FunctionBody:
         self.visibility_stack = VisibilityStack()
 
     def is_valid(self) -> bool:
-        if not self.function.data.is_safe:
-            settings.switch_unsafe()
-        valid = True
-        if self.function.is_template():
-            raise StateException
-        self.visibility_stack.clear()
-        self.visibility_stack.push_level()
+        with settings.scope(self.function.data.is_safe):
+            valid = True
+            if self.function.is_template():
+                raise StateException
+            self.visibility_stack.clear()
+            self.visibility_stack.push_level()
 
-        args = self.function.get_arguments_as_variables()
-        for i in args:
-            self.visibility_stack.register_variable(i)
-        for expr in self.expressions:
-            try:
-                expr.check_valid()
-            except AnalyzerException as e:
-                valid = False
-                log_error(e, self.function.data.package, self.function)
+            args = self.function.get_arguments_as_variables()
+            for i in args:
+                self.visibility_stack.register_variable(i)
+            for expr in self.expressions:
+                try:
+                    expr.check_valid()
+                except AnalyzerException as e:
+                    valid = False
+                    log_error(e, self.function.data.package, self.function)
 
-        settings.switch_safe()
         return valid
 
     def simplify(self):
@@ -1455,9 +2212,7 @@ class FunctionBody:
             elif isinstance(expr, ReturnExpression):
                 #recursive(expr.expr, parent_exprs_list)
 
-                need_delete = []
-                for l in self.visibility_stack.levels[::-1]:
-                    need_delete += l
+                need_delete = self.visibility_stack.variables()
 
                 index = parent_exprs_list.index(expr)
                 if isinstance(expr.expr, VariableExpression):
@@ -1495,13 +2250,18 @@ class FunctionBody:
 
 
 class Expression:
-    def __init__(self, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, position: Optional[Position] = None):
         self.function_body: Optional[FunctionBody] = None
         self.position = position
 
     def get_out_type(self):
         raise NotImplementedError
 
+    def is_mut(self) -> bool:
+        # value can be set or pointed to, constness is a part of its type.
+        # Types are shared between expressions, so it isn't kept in them
+        return False
+
     def check_valid(self):
         raise NotImplementedError
 
@@ -1531,7 +2291,7 @@ class FunctionInvokeExpression(Expression):
             i.update_types()
 
     def __init__(self, path: Path, name: str, arguments: List[Expression], templates: List[RawType],
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         super().__init__(position)
 
         self.name = name
@@ -1550,9 +2310,7 @@ class FunctionInvokeExpression(Expression):
         if self.function is None:
             self.check_valid()
 
-        t = self.function.type
-        t.set_immutable()
-        return t
+        return self.function.type
 
     def gen_arg_auto_pack(self, types_may_be: List[TypeData]):
         for i, t_arg in enumerate(types_may_be):
@@ -1696,7 +2454,7 @@ class BinaryOperatorExpression(Expression):
         self.expr2.update_types()
 
     def __init__(self, expr1: Expression, expr2: Expression, operator: str,
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         super().__init__(position)
 
         self.expr1: Expression = expr1
@@ -1741,9 +2499,7 @@ class BinaryOperatorExpression(Expression):
 
     def get_out_type(self):
         self._try_find_function()
-        t = self.function.type
-        t.set_immutable()
-        return t
+        return self.function.type
 
     def check_valid(self):
         self.expr1.check_valid()
@@ -1790,7 +2546,7 @@ class UnaryOperatorExpression(Expression):
     def update_types(self):
         self.expr.update_types()
 
-    def __init__(self, expr: Expression, operator: str, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expr: Expression, operator: str, position: Optional[Position] = None):
         super().__init__(position)
 
         self.expr: Expression = expr
@@ -1830,9 +2586,7 @@ class UnaryOperatorExpression(Expression):
 
     def get_out_type(self):
         self._try_find_function()
-        t = self.function.type
-        t.set_immutable()
-        return t
+        return self.function.type
 
     def check_valid(self):
         self.expr.check_valid()
@@ -1876,7 +2630,7 @@ class VariableExpression(Expression):
     def update_types(self):
         pass
 
-    def __init__(self, name, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, name, position: Optional[Position] = None):
         super().__init__(position)
 
         self.name = name
@@ -1892,9 +2646,11 @@ class VariableExpression(Expression):
     def get_out_type(self):
         if self.type is None:
             self._get_type()
-        self.type.set_mutable()
         return self.type
 
+    def is_mut(self) -> bool:
+        return True
+
     def check_valid(self):
         if self.type is None:
             self._get_type()
@@ -1916,7 +2672,7 @@ class VariableExpression(Expression):
 
 class VariableCreationExpression(Expression):
     def __init__(self, name: str, expr: Optional[Expression] = None, required_type: RawType = NOTYPE_T.raw,
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         super().__init__(position)
 
         self.expr = expr
@@ -2024,7 +2780,7 @@ class ExpressionValueSetExpression(Expression):
         self.expr.update_types()
         self.to.update_types()
 
-    def __init__(self, to: Expression, expr: Expression, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, to: Expression, expr: Expression, position: Optional[Position] = None):
         super().__init__(position)
 
         self.to = to
@@ -2040,7 +2796,7 @@ class ExpressionValueSetExpression(Expression):
         self.expr.check_valid()
 
         if self.to.get_out_type() == self.expr.get_out_type():
-            if not self.to.get_out_type().is_mutable():
+            if not self.to.is_mut() or self.to.get_out_type().is_constant():
                 if self.to.get_out_type().is_constant():
                     text = f"can't set value to constant expression"
                 else:
@@ -2084,7 +2840,7 @@ class ReturnExpression(Expression):
     def update_types(self):
         self.expr.update_types()
 
-    def __init__(self, expr: Optional[Expression] = None, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expr: Optional[Expression] = None, position: Optional[Position] = None):
         super().__init__(position)
         self.expr = expr
 
@@ -2127,7 +2883,7 @@ class Constant(Expression):
     def update_types(self):
         self.type, self.value = self.process_value(self.src_value)
 
-    def __init__(self, value: str, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, value: str, position: Optional[Position] = None):
         super().__init__(position)
         self.type: Optional[TypeData] = None
         self.src_value = value
@@ -2209,7 +2965,6 @@ class Constant(Expression):
             raise NotImplementedError
 
     def get_out_type(self):
-        self.type.set_immutable()
         return self.type
 
     def check_valid(self):
@@ -2233,7 +2988,7 @@ class CastExpression(Expression):
         self.expr.update_types()
         self.cast_type.update_types()
 
-    def __init__(self, type_to: RawType, expr: Expression, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, type_to: RawType, expr: Expression, position: Optional[Position] = None):
         self.cast_type = TypeData.new_raw(type_to.src_pack, type_to)
         self.expr = expr
         self.function: Optional[FunctionData] = None
@@ -2244,12 +2999,12 @@ class CastExpression(Expression):
         self.expr.set_body(body)
 
     def _find_function(self):
-        functions = functions_by_path(Path([]), self.function_body.function.data.package)
         # TODO: make __cast_function normal name generation
-        fi = FunctionImage(f'__cast_{str(self.cast_type).replace(":", "_")}', [self.expr.get_out_type()],
-                           [])
-        if fi in functions:
-            self.function = functions[functions.index(fi)]
+        functions = find_function(self.function_body.function.data.package, Path([]),
+                                  f'__cast_{str(self.cast_type).replace(":", "_")}', [], [self.expr.get_out_type()],
+                                  allow_auto_pack=False)
+        if functions:
+            self.function = functions[0]
         else:
             self.function = None
 
@@ -2263,7 +3018,6 @@ class CastExpression(Expression):
             t = self.function.type
         else:
             t = self.cast_type
-        t.set_immutable()
         return t
 
     def check_valid(self):
@@ -2309,7 +3063,7 @@ class CastExpression(Expression):
 
 class StructConstructorExpression(Expression):
     def __init__(self, type: RawType, init_exprs: List[Expression],
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         self.type = TypeData.new_raw(type.src_pack, type)
         self.exprs = init_exprs
         super().__init__(position)
@@ -2320,7 +3074,6 @@ class StructConstructorExpression(Expression):
             e.set_body(body)
 
     def get_out_type(self):
-        self.type.set_immutable()
         return self.type
 
     def check_valid(self):
@@ -2376,7 +3129,7 @@ class StructConstructorExpression(Expression):
 
 
 class GetterExpression(Expression):
-    def __init__(self, from_: Expression, what: str, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, from_: Expression, what: str, position: Optional[Position] = None):
         super().__init__(position)
         self.expr = from_
         self.what = what
@@ -2432,9 +3185,11 @@ class GetterExpression(Expression):
             self.get_type()
             if self.type is None:
                 raise StateException
-        self.type.set_mutable()
         return self.type
 
+    def is_mut(self) -> bool:
+        return True
+
     def check_valid(self):
         self.expr.check_valid()
         if self.type is None:
@@ -2464,7 +3219,7 @@ class GetterExpression(Expression):
 
 
 class VisibilityAreaExpression(Expression):
-    def __init__(self, expressions: List[Expression], position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expressions: List[Expression], position: Optional[Position] = None):
         super().__init__(position)
         self.exprs = expressions
 
@@ -2510,7 +3265,7 @@ class VisibilityAreaExpression(Expression):
 class IfExpression(Expression):
     def __init__(self, expr: Expression, if_body: VisibilityAreaExpression,
                  else_body: Optional[VisibilityAreaExpression],
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         super().__init__(position)
         self.expr = expr
         self.if_body = if_body
@@ -2565,7 +3320,7 @@ class IfExpression(Expression):
 
 class WhileExpression(Expression):
     def __init__(self, expr: Expression, body: VisibilityAreaExpression,
-                 position: Optional[Tuple[int, int, int, int]] = None):
+                 position: Optional[Position] = None):
         super().__init__(position)
         self.expr = expr
         self.body = body
@@ -2619,7 +3374,7 @@ class WhileExpression(Expression):
 
 
 class PointerGetExpression(Expression):
-    def __init__(self, expr: Expression, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expr: Expression, position: Optional[Position] = None):
         super().__init__(position)
         self.expr = expr
         self.type: Optional[TypeData] = None
@@ -2631,20 +3386,17 @@ class PointerGetExpression(Expression):
     def get_out_type(self):
         if self.type is None:
             self.calc_type()
-        self.type.set_immutable()
         return self.type
 
     def calc_type(self):
         t: TypeData = self.expr.get_out_type()
-        self.type = TypeData.new_data(t.data, t.pointer_level + 1, t.templates, t.is_const)
-        self.type.is_mut = t.is_mut
+        self.type = t.with_pointer_level(t.pointer_level + 1)
 
     def check_valid(self):
         self.expr.check_valid()
         self.calc_type()
-        # TODO: may be wrong state after get_out_type
 
-        if not self.type.is_mut:
+        if not self.expr.is_mut():
             raise AnalyzerException(f"can't get pointer of immutable expression", self.position)
 
     def replace_template(self, template2type: Dict[RawType, TypeData]):
@@ -2666,7 +3418,7 @@ class PointerGetExpression(Expression):
 
 
 class PointerUnpackExpression(Expression):
-    def __init__(self, expr: Expression, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expr: Expression, position: Optional[Position] = None):
         super().__init__(position)
         self.expr = expr
         self.type: Optional[TypeData] = None
@@ -2678,12 +3430,14 @@ class PointerUnpackExpression(Expression):
     def get_out_type(self):
         if self.type is None:
             self.calc_type()
-        self.type.set_mutable()
         return self.type
 
+    def is_mut(self) -> bool:
+        return True
+
     def calc_type(self):
         t: TypeData = self.expr.get_out_type()
-        self.type = TypeData.new_data(t.data, t.pointer_level - 1, t.templates, t.is_const)
+        self.type = t.with_pointer_level(t.pointer_level - 1)
 
     def check_valid(self):
         self.expr.check_valid()
@@ -2716,7 +3470,7 @@ class PointerUnpackExpression(Expression):
 
 
 '''class TypeExpression(Expression):
-    def __init__(self, type: RawType, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, type: RawType, position: Optional[Position] = None):
         super().__init__(position)
         self.type = TypeData.new_raw(type.src_pack, type)
 
@@ -2741,7 +3495,7 @@ class PointerUnpackExpression(Expression):
 
 
 class UnsafeExpression(Expression):
-    def __init__(self, expr: Expression, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expr: Expression, position: Optional[Position] = None):
         super().__init__(position)
         self.expr = expr
 
@@ -2752,11 +3506,13 @@ class UnsafeExpression(Expression):
     def get_out_type(self):
         return self.expr.get_out_type()
 
+    def is_mut(self) -> bool:
+        return self.expr.is_mut()
+
     def check_valid(self):
         if settings.curr_is_safe():
-            settings.switch_unsafe()
-            self.expr.check_valid()
-            settings.switch_safe()
+            with settings.scope(False):
+                self.expr.check_valid()
         else:
             raise AnalyzerException(f"can't put unsafe under unsafe", self.position)
 
@@ -2808,7 +3564,7 @@ class UnsafeExpression(Expression):
 
 # TODO: сделать для Expression
 class SizeofExpression(Expression):
-    def __init__(self, type: RawType, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, type: RawType, position: Optional[Position] = None):
         super().__init__(position)
         self.type: TypeData = TypeData.new_raw(type.src_pack, type)
 
@@ -2838,7 +3594,7 @@ class SizeofExpression(Expression):
 
 
 class TypeidExpression(Expression):
-    def __init__(self, obj: Union[RawType, Expression], position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, obj: Union[RawType, Expression], position: Optional[Position] = None):
         super().__init__(position)
         self.obj = obj
         self.type: Optional[TypeData] = None
@@ -2883,7 +3639,7 @@ class TypeidExpression(Expression):
 
 
 class TypestrExpression(Expression):
-    def __init__(self, obj: Union[RawType, Expression], position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, obj: Union[RawType, Expression], position: Optional[Position] = None):
         super().__init__(position)
         self.obj = obj
         self.type: Optional[TypeData] = None
@@ -2931,7 +3687,7 @@ class TypestrExpression(Expression):
 
 
 class ArrayCreationExpression(Expression):
-    def __init__(self, exprs: List[Expression], position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, exprs: List[Expression], position: Optional[Position] = None):
         super().__init__(position)
         self.exprs = exprs
 
@@ -2999,7 +3755,7 @@ class ArrayCreationExpression(Expression):
 
 
 class VariableDestroyExpression(Expression):
-    def __init__(self, var_name: str, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, var_name: str, position: Optional[Position] = None):
         super().__init__(position)
         self.name = var_name
         self.function: Optional[FunctionData] = None
@@ -3007,10 +3763,7 @@ class VariableDestroyExpression(Expression):
     def _find_function(self, v: VariableData):
         path = v.type.data.package.path
 
-        type = v.type.copy()
-        type.pointer_level += 1
-        type.raw.pointer_level += 1
-        type.gen_hash()
+        type = v.type.with_pointer_level(v.type.pointer_level + 1)
 
         arg_types = [type]
 
@@ -3077,7 +3830,7 @@ class VariableDestroyExpression(Expression):
 
 
 class CopyExpression(Expression):
-    def __init__(self, expr: Expression, position: Optional[Tuple[int, int, int, int]] = None):
+    def __init__(self, expr: Expression, position: Optional[Position] = None):
         #if not (isinstance(expr, VariableExpression) or isinstance(expr, GetterExpression)):
         #    raise ValueError
 
@@ -3090,10 +3843,8 @@ class CopyExpression(Expression):
         self.expr.set_body(body)
 
     def _find_function(self):
-        type: TypeData = self.expr.get_out_type().copy()
-        type.pointer_level += 1
-        type.raw.pointer_level += 1
-        type.gen_hash()
+        t: TypeData = self.expr.get_out_type()
+        type = t.with_pointer_level(t.pointer_level + 1)
 
         path = type.data.package.path
 
@@ -3140,6 +3891,9 @@ class CopyExpression(Expression):
         else:
             return self.expr.get_out_type()
 
+    def is_mut(self) -> bool:
+        return self.function is None and self.expr.is_mut()
+
     def check_valid(self):
         self.expr.check_valid()
 
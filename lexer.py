@@ -1,4 +1,7 @@
-from ply.lex import lex, TOKEN
+import re
+from typing import Dict, Iterator, Tuple
+
+from ply.lex import lex, TOKEN, LexToken
 
 
 class Lexer(object):
@@ -110,3 +113,170 @@ class Lexer(object):
             if not tok:
                 break
             print(tok)
+
+
+
+class StreamLexer(object):
+    # same tokens as Lexer, but one master regex matched by re.finditer instead of ply's loop
+
+    # kinds of master regex groups
+    _NEWLINE, _SKIP, _LCOMMENT, _NUM, _ID, _STRING, _FIXED, _LITERAL, _ERROR = range(9)
+
+    # ply tries this string rules after t_NUM and t_ID, which always match the same text
+    _SHADOWED = ['t_FLOAT', 't_INT', 't_BOOL']
+
+    _master = None
+    _kinds: Dict[str, Tuple[int, str]] = {}
+    _fixed: Dict[str, str] = {}
+    _keywords: Dict[str, str] = {}
+
+    def __init__(self):
+        if StreamLexer._master is None:
+            StreamLexer._build_master()
+        self.lineno = 1
+        self.lexpos = 0
+        self.lexdata = ''
+        self._stream = iter(())
+
+    @staticmethod
+    def _uncapture(regex: str) -> str:
+        # inner groups are never read, and each capturing group slows down the whole alternation
+        out = []
+        in_class = False
+        i = 0
+        while i < len(regex):
+            c = regex[i]
+            if c == '\\':
+                out.append(regex[i:i + 2])
+                i += 2
+                continue
+            if in_class:
+                in_class = c != ']'
+            elif c == '[':
+                in_class = True
+            elif c == '(' and regex[i + 1:i + 2] != '?':
+                c = '(?:'
+            out.append(c)
+            i += 1
+        return ''.join(out)
+
+    @classmethod
+    def _build_master(cls):
+        # rules go in ply's order: functions as defined, then strings from the longest regex
+        funcs = []
+        strings = []
+        for name in dir(Lexer):
+            if not name.startswith('t_') or name in ('t_ignore', 't_error'):
+                continue
+            rule = getattr(Lexer, name)
+            if callable(rule):
+                funcs.append((rule.__code__.co_firstlineno, name, getattr(rule, 'regex', rule.__doc__)))
+            elif name not in cls._SHADOWED:
+                strings.append((name, rule))
+        funcs.sort()
+        strings.sort(key=lambda x: len(x[1]), reverse=True)
+
+        fast_kinds = {
+            't_newline': cls._NEWLINE,
+            't_COMMENT': cls._SKIP,
+            't_LCOMMENT': cls._LCOMMENT,
+            't_NUM': cls._NUM,
+            't_ID': cls._ID,
+        }
+
+        rules = []
+        for _, name, regex in funcs:
+            if name not in fast_kinds:
+                raise NotImplementedError(f"StreamLexer doesn't know rule {name}")
+            if name == 't_LCOMMENT':
+                # same as /\*(.|\n)*?\*/ without group per character
+                regex = r'/\*[\s\S]*?\*/'
+            rules.append((fast_kinds[name], name[2:], regex))
+
+        # rules without metacharacters (operators) become one group, from the longest text,
+        # so as in ply the longest operator wins
+        fixed = {}
+        for name, regex in strings:
+            if re.fullmatch(r'(\\[^0-9A-Za-z]|[^\\.^$*+?{}\[\]|()#\s])+', regex):
+                if not fixed:
+                    rules.append((cls._FIXED, '', None))
+                fixed[re.sub(r'\\(.)', r'\1', regex)] = name[2:]
+            else:
+                rules.append((cls._STRING, name[2:], regex))
+        fixed_regex = '|'.join(re.escape(i) for i in sorted(fixed, key=len, reverse=True))
+        rules = [(kind, name, fixed_regex if kind == cls._FIXED else regex) for kind, name, regex in rules]
+
+        rules.append((cls._LITERAL, '', '[' + re.escape(Lexer.literals) + ']'))
+        # not an ignored character, otherwise trailing t_ignore would become an error
+        rules.append((cls._ERROR, '', '[^' + re.escape(Lexer.t_ignore) + '\\n]'))
+
+        parts = []
+        kinds = {}
+        for n, (kind, name, regex) in enumerate(rules):
+            group = f'r{n}'
+            parts.append(f'(?P<{group}>{cls._uncapture(regex)})')
+            kinds[group] = (kind, name)
+        # ply skips t_ignore before trying rules, here it's eaten as a prefix of every match
+        ignore = '[' + re.escape(Lexer.t_ignore) + ']*'
+        cls._master = re.compile(ignore + '(?:' + '|'.join(parts) + ')', re.VERBOSE)
+        cls._kinds = kinds
+        cls._fixed = fixed
+
+        keywords = dict(Lexer.reserved)
+        keywords['true'] = keywords['false'] = 'BOOL'
+        for i in Lexer.access_modifiers:
+            keywords[i] = 'ACCMOD'
+        cls._keywords = keywords
+
+    def input(self, data: str):
+        self.lexdata = data
+        self.lexpos = 0
+        self._stream = self.tokenize(data)
+
+    def token(self):
+        return next(self._stream, None)
+
+    def clone(self) -> 'StreamLexer':
+        return StreamLexer()
+
+    def tokenize(self, data: str) -> Iterator[LexToken]:
+        NEWLINE, SKIP, LCOMMENT, NUM, ID, STRING, FIXED, LITERAL, ERROR = range(9)
+        kinds = self._kinds
+        fixed = self._fixed
+        keywords = self._keywords
+        lineno = self.lineno
+        for m in self._master.finditer(data, self.lexpos):
+            group = m.lastgroup
+            kind, name = kinds[group]
+            if kind == SKIP:
+                continue
+            value = m.group(group)
+            if kind == NEWLINE:
+                lineno += len(value)
+                continue
+            if kind == LCOMMENT:
+                lineno += value.count('\n')
+                continue
+
+            tok = LexToken()
+            tok.value = value
+            tok.lineno = lineno
+            tok.lexpos = m.start(group)
+            if kind == ID:
+                tok.type = keywords.get(value, 'ID')
+            elif kind == NUM:
+                tok.type = 'FLOAT' if '.' in value else 'INT'
+            elif kind == FIXED:
+                tok.type = fixed[value]
+            elif kind == STRING:
+                tok.type = name
+            elif kind == LITERAL:
+                tok.type = value
+            else:
+                print(f"Lexer error: illegal character {value}")
+                continue
+            self.lineno = lineno
+            self.lexpos = m.end()
+            yield tok
+        self.lineno = lineno
+        self.lexpos = len(data)
@@ -1,10 +1,12 @@
 from helpers2 import *
-from lexer import Lexer
-from parser3 import parse
+from frontend import parse_all, read_sources
+from parse_cache import ParseCache
+from build_db import BuildDatabase
 import os
 
 from codegen2 import gen_c_code
 from codegen_fatlang_debug import gen_fatlang_code
+from graphs import CallGraph, StructGraph
 
 if 0:
     type_dict = {
@@ -15,29 +17,42 @@ if 0:
     nt = TypeData.new_raw_templates(t, type_dict)
     print(nt)
     quit()
-l = Lexer()
-l.build()
 
 storage = GlobalStorage()
+cache = ParseCache('./.flcache')
+build = BuildDatabase('./.flbuild')
 storage.add_package(BUILD_IN_PACK)
 
-packs = []
-for i in os.listdir('./build-in'):
-    with open(f'./build-in/{i}', 'r') as file:
-       packs.append(parse(file.read(), storage))
+# bodies of functions are analyzed in that many processes, serial by default
+analysis_workers = int(os.environ.get('FATLANG_ANALYSIS_WORKERS', '1'))
 
+try:
+    packs = parse_all(read_sources('./build-in') + read_sources('./src'), storage, cache)
+    valid = storage.is_valid(build, analysis_workers)
+except SymbolCollisionException as e:
+    print(e)
+    valid = False
 
-for i in os.listdir('./src'):
-    with open(f'./src/{i}', 'r') as file:
-        packs.append(parse(file.read(), storage))
-
-
-if storage.is_valid():
+if valid:
     print("success")
-    code = gen_c_code(storage)
+    graphs_dir = os.environ.get('FATLANG_GRAPHS')
+    if graphs_dir:
+        os.makedirs(graphs_dir, exist_ok=True)
+        for name, graph in (('calls', CallGraph(storage, build.callees)), ('structs', StructGraph(storage))):
+            with open(os.path.join(graphs_dir, name + '.dot'), 'w') as file:
+                file.write(graph.to_dot(name))
+            with open(os.path.join(graphs_dir, name + '.json'), 'w') as file:
+                file.write(graph.to_json())
+    try:
+        code = gen_c_code(storage, build=build)
+    except SymbolCollisionException as e:
+        print(e)
+        print("error, can't build code")
+        exit(1)
     #print(code)
     with open("./gcc_gens/test.c", 'w') as file:
         file.write(code)
+    build.save()
 
 else:
     print("error, can't build code")
@@ -0,0 +1,132 @@
+import contextlib
+import io
+import multiprocessing
+import pickle
+import sys
+
+from helpers2 import *
+
+# Workers are forked after types are resolved, so they see the same storage. A worker analyzes its
+# functions in order and ships back each body, the output and the applied datas it registered.
+# Objects of the storage are pickled as indices into a list both processes built before the fork,
+# applied datas as their template and types, they are applied again on load.
+# Main process merges results in order of functions, so registration order and output are the same
+# as in serial analysis. Functions the build database has results for are left to main process.
+
+_storage: Optional[GlobalStorage] = None
+_functions: List[FunctionDeclaration] = []
+_build: Optional['BuildDatabase'] = None
+_objects: List[object] = []
+_object_ids: Dict[int, int] = {}
+
+
+def _shared_objects(storage: GlobalStorage) -> List[object]:
+    objects: List[object] = []
+    for p in storage.all_packages:
+        objects.append(p)
+        objects += p.function_datas
+        objects += p.struct_datas
+        for applied in p.applied_function_datas.values():
+            objects += applied
+        for applied in p.applied_struct_datas.values():
+            objects += applied
+    declarations: List[Declaration] = storage.struct_declarations + storage.function_declarations
+    for applied in storage.applied_struct_declarations.values():
+        declarations += applied
+    for applied in storage.applied_function_declarations.values():
+        declarations += applied
+    for d in declarations:
+        objects += [d, d.data]
+        if isinstance(d, FunctionDeclaration) and d.body is not None:
+            objects.append(d.body)
+    return objects
+
+
+def _shared(i: int) -> object:
+    return _objects[i]
+
+
+def _applied(src: Union[FunctionData, StructData], templates: List[TypeData]) -> Data:
+    applied = src.apply_template(templates)
+    if applied.hash not in applied.package.applied_hashes:
+        applied.package.register(applied)
+    return applied
+
+
+class _Pickler(pickle.Pickler):
+    # reduced objects are memoized, so each shared or applied one is loaded once per result
+    def reducer_override(self, obj):
+        i = _object_ids.get(id(obj))
+        if i is not None:
+            return _shared, (i,)
+        if isinstance(obj, AppliedFunctionData):
+            return _applied, (obj.src_function, obj.applied_templates)
+        if isinstance(obj, AppliedStructData):
+            return _applied, (obj.src_sd, obj.applied_templates)
+        return NotImplemented
+
+
+def _analyze_worker(chunk: Tuple[int, int]) -> List[Optional[bytes]]:
+    results = []
+    for n in range(*chunk):
+        f = _functions[n]
+        if _build is not None and _build.is_reusable(f):
+            results.append(None)
+            continue
+        _storage.applied_log = []
+        _storage.lookup_log = set()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            valid = f.is_valid()
+        # the log goes first, so applied datas are registered on load in the order they were here
+        result = (_storage.applied_log, _storage.lookup_log, bool(valid), out.getvalue(),
+                  f.body.expressions if f.body else None)
+        data = io.BytesIO()
+        try:
+            _Pickler(data, pickle.HIGHEST_PROTOCOL).dump(result)
+            results.append(data.getvalue())
+        except RecursionError:
+            # too deep to ship back, main process analyzes it by itself
+            results.append(None)
+    return results
+
+
+def _analyze(f: FunctionDeclaration, build: Optional['BuildDatabase']) -> bool:
+    return build.analyze(f) if build is not None else f.is_valid()
+
+
+def analyze_functions(storage: GlobalStorage, functions: List[FunctionDeclaration], workers: int,
+                      build: Optional['BuildDatabase'] = None) -> bool:
+    global _storage, _functions, _build, _objects, _object_ids
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return all([_analyze(f, build) for f in functions])
+
+    # ones of an earlier storage can't be shared with workers
+    drop_foreign_arr_types(storage)
+
+    _storage, _functions, _build = storage, functions, build
+    _objects = _shared_objects(storage)
+    _object_ids = {id(o): i for i, o in enumerate(_objects)}
+
+    chunksize = max(1, len(functions) // (workers * 4))
+    chunks = [(n, min(n + chunksize, len(functions))) for n in range(0, len(functions), chunksize)]
+    # buffered output would be written again by every worker
+    sys.stdout.flush()
+    valid = True
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            for (start, _), results in zip(chunks, pool.imap(_analyze_worker, chunks)):
+                for f, data in zip(functions[start:], results):
+                    if data is None:
+                        valid *= _analyze(f, build)
+                        continue
+                    applied, lookups, function_valid, output, expressions = pickle.loads(data)
+                    sys.stdout.write(output)
+                    if f.body is not None:
+                        f.body.expressions = expressions
+                    if build is not None:
+                        build.record(f, function_valid, output, applied, lookups)
+                    valid *= function_valid
+    finally:
+        _storage, _functions, _build, _objects, _object_ids = None, [], None, [], {}
+    return bool(valid)
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pickle
+
+from helpers2 import *
+
+CACHE_FORMAT = '1'
+
+# cache entries are dropped when any of this modules changes
+_SALT_SOURCES = ['helpers2.py', 'parser3.py', 'lexer.py', 'parse_cache.py']
+
+
+def gen_salt(cache_format: str, sources: List[str]) -> bytes:
+    h = hashlib.sha256((cache_format + SYMBOL_HASH).encode())
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in sources:
+        with open(os.path.join(root, name), 'rb') as file:
+            h.update(file.read())
+    return h.digest()
+
+
+class PackageSnapshot:
+    def __init__(self, package: Package, struct_declarations: List['StructDeclaration'],
+                 function_declarations: List['FunctionDeclaration'],
+                 casts: List[Tuple[Package, RawType, Tuple[RawType, str], 'FunctionBody']]):
+        self.package = package
+        self.struct_declarations = struct_declarations
+        self.function_declarations = function_declarations
+        self.casts = casts
+
+    def install(self, storage: GlobalStorage, index: Optional[int] = None) -> Package:
+        p = self.package
+        # datas are registered again together with their declarations
+        p.function_datas = []
+        p.struct_datas = []
+        p.function_index = {}
+        p.struct_index = {}
+        p.applied_function_datas = {}
+        p.applied_struct_datas = {}
+        p.applied_hashes = {}
+
+        storage.add_package(p, index)
+        for s in self.struct_declarations:
+            storage.register(s)
+        for f in self.function_declarations:
+            storage.register(f)
+        for c in self.casts:
+            storage._register_cast(c)
+        return p
+
+
+class ParseCache:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.salt = gen_salt(CACHE_FORMAT, _SALT_SOURCES)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, source: str) -> str:
+        key = hashlib.sha256(self.salt + source.encode()).hexdigest()
+        return os.path.join(self.directory, key + '.pkl')
+
+    def load(self, source: str) -> Optional[PackageSnapshot]:
+        try:
+            with open(self._path(source), 'rb') as file:
+                snapshot = pickle.load(file)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # broken entry, it'll be rewritten after real parse
+            self.misses += 1
+            return None
+        self.hits += 1
+        return snapshot
+
+    def store(self, source: str, snapshot: PackageSnapshot):
+        try:
+            data = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(source)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
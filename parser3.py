@@ -1,32 +1,30 @@
+import copy
+import os
+import pickle
+
 import ply.yacc as yacc
 from helpers2 import *
 
-from lexer import Lexer
+from lexer import Lexer, StreamLexer
+from parse_cache import ParseCache, PackageSnapshot
 
 tokens = Lexer.tokens
 
 lexer = Lexer()
 lexer.build()
 
+# FATLANG_LEXER=stream switches sessions to StreamLexer, it gives the same tokens
+STREAM_LEXER = os.environ.get('FATLANG_LEXER', 'ply') == 'stream'
+
 tokens = Lexer.tokens
 used_types = []
 
-PACKAGE: Optional[Package] = None
-STORAGE: Optional[GlobalStorage] = None
-SOURCE: Optional[str] = None
-
-
-def parser_log_error(text, pos):
-    log_error(AnalyzerException(text, pos), PACKAGE, None)
-    exit(1)
-
 
-def getpos(p, n=1, max=None) -> Tuple[int, int, int, int]:
+def getpos(p, n=1, max=None) -> Position:
     if max is None:
         max = len(p) - 1
-    _, end_line = p.linespan(max)
     _, end_pos = p.lexspan(max)
-    return p.lineno(n), p.lexpos(n), end_line, end_pos
+    return make_pos(p.lexpos(n), end_pos)
 
 
 precedence = (
@@ -45,8 +43,7 @@ precedence = (
 
 
 def p_error(p):
-    log_error(AnalyzerException(f"can't parse this fragment of code", (p.lineno, p.lexpos, p.lineno, p.lexpos)),
-              PACKAGE, None)
+    # never called, every ParserSession replaces it with ParserSession.error
     exit(1)
 
 
@@ -64,10 +61,10 @@ def p_package_declaration(p):
     else:
         path = Path(p[2])
 
-    global PACKAGE
-    PACKAGE = Package(path, [])
-    PACKAGE.sources = SOURCE
-    STORAGE.add_package(PACKAGE)
+    session = p.parser.session
+    session.package = Package(path, [])
+    session.package.sources = session.source
+    session.storage.add_package(session.package)
 
 
 def p_package_complicated_name1(p):
@@ -91,10 +88,11 @@ def p_import_declarations(p):
                            | import-declaration
                            |
     """
+    session = p.parser.session
     if len(p) == 2:
-        PACKAGE.imports.append(p[1])
+        session.package.imports.append(p[1])
     elif len(p) == 3:
-        PACKAGE.imports.append(p[2])
+        session.package.imports.append(p[2])
 
 
 def p_import_declaration(p):
@@ -119,47 +117,51 @@ def p_main_function_declaration1(p):
     """main : ID ID function-arguments function-body
             | complicated-type ID function-arguments function-body
     """
+    session = p.parser.session
     ret_type = p[1]
     if type(ret_type) == str:
-        ret_type = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        ret_type = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, ret_type, p[2], p[3], [], p[4], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, ret_type, p[2], p[3], [], p[4], True, getpos(p))
+    session.register(f)
 
 
 def p_main_function_declaration2(p):
     """main : ID ID template-declaration function-arguments function-body
             | complicated-type ID template-declaration function-arguments function-body
     """
+    session = p.parser.session
     ret_type = p[1]
     if type(ret_type) == str:
-        ret_type = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        ret_type = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, ret_type, p[2], p[4], p[3], p[5], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, ret_type, p[2], p[4], p[3], p[5], True, getpos(p))
+    session.register(f)
 
 def p_main_function_declaration3(p):
     """main : UNSAFE ID ID function-arguments function-body
             | UNSAFE complicated-type ID function-arguments function-body
     """
+    session = p.parser.session
     ret_type = p[2]
     if type(ret_type) == str:
-        ret_type = RawType(Path([]), p[2], 0, [], PACKAGE, getpos(p, 2, 2))
+        ret_type = RawType(Path([]), p[2], 0, [], session.package, getpos(p, 2, 2))
 
-    f = FunctionDeclaration(PACKAGE, ret_type, p[3], p[4], [], p[5], False, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, ret_type, p[3], p[4], [], p[5], False, getpos(p))
+    session.register(f)
 
 
 def p_main_function_declaration4(p):
     """main : UNSAFE ID ID template-declaration function-arguments function-body
             | UNSAFE complicated-type ID template-declaration function-arguments function-body
     """
+    session = p.parser.session
     ret_type = p[2]
     if type(ret_type) == str:
-        ret_type = RawType(Path([]), p[2], 0, [], PACKAGE, getpos(p, 2, 2))
+        ret_type = RawType(Path([]), p[2], 0, [], session.package, getpos(p, 2, 2))
 
-    f = FunctionDeclaration(PACKAGE, ret_type, p[3], p[5], p[4], p[6], False, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, ret_type, p[3], p[5], p[4], p[6], False, getpos(p))
+    session.register(f)
     
 def p_main_operator_declaration1(p):
     """main : ID OPERATOR binary-operator function-arguments function-body
@@ -171,12 +173,13 @@ def p_main_operator_declaration1(p):
             | complicated-type OPERATOR LS function-arguments function-body
             | complicated-type OPERATOR GR function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, f'__binary_operator_{operator_to_text(p[3])}', p[4], [], p[5], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, f'__binary_operator_{operator_to_text(p[3])}', p[4], [], p[5], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration2(p):
     """main : ID OPERATOR binary-operator template-declaration function-arguments function-body
@@ -188,12 +191,13 @@ def p_main_operator_declaration2(p):
             | complicated-type OPERATOR LS template-declaration function-arguments function-body
             | complicated-type OPERATOR GR template-declaration function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, f'__binary_operator_{operator_to_text(p[3])}', p[5], p[4], p[6], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, f'__binary_operator_{operator_to_text(p[3])}', p[5], p[4], p[6], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration3(p):
     """main : ID OPERATOR binary-operator '(' ')' function-arguments function-body
@@ -201,12 +205,13 @@ def p_main_operator_declaration3(p):
             | complicated-type OPERATOR binary-operator '(' ')' function-arguments function-body
             | complicated-type OPERATOR '!' '(' ')' function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, f'__unary_operator_{operator_to_text(p[3])}', p[6], [], p[7], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, f'__unary_operator_{operator_to_text(p[3])}', p[6], [], p[7], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration31(p):
     """main : ID OPERATOR binary-operator '(' ')' template-declaration function-arguments function-body
@@ -214,95 +219,104 @@ def p_main_operator_declaration31(p):
             | complicated-type OPERATOR binary-operator '(' ')' template-declaration function-arguments function-body
             | complicated-type OPERATOR '!' '(' ')' template-declaration function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, f'__unary_operator_{operator_to_text(p[3])}', p[7], p[6], p[8], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, f'__unary_operator_{operator_to_text(p[3])}', p[7], p[6], p[8], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration4(p):
     """main : ID OPERATOR '(' ')' function-arguments function-body
             | complicated-type OPERATOR '(' ')' function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    STORAGE._register_cast((PACKAGE, t, p[5][0], p[6]))  # TODO: make normally
+    session.register_cast((session.package, t, p[5][0], p[6]))  # TODO: make normally
 
 def p_main_operator_declaration5(p):
     """main : OPERATOR '~' function-arguments function-body
     """
+    session = p.parser.session
     t = VOID_T.raw.copy()
     t.position = getpos(p)
 
-    f = FunctionDeclaration(PACKAGE, t, '__destructor', p[3], [], p[4], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, '__destructor', p[3], [], p[4], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration6(p):
     """main : OPERATOR '~' template-declaration function-arguments function-body
     """
+    session = p.parser.session
     t = VOID_T.raw.copy()
     t.position = getpos(p)
 
-    f = FunctionDeclaration(PACKAGE, t, '__destructor', p[4], p[3], p[5], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, '__destructor', p[4], p[3], p[5], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration7(p):
     """main : ID OPERATOR '[' ']' function-arguments function-body
             | complicated-type OPERATOR '[' ']' function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, '__binary_operator_square_brackets', p[5], [], p[6], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, '__binary_operator_square_brackets', p[5], [], p[6], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration8(p):
     """main : ID OPERATOR '[' ']' template-declaration function-arguments function-body
             | complicated-type OPERATOR '[' ']' template-declaration function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, '__binary_operator_square_brackets', p[6], p[5], p[7], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, '__binary_operator_square_brackets', p[6], p[5], p[7], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration9(p):
     """main : ID OPERATOR '=' function-arguments function-body
             | complicated-type OPERATOR '=' function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, f'__copy', p[4], [], p[5], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, f'__copy', p[4], [], p[5], True, getpos(p))
+    session.register(f)
 
 def p_main_operator_declaration10(p):
     """main : ID OPERATOR '=' template-declaration function-arguments function-body
             | complicated-type OPERATOR '=' template-declaration function-arguments function-body
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
-    f = FunctionDeclaration(PACKAGE, t, f'__copy', p[5], p[4], p[6], True, getpos(p))
-    STORAGE.register(f)
+    f = FunctionDeclaration(session.package, t, f'__copy', p[5], p[4], p[6], True, getpos(p))
+    session.register(f)
 
 
 def p_main_extern_function_declaration(p):
     """main : EXTERN ID ID function-arguments ';'
             | EXTERN complicated-type ID function-arguments ';'
     """
+    session = p.parser.session
     t = p[2]
     if type(t) == str:
-        t = RawType(Path([]), p[2], 0, [], PACKAGE, getpos(p, 2, 2))
-    f = FunctionDeclaration(PACKAGE, t, p[3], p[4], [], None, False, getpos(p))
-    STORAGE.register(f)
+        t = RawType(Path([]), p[2], 0, [], session.package, getpos(p, 2, 2))
+    f = FunctionDeclaration(session.package, t, p[3], p[4], [], None, False, getpos(p))
+    session.register(f)
 
 
 def p_complicated_type1(p):
@@ -310,24 +324,26 @@ def p_complicated_type1(p):
                         | package-complicated-name ':' ID TIMES
                         | package-complicated-name ':' ID complicated-pointer-level
     """
+    session = p.parser.session
     if len(p) == 4:
-        p[0] = RawType(Path(p[1]), p[3], 0, [], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path(p[1]), p[3], 0, [], session.package, getpos(p), False)
     elif type(p[4]) == str:
-        p[0] = RawType(Path(p[1]), p[3], 1, [], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path(p[1]), p[3], 1, [], session.package, getpos(p), False)
     else:
-        p[0] = RawType(Path(p[1]), p[3], p[4], [], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path(p[1]), p[3], p[4], [], session.package, getpos(p), False)
 
 def p_complicated_type2(p):
     """complicated-type : ID ':' ID
                         | ID ':' ID TIMES
                         | ID ':' ID complicated-pointer-level
     """
+    session = p.parser.session
     if len(p) == 4:
-        p[0] = RawType(Path([p[1]]), p[3], 0, [], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path([p[1]]), p[3], 0, [], session.package, getpos(p), False)
     elif type(p[4]) == str:
-        p[0] = RawType(Path([p[1]]), p[3], 1, [], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path([p[1]]), p[3], 1, [], session.package, getpos(p), False)
     else:
-        p[0] = RawType(Path([p[1]]), p[3], p[4], [], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path([p[1]]), p[3], p[4], [], session.package, getpos(p), False)
 
 
 def p_complicated_type3(p):
@@ -335,24 +351,26 @@ def p_complicated_type3(p):
                         | package-complicated-name ':' ID template-declaration TIMES
                         | package-complicated-name ':' ID template-declaration complicated-pointer-level
     """
+    session = p.parser.session
     if len(p) == 5:
-        p[0] = RawType(Path(p[1]), p[3], 0, p[4], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path(p[1]), p[3], 0, p[4], session.package, getpos(p), False)
     elif type(p[5]) == str:
-        p[0] = RawType(Path(p[1]), p[3], 1, p[4], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path(p[1]), p[3], 1, p[4], session.package, getpos(p), False)
     else:
-        p[0] = RawType(Path(p[1]), p[3], p[4], p[4], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path(p[1]), p[3], p[4], p[4], session.package, getpos(p), False)
 
 def p_complicated_type4(p):
     """complicated-type : ID ':' ID template-declaration
                         | ID ':' ID template-declaration TIMES
                         | ID ':' ID template-declaration complicated-pointer-level
     """
+    session = p.parser.session
     if len(p) == 5:
-        p[0] = RawType(Path([p[1]]), p[3], 0, p[4], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path([p[1]]), p[3], 0, p[4], session.package, getpos(p), False)
     elif type(p[5]) == str:
-        p[0] = RawType(Path([p[1]]), p[3], 1, p[4], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path([p[1]]), p[3], 1, p[4], session.package, getpos(p), False)
     else:
-        p[0] = RawType(Path([p[1]]), p[3], p[4], p[4], PACKAGE, getpos(p), False)
+        p[0] = RawType(Path([p[1]]), p[3], p[4], p[4], session.package, getpos(p), False)
 
 
 def p_complicated_type5(p):
@@ -360,24 +378,26 @@ def p_complicated_type5(p):
                         | ID template-declaration TIMES
                         | ID template-declaration complicated-pointer-level
     """
+    session = p.parser.session
     path = Path([])
     if len(p) == 3:
-        p[0] = RawType(path, p[1], 0, p[2], PACKAGE, getpos(p), False)
+        p[0] = RawType(path, p[1], 0, p[2], session.package, getpos(p), False)
     elif type(p[3]) == str:
-        p[0] = RawType(path, p[1], 1, p[2], PACKAGE, getpos(p), False)
+        p[0] = RawType(path, p[1], 1, p[2], session.package, getpos(p), False)
     else:
-        p[0] = RawType(path, p[1], p[3], p[2], PACKAGE, getpos(p), False)
+        p[0] = RawType(path, p[1], p[3], p[2], session.package, getpos(p), False)
 
 
 def p_complicated_type6(p):
     """complicated-type : ID TIMES
                         | ID complicated-pointer-level
     """
+    session = p.parser.session
     path = Path([])
     if type(p[2]) == str:
-        p[0] = RawType(path, p[1], 1, [], PACKAGE, getpos(p), False)
+        p[0] = RawType(path, p[1], 1, [], session.package, getpos(p), False)
     else:
-        p[0] = RawType(path, p[1], p[2], [], PACKAGE, getpos(p), False)
+        p[0] = RawType(path, p[1], p[2], [], session.package, getpos(p), False)
 
 def p_complicated_type7(p):
     """complicated-type : CONST complicated-type"""
@@ -405,7 +425,8 @@ def p_template_declaration1(p):
 def p_template_declaration2(p):
     """template-declaration : LS ID GR
     """
-    p[0] = [RawType(Path([]), p[2], 0, [], PACKAGE, getpos(p, 2, 2))]
+    session = p.parser.session
+    p[0] = [RawType(Path([]), p[2], 0, [], session.package, getpos(p, 2, 2))]
 
 
 def p_template_declaration3(p):
@@ -418,9 +439,10 @@ def p_template_declaration_body1(p):
     """template-declaration-body : template-declaration-body ',' ID
                                 | template-declaration-body ',' complicated-type
     """
+    session = p.parser.session
     p[0] = p[1]
     if type(p[3]) == str:
-        p[0].append(RawType(Path([]), p[3], 0, [], PACKAGE, getpos(p, 3, 3)))
+        p[0].append(RawType(Path([]), p[3], 0, [], session.package, getpos(p, 3, 3)))
     else:
         p[0].append(p[3])
 
@@ -429,10 +451,11 @@ def p_template_declaration_body2(p):
     """template-declaration-body :  ID ',' ID
                                 | complicated-type ',' ID
     """
-    t2 = RawType(Path([]), p[3], 0, [], PACKAGE, getpos(p, 3, 3))
+    session = p.parser.session
+    t2 = RawType(Path([]), p[3], 0, [], session.package, getpos(p, 3, 3))
     t1 = p[1]
     if type(t1) == str:
-        t1 = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t1 = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
     p[0] = [t1, t2]
 
@@ -441,10 +464,11 @@ def p_template_declaration_body3(p):
     """template-declaration-body : ID ',' complicated-type
                                 | complicated-type ',' complicated-type
     """
+    session = p.parser.session
     t2 = p[3]
     t1 = p[1]
     if type(t1) == str:
-        t1 = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t1 = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
     p[0] = [t1, t2]
 
@@ -474,8 +498,9 @@ def p_function_argument(p):
     """function-argument : ID ID
                         | complicated-type ID
     """
+    session = p.parser.session
     if type(p[1]) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
     else:
         t = p[1]
 
@@ -492,22 +517,25 @@ def p_function_body(p):
 
 def p_struct_declaration1(p):
     """main : STRUCT ID struct-body"""
+    session = p.parser.session
     fields, methods = p[3], []
-    struct = StructDeclaration(PACKAGE, p[2], fields, methods, [], False, getpos(p))
-    STORAGE.register(struct)
+    struct = StructDeclaration(session.package, p[2], fields, methods, [], False, getpos(p))
+    session.register(struct)
 
 
 def p_struct_declaration2(p):
     """main : STRUCT ID template-declaration struct-body"""
+    session = p.parser.session
     fields, methods = p[4], []
-    struct = StructDeclaration(PACKAGE, p[2], fields, methods, p[3], False, getpos(p))
-    STORAGE.register(struct)
+    struct = StructDeclaration(session.package, p[2], fields, methods, p[3], False, getpos(p))
+    session.register(struct)
 
 def p_extern_struct_declaration1(p):
     """main : EXTERN STRUCT ID struct-body"""
+    session = p.parser.session
     fields, methods = p[4], []
-    struct = StructDeclaration(PACKAGE, p[3], fields, methods, [], True, getpos(p))
-    STORAGE.register(struct)
+    struct = StructDeclaration(session.package, p[3], fields, methods, [], True, getpos(p))
+    session.register(struct)
 
 
 def p_struct_body(p):
@@ -530,18 +558,20 @@ def p_struct_field1(p):
     """struct-field : ID ID ';'
                     | complicated-type ID ';'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
     p[0] = ('public', t, p[2])
 
 def p_struct_field2(p):
     """struct-field : ACCMOD ID ID ';'
                     | ACCMOD complicated-type ID ';'
     """
+    session = p.parser.session
     t = p[2]
     if type(t) == str:
-        t = RawType(Path([]), p[2], 0, [], PACKAGE, getpos(p, 2, 2))
+        t = RawType(Path([]), p[2], 0, [], session.package, getpos(p, 2, 2))
     p[0] = (p[1], t, p[3])
 
 
@@ -591,9 +621,10 @@ def p_variable_declaration1(p):
     """variable-declaration : ID ID ';'
                             | complicated-type ID ';'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
     p[0] = VariableCreationExpression(p[2], None, t, getpos(p))
 
 
@@ -601,9 +632,10 @@ def p_variable_declaration2(p):
     """variable-declaration : ID ID '=' ID ';'
                             | complicated-type ID '=' ID ';'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
     expr = VariableExpression(p[4], getpos(p, 4, 4))
     p[0] = VariableCreationExpression(p[2], expr, t, getpos(p))
@@ -613,9 +645,10 @@ def p_variable_declaration3(p):
     """variable-declaration : ID ID '=' complicated-expression ';'
                             | complicated-type ID '=' complicated-expression ';'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
     p[0] = VariableCreationExpression(p[2], p[4], t, getpos(p))
 
 def p_variable_declaration4(p):
@@ -697,9 +730,10 @@ def p_struct_construct_expression1(p):
     """complicated-expression : ID '{' invoke-arguments-list '}'
                                 | complicated-type '{' invoke-arguments-list '}'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
     p[0] = StructConstructorExpression(t, p[3], getpos(p))
 
@@ -709,9 +743,10 @@ def p_struct_construct_expression2(p):
                                 | complicated-type '{' ID '}'
                                 | complicated-type '{' complicated-expression '}'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
     expr = p[3]
     if type(expr) == str:
@@ -723,9 +758,10 @@ def p_struct_construct_expression3(p):
     """complicated-expression : ID '{' '}'
                                 | complicated-type '{' '}'
     """
+    session = p.parser.session
     t = p[1]
     if type(t) == str:
-        t = RawType(Path([]), p[1], 0, [], PACKAGE, getpos(p, 1, 1))
+        t = RawType(Path([]), p[1], 0, [], session.package, getpos(p, 1, 1))
 
     p[0] = StructConstructorExpression(t, [], getpos(p))
 
@@ -816,9 +852,10 @@ def p_sizeof_expression(p):
     """complicated-expression : SIZEOF '(' ID ')'
                             | SIZEOF '(' complicated-type ')'
     """
+    session = p.parser.session
     t = p[3]
     if type(t) == str:
-        t = RawType(Path([]), p[3], 0, [], PACKAGE, getpos(p, 3, 3))
+        t = RawType(Path([]), p[3], 0, [], session.package, getpos(p, 3, 3))
     p[0] = SizeofExpression(t, getpos(p))  # TODO: typeid & typestr
 
 def p_function_invoke_expression1(p):
@@ -979,7 +1016,8 @@ def p_complicated_expression6(p):
     """complicated-expression : '(' ID ')' ID %prec CAST
                             | '(' ID ')' complicated-expression %prec CAST
     """
-    t = RawType(Path([]), p[2], 0, [], PACKAGE, getpos(p, 2, 2))
+    session = p.parser.session
+    t = RawType(Path([]), p[2], 0, [], session.package, getpos(p, 2, 2))
     expr = p[4]
     if type(expr) == str:
         expr = VariableExpression(p[4], getpos(p, 4, 4))
@@ -1043,17 +1081,88 @@ def p_binary_operator(p):
     p[0] = p[1]
 
 
-parser = yacc.yacc()
-
-
-def parse(t: str, storage: GlobalStorage):
-    global STORAGE, SOURCE
-    SOURCE = t
-    STORAGE = storage
-    lexer.lexer.lineno = 0
-    lexer.lexer.lexpos = 0
-    parser.parse(t, lexer=lexer.lexer, tracking=True)# , debug=True)
-    return PACKAGE
+# FATLANG_PARSER_DEBUG=1 validates the grammar and rewrites parsetab.py and parser.out as before.
+# Otherwise frozen tables from parsetab.pickle are loaded: it's much cheaper than compiling parsetab.py
+# and nothing is written unless the pickle is stale
+PARSER_DEBUG = os.environ.get('FATLANG_PARSER_DEBUG', '') == '1'
+PARSETAB_PICKLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parsetab.pickle')
+
+yacc.pickle_protocol = pickle.HIGHEST_PROTOCOL
+if PARSER_DEBUG:
+    parser = yacc.yacc()
+else:
+    parser = yacc.yacc(debug=False, write_tables=False, picklefile=PARSETAB_PICKLE, errorlog=yacc.NullLogger())
+
+
+class ParserSession:
+    def __init__(self, storage: Optional[GlobalStorage] = None, cache: Optional[ParseCache] = None):
+        # without storage the session registers everything into its own one
+        self.storage = storage if storage is not None else GlobalStorage()
+        self.cache = cache
+
+        self.package: Optional[Package] = None
+        self.source: Optional[str] = None
+        self.struct_declarations: List[StructDeclaration] = []
+        self.function_declarations: List[FunctionDeclaration] = []
+        self.casts: List[Tuple[Package, RawType, Tuple[RawType, str], FunctionBody]] = []
+
+        # tables are shared, parsing state is not
+        self.lexer = StreamLexer() if STREAM_LEXER else lexer.lexer.clone()
+        self.parser = copy.copy(parser)
+        self.parser.session = self
+        self.parser.errorfunc = self.error
+
+    def register(self, v: Declaration):
+        self.storage.register(v)
+        if isinstance(v, StructDeclaration):
+            self.struct_declarations.append(v)
+        else:
+            self.function_declarations.append(v)
+
+    def register_cast(self, d: Tuple[Package, RawType, Tuple[RawType, str], FunctionBody]):
+        self.storage._register_cast(d)
+        self.casts.append(d)
+
+    def log_error(self, text, pos):
+        log_error(AnalyzerException(text, pos), self.package, None)
+        exit(1)
+
+    def error(self, p):
+        if p is None:
+            pos = len(self.source)
+            self.log_error(f"unexpected end of code", make_pos(pos, pos))
+        self.log_error(f"can't parse this fragment of code", make_pos(p.lexpos, p.lexpos))
+
+    def snapshot(self) -> PackageSnapshot:
+        return PackageSnapshot(self.package, self.struct_declarations, self.function_declarations, self.casts)
+
+    def parse(self, t: str) -> Package:
+        if self.cache is not None:
+            snapshot = self.cache.load(t)
+            if snapshot is not None:
+                self.package = snapshot.install(self.storage)
+                self.struct_declarations = snapshot.struct_declarations
+                self.function_declarations = snapshot.function_declarations
+                self.casts = snapshot.casts
+                return self.package
+
+        self.source = t
+        self.package = None
+        self.struct_declarations = []
+        self.function_declarations = []
+        self.casts = []
+
+        self.lexer.lineno = 0
+        self.lexer.lexpos = 0
+        self.parser.parse(t, lexer=self.lexer, tracking=True)# , debug=True)
+
+        if self.cache is not None:
+            self.cache.store(t, self.snapshot())
+        return self.package
+
+
+def parse(t: str, storage: GlobalStorage, cache: Optional[ParseCache] = None) -> Package:
+    return ParserSession(storage, cache).parse(t)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,531 @@
+import contextlib
+import hashlib
+import io
+import pickle
+
+from helpers2 import *
+from parser3 import ParserSession
+from parse_cache import ParseCache, PackageSnapshot
+from build_db import interface_lines
+from reachability import data_packages, function_callees, function_types
+
+# Memoized queries over sources, demand-driven instead of phase-ordered.
+# A query records queries it reads as its dependencies. After a source changes, a memo is checked
+# by bringing its dependencies up to date first, it's computed again only if one of them changed.
+# A result equal to the previous one doesn't count as a change, so an edit of a body stops at
+# interface of its package and doesn't reach checks of other functions.
+#
+# Packages are installed into one storage from parsed snapshots and stay there while their interfaces
+# are the same. Analysis changes what it analyzes, so bodies are analyzed in fresh copies from the current
+# snapshot. A package with another interface is installed again, and so are packages which looked it up
+# resolving their declarations. Storage isn't a tracked dependency: queries read it and declare what
+# their result depends on.
+
+# set by set_source and remove_source, not computed
+_INPUTS = ('files', 'source')
+
+
+class _BoundPickler(pickle.Pickler):
+    # objects of a snapshot are written as references, to be read as the installed ones
+    def __init__(self, file: io.BytesIO, ids: Dict[int, int]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.ids = ids
+
+    def persistent_id(self, obj: Any) -> Optional[int]:
+        return self.ids.get(id(obj))
+
+
+class _BoundUnpickler(pickle.Unpickler):
+    def __init__(self, file: io.BytesIO, objects: List[Any]):
+        super().__init__(file)
+        self.objects = objects
+
+    def persistent_load(self, pid: int) -> Any:
+        return self.objects[pid]
+
+
+def _bound_objects(snapshot: PackageSnapshot) -> List[Any]:
+    # what bodies refer to out of themselves, in the same order in snapshots with the same interface
+    declarations = snapshot.struct_declarations + snapshot.function_declarations
+    return [snapshot.package] + declarations + [d.data for d in declarations]
+
+
+def _qualified(t: TypeData) -> RawType:
+    # raw type resolved to the same type from any package
+    d = t.data
+    templates = d.applied_templates if isinstance(d, AppliedStructData) else []
+    return RawType(d.package.path, d.name, t.pointer_level, [_qualified(i) for i in templates], is_const=t.is_const)
+
+
+class _Memo:
+    def __init__(self, value: Any, deps: List[tuple], revision: int):
+        self.value = value
+        self.deps = deps
+        self.verified_at = revision
+        self.changed_at = revision
+
+
+class QueryEngine:
+    def __init__(self, cache: Optional[ParseCache] = None):
+        self.cache = cache
+        self.revision = 0
+        self.memos: Dict[tuple, _Memo] = {}
+        # query name -> times it was computed
+        self.executions: Dict[str, int] = {}
+        self._frames: List[List[tuple]] = []
+        self._raw_types: Dict[str, RawType] = {}
+        # name -> parsed data, snapshot and its functions by id, read only
+        self._snapshots: Dict[str, Tuple[bytes, PackageSnapshot, Dict[str, FunctionDeclaration]]] = {}
+
+        self._storage: Optional[GlobalStorage] = None
+        self._storage_revision = -1
+        # name -> parsed data, interface and snapshot installed into storage, in order of files
+        self._installed: Dict[str, Tuple[bytes, str, PackageSnapshot]] = {}
+        self._packages: Dict[str, Package] = {}
+        self._names: Dict[Package, str] = {}
+        self._functions: Dict[Tuple[str, str], FunctionDeclaration] = {}
+        # installed function -> its file and id
+        self._ids: Dict[FunctionDeclaration, Tuple[str, str]] = {}
+        self._declarations: Dict[str, Tuple[List[StructDeclaration], List[FunctionDeclaration]]] = {}
+        # name -> packages looked up declaring its casts
+        self._cast_names: Dict[str, Set[str]] = {}
+        # name -> output and looked up packages of resolving its declarations in current storage
+        self._resolved: Dict[str, Tuple[str, Set[str]]] = {}
+
+        self._set_input(('files',), ())
+
+    # inputs
+
+    def _set_input(self, key: tuple, value: Any):
+        memo = self.memos.get(key)
+        if memo is not None and memo.value == value:
+            return
+        self.revision += 1
+        self.memos[key] = _Memo(value, [], self.revision)
+
+    def set_source(self, name: str, source: str):
+        # files are added to storage in order they were set first
+        self._set_input(('source', name), source)
+        files = self.memos[('files',)].value
+        if name not in files:
+            self._set_input(('files',), files + (name,))
+
+    def remove_source(self, name: str):
+        files = self.memos[('files',)].value
+        self._set_input(('files',), tuple([i for i in files if i != name]))
+        self._set_input(('source', name), None)
+
+    # engine
+
+    def _get(self, key: tuple, record: bool = True) -> Any:
+        if record and self._frames:
+            self._frames[-1].append(key)
+        return self._fetch(key).value
+
+    def _fetch(self, key: tuple) -> _Memo:
+        memo = self.memos.get(key)
+        if key[0] in _INPUTS:
+            if memo is None or memo.value is None:
+                raise KeyError(f"no input {key}")
+            return memo
+        if memo is not None:
+            if memo.verified_at == self.revision:
+                return memo
+            if self._deps_unchanged(memo):
+                memo.verified_at = self.revision
+                return memo
+        return self._execute(key, memo)
+
+    def _deps_unchanged(self, memo: _Memo) -> bool:
+        for dep in memo.deps:
+            try:
+                changed_at = self._fetch(dep).changed_at
+            except Exception:
+                # it fails now, the query computed again tells why
+                return False
+            if changed_at > memo.verified_at:
+                return False
+        return True
+
+    def _execute(self, key: tuple, old: Optional[_Memo]) -> _Memo:
+        self.executions[key[0]] = self.executions.get(key[0], 0) + 1
+        self._frames.append([])
+        try:
+            value = getattr(self, f'_compute_{key[0]}')(*key[1:])
+        finally:
+            deps = self._frames.pop()
+        memo = _Memo(value, deps, self.revision)
+        if old is not None and old.value == value:
+            memo.changed_at = old.changed_at
+        self.memos[key] = memo
+        return memo
+
+    # untracked state
+
+    def _snapshot(self, name: str, record: bool = True) -> Tuple[PackageSnapshot, Dict[str, FunctionDeclaration]]:
+        data = self._get(('parse', name), record)
+        cached = self._snapshots.get(name)
+        if cached is None or cached[0] is not data:
+            snapshot = pickle.loads(data)
+            functions = {str(f.data): f for f in snapshot.function_declarations}
+            cached = self._snapshots[name] = (data, snapshot, functions)
+        return cached[1], cached[2]
+
+    def storage(self) -> GlobalStorage:
+        if self._storage is not None and self._storage_revision == self.revision:
+            return self._storage
+        files = self._get(('files',), False)
+        kept = [n for n in self._installed if n in files]
+        if self._storage is None or kept != list(files) or \
+                any([self._snapshot(n, False)[0].package.path != self._installed[n][2].package.path for n in kept]):
+            # lookups of any package can find a new file or a moved one
+            self._storage = GlobalStorage()
+            self._storage.add_package(BUILD_IN_PACK)
+            self._installed, self._packages, self._names, self._functions, self._ids = {}, {}, {}, {}, {}
+            self._declarations, self._cast_names, self._resolved = {}, {}, {}
+            self._install(files, list(files))
+        else:
+            self._update(files, [n for n in self._installed if n not in files])
+        self._storage_revision = self.revision
+        return self._storage
+
+    def _update(self, files: Tuple[str, ...], removed: List[str]):
+        changed = set(removed)
+        for name in files:
+            data, interface, installed = self._installed[name]
+            current = self._get(('parse', name), False)
+            if current == data:
+                continue
+            if self._get(('interface', name), False) != interface:
+                changed.add(name)
+                continue
+            # only bodies changed, they're taken from the current snapshot when analyzed
+            snapshot, _ = self._snapshot(name, False)
+            installed.package.sources = snapshot.package.sources
+            installed.package._line_starts = None
+            for d, s in zip(installed.struct_declarations + installed.function_declarations,
+                            snapshot.struct_declarations + snapshot.function_declarations):
+                d.position = s.position
+            self._installed[name] = (current, interface, installed)
+
+        # resolved declarations can hold types of changed packages
+        again = set(changed)
+        while True:
+            more = {n for n in files if n not in again and
+                    (self._resolved.get(n, ('', set()))[1] | self._cast_names.get(n, set())) & again}
+            if not more:
+                break
+            again |= more
+        for name in again:
+            p = self._packages.pop(name)
+            self._storage.remove_package(p)
+            del self._names[p]
+            del self._installed[name]
+            self._functions = {k: f for k, f in self._functions.items() if k[0] != name}
+            self._ids = {f: k for f, k in self._ids.items() if k[0] != name}
+            for i in [self._declarations, self._cast_names, self._resolved]:
+                i.pop(name, None)
+        self._install(files, [n for n in files if n in again])
+
+    def _install(self, files: Tuple[str, ...], names: List[str]):
+        storage = self._storage
+        for name in names:
+            data = self._get(('parse', name), False)
+            snapshot: PackageSnapshot = pickle.loads(data)
+            p = snapshot.install(storage, files.index(name) + 1)
+            self._installed[name] = (data, self._get(('interface', name), False), snapshot)
+            self._packages[name] = p
+            self._names[p] = name
+            self._declarations[name] = ([], [])
+        self._installed = {n: self._installed[n] for n in files}
+        self._packages = {n: self._packages[n] for n in files}
+        drop_foreign_arr_types(storage)
+        storage.lookup_log = set()
+        try:
+            storage.declare_casts()
+        finally:
+            lookups, storage.lookup_log = storage.lookup_log, None
+        for name in names:
+            p = self._packages[name]
+            self._cast_names[name] = self._package_names({i for i in lookups if i[0] is p})
+
+        # ids are taken before types are resolved, as in functions()
+        for f in storage.function_declarations:
+            name = self._names.get(f.data.package)
+            if name in names:
+                key = (name, str(f.data))
+                if self._functions.setdefault(key, f) is f:
+                    self._ids[f] = key
+                self._declarations[name][1].append(f)
+        for s in storage.struct_declarations:
+            name = self._names.get(s.data.package)
+            if name in names:
+                self._declarations[name][0].append(s)
+
+    def _fresh_body(self, name: str, function: str) -> Optional[FunctionBody]:
+        # body of the current snapshot for the installed declaration, analysis doesn't get one twice
+        snapshot, functions = self._snapshot(name, False)
+        body = functions[function].body
+        if body is None:
+            return None
+        file = io.BytesIO()
+        _BoundPickler(file, {id(o): i for i, o in enumerate(_bound_objects(snapshot))}).dump(body)
+        file.seek(0)
+        return _BoundUnpickler(file, _bound_objects(self._installed[name][2])).load()
+
+    def _function(self, name: str, function: str) -> FunctionDeclaration:
+        self.storage()
+        f = self._functions.get((name, function))
+        if f is None:
+            raise KeyError(f"no function {function} in {name}")
+        return f
+
+    def _package_names(self, lookups: Set[Tuple[Package, Path]]) -> Set[str]:
+        names = set()
+        for trace, path in lookups:
+            for p in [trace] + self._storage.resolve_packages(path, trace):
+                name = self._names.get(p)
+                if name is not None:
+                    names.add(name)
+        return names
+
+    def _logged(self, run: Callable[[], Any]) -> Tuple[Any, str, Set[str], List[Data]]:
+        # result, output, looked up packages and applied datas of analysis in current storage
+        storage = self.storage()
+        storage.lookup_log = set()
+        storage.applied_log = []
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                value = run()
+        finally:
+            lookups, storage.lookup_log = storage.lookup_log, None
+            applied, storage.applied_log = storage.applied_log, None
+        return value, out.getvalue(), self._package_names(lookups), applied
+
+    def _resolve_declarations(self, name: str) -> Tuple[str, Set[str]]:
+        # signatures and struct fields, once per storage
+        self.storage()
+        resolved = self._resolved.get(name)
+        if resolved is None:
+            structs, functions = self._declarations[name]
+
+            def run():
+                for s in structs:
+                    s.update_types()
+                for f in functions:
+                    if not f.is_template():
+                        f.update_signature_types()
+
+            _, output, names, _ = self._logged(run)
+            resolved = self._resolved[name] = (output, names)
+        return resolved
+
+    def _raw_key(self, raw: RawType) -> str:
+        key = f"{'const ' if raw.is_const else ''}{raw}"
+        self._raw_types.setdefault(key, raw)
+        return key
+
+    def _depend_on_declarations(self, names: Set[str], datas: List[Data]):
+        for d in datas:
+            names.update([self._names[p] for p in data_packages(d) if p in self._names])
+        for n in sorted(names):
+            self.declarations(n)
+
+    def _instantiations(self, log: List[Data]) -> List[Tuple[str, str, Tuple[str, ...]]]:
+        # instantiate() keys of applied functions in the log
+        keys = []
+        for d in log:
+            if isinstance(d, AppliedFunctionData):
+                template = self._ids.get(self._storage.get_declaration_by_data(d.src_function))
+                if template is not None:
+                    key = template + (tuple([self._raw_key(_qualified(t)) for t in d.applied_templates]),)
+                    if key not in keys:
+                        keys.append(key)
+        return keys
+
+    def _instantiated(self, keys: List[Tuple[str, str, Tuple[str, ...]]]) -> Tuple[bool, str]:
+        # validity and errors of instantiations and of ones they make, each is counted once
+        valid, output = True, ''
+        queue, seen = list(keys), set(keys)
+        for key in queue:
+            _, v, out, applied = self._get(('instantiate',) + key)
+            valid, output = valid and v, output + out
+            for i in applied:
+                if i not in seen:
+                    seen.add(i)
+                    queue.append(i)
+        return valid, output
+
+    # queries
+
+    def files(self) -> Tuple[str, ...]:
+        return self._get(('files',))
+
+    def source(self, name: str) -> str:
+        return self._get(('source', name))
+
+    def parse(self, name: str) -> bytes:
+        # pickled PackageSnapshot
+        return self._get(('parse', name))
+
+    def _compute_parse(self, name: str) -> bytes:
+        source = self.source(name)
+        snapshot = self.cache.load(source) if self.cache is not None else None
+        if snapshot is None:
+            session = ParserSession()
+            session.parse(source)
+            snapshot = session.snapshot()
+            if self.cache is not None:
+                self.cache.store(source, snapshot)
+        return pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+
+    def functions(self, name: str) -> Tuple[str, ...]:
+        # ids of functions are their unresolved signatures
+        return self._get(('functions', name))
+
+    def _compute_functions(self, name: str) -> Tuple[str, ...]:
+        return tuple(self._snapshot(name)[1])
+
+    def function_text(self, name: str, function: str) -> Tuple[int, str]:
+        return self._get(('function_text', name, function))
+
+    def _compute_function_text(self, name: str, function: str) -> Tuple[int, str]:
+        snapshot, functions = self._snapshot(name)
+        f = functions.get(function)
+        if f is None:
+            raise KeyError(f"no function {function} in {name}")
+        start, end = pos_start(f.position), pos_end(f.position)
+        return start, snapshot.package.sources[start:end + 1]
+
+    def interface(self, name: str) -> str:
+        # unresolved declarations, the same until something but bodies changes
+        return self._get(('interface', name))
+
+    def _compute_interface(self, name: str) -> str:
+        snapshot, _ = self._snapshot(name)
+        lines = interface_lines(snapshot.package, snapshot.struct_declarations, snapshot.function_declarations)
+        lines += [f"cast {c[1]} {c[2][0]}" for c in snapshot.casts]
+        return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+    def package_paths(self) -> Tuple[Tuple[str, str], ...]:
+        # lookups go by paths, packages they give change only with this
+        return self._get(('package_paths',))
+
+    def _compute_package_paths(self) -> Tuple[Tuple[str, str], ...]:
+        return tuple([(name, str(self._snapshot(name)[0].package.path)) for name in self.files()])
+
+    def declarations(self, name: str) -> Tuple[str, ...]:
+        # resolved declarations and errors of resolving them
+        return self._get(('declarations', name))
+
+    def _compute_declarations(self, name: str) -> Tuple[str, ...]:
+        self.package_paths()
+        self.interface(name)
+        output, names = self._resolve_declarations(name)
+        # only struct names of other packages are read
+        for n in sorted(names - {name}):
+            self.interface(n)
+        structs, functions = self._declarations[name]
+        return tuple(interface_lines(self._packages[name], structs, functions)) + (output,)
+
+    def resolve_type(self, raw: RawType, name: str) -> TypeData:
+        # raw type as it's written in the file
+        return self._get(('resolve_type', self._raw_key(raw), name))
+
+    def _compute_resolve_type(self, raw_key: str, name: str) -> TypeData:
+        self.package_paths()
+        self.storage()
+        t = TypeData.new_raw(self._packages[name], self._raw_types[raw_key])
+        _, _, names, _ = self._logged(t.make_not_raw)
+        for n in sorted(names):
+            self.interface(n)
+        return t
+
+    def signature(self, name: str, function: str) -> str:
+        return self._get(('signature', name, function))
+
+    def _compute_signature(self, name: str, function: str) -> str:
+        self.declarations(name)
+        f = self._function(name, function)
+        self._resolve_declarations(name)
+        return f"{f.data.type} {f.data}"
+
+    def check(self, name: str, function: str) -> Tuple[bool, str]:
+        # validity and errors of a non-template function and of instantiations it makes
+        return self._get(('check', name, function))
+
+    def _compute_check(self, name: str, function: str) -> Tuple[bool, str]:
+        self.function_text(name, function)
+        self.package_paths()
+        f = self._function(name, function)
+        if f.is_template():
+            raise ValueError(f"{function} is a template, its instantiations are checked")
+        # any function can be a candidate of a call
+        for n in self._packages:
+            self._resolve_declarations(n)
+
+        f.body = self._fresh_body(name, function)
+
+        def run() -> bool:
+            if f.body is not None:
+                f.body.update_types()
+            return bool(f.is_valid())
+
+        valid, output, names, log = self._logged(run)
+        datas: List[Data] = []
+        if f.body is not None:
+            datas += function_callees(f) + [t.data for t in function_types(f) if t is not None and t.data]
+        self._depend_on_declarations(names | {name}, datas)
+        instantiated, errors = self._instantiated(self._instantiations(log))
+        return valid and instantiated, output + errors
+
+    def instantiate(self, name: str, function: str, templates: List[RawType]) -> Tuple[str, bool, str]:
+        # applied function, validity and errors of it and of instantiations it makes.
+        # Types are resolved in the file of the template
+        key = (name, function, tuple([self._raw_key(t) for t in templates]))
+        text = self._get(('instantiate',) + key)[0]
+        valid, output = self._instantiated([key])
+        return text, valid, output
+
+    def _compute_instantiate(self, name: str, function: str, templates: Tuple[str, ...]) \
+            -> Tuple[str, bool, str, Tuple[Tuple[str, str, Tuple[str, ...]], ...]]:
+        # applied function, its own validity and errors, instantiations it makes
+        self.function_text(name, function)
+        self.package_paths()
+        f = self._function(name, function)
+        if not f.is_template():
+            raise ValueError(f"{function} isn't a template")
+        storage = self.storage()
+        for n in self._packages:
+            self._resolve_declarations(n)
+        f.body = self._fresh_body(name, function)
+        applied: List[FunctionDeclaration] = []
+
+        def run() -> Tuple[str, bool]:
+            types = []
+            for key in templates:
+                t = TypeData.new_raw(f.data.package, self._raw_types[key])
+                t.make_not_raw()
+                types.append(t)
+            data = f.data.apply_template(types)
+            try:
+                data.package.register(data)
+            except KeyError:
+                pass
+            a = f.apply_template(types)
+            applied.append(a)
+            try:
+                storage.register(a)
+            except KeyError:
+                pass
+            a.update_types()
+            return str(data), bool(a.is_valid())
+
+        (text, valid), output, names, log = self._logged(run)
+        a = applied[0]
+        datas = [a.data] + function_callees(a) + [t.data for t in function_types(a) if t is not None and t.data]
+        self._depend_on_declarations(names | {name}, datas)
+        # recursive calls make the same instantiation
+        log = [d for d in log if d.hash != a.data.hash]
+        return text, valid, output, tuple(self._instantiations(log))
@@ -0,0 +1,151 @@
+from helpers2 import *
+
+
+def expression_children(expr: Expression) -> List[Expression]:
+    # the same expressions gen_expr goes into
+    if isinstance(expr, FunctionInvokeExpression):
+        return expr.arguments
+    elif isinstance(expr, BinaryOperatorExpression):
+        return [expr.expr1, expr.expr2]
+    elif isinstance(expr, (UnaryOperatorExpression, ReturnExpression, CastExpression, GetterExpression,
+                           PointerUnpackExpression, PointerGetExpression, UnsafeExpression, CopyExpression)):
+        return [expr.expr] if expr.expr else []
+    elif isinstance(expr, VariableCreationExpression):
+        return [expr.expr] if expr.expr else []
+    elif isinstance(expr, ExpressionValueSetExpression):
+        return [expr.to, expr.expr]
+    elif isinstance(expr, (StructConstructorExpression, VisibilityAreaExpression, ArrayCreationExpression)):
+        return expr.exprs
+    elif isinstance(expr, IfExpression):
+        return [expr.expr, expr.if_body] + ([expr.else_body] if expr.else_body else [])
+    elif isinstance(expr, WhileExpression):
+        return [expr.expr, expr.body]
+    return []
+
+
+def expression_callees(expr: Expression) -> List[FunctionData]:
+    # functions the expression itself calls: invoke, operators, cast, copy and destructor
+    if isinstance(expr, (FunctionInvokeExpression, BinaryOperatorExpression, UnaryOperatorExpression,
+                         CastExpression, VariableDestroyExpression, CopyExpression)):
+        return [expr.function] if expr.function else []
+    return []
+
+
+def expression_types(expr: Expression) -> List[TypeData]:
+    # types the generated C of the expression names
+    if isinstance(expr, VariableCreationExpression):
+        return [expr.data.type] if expr.data else []
+    elif isinstance(expr, CastExpression):
+        return [expr.cast_type]
+    elif isinstance(expr, (StructConstructorExpression, SizeofExpression)):
+        return [expr.type]
+    elif isinstance(expr, TypestrExpression):
+        return [get_char_arr_t()]
+    elif isinstance(expr, Constant):
+        return [expr.type]
+    elif isinstance(expr, ArrayCreationExpression):
+        return [expr.get_out_type(), expr.exprs[0].get_out_type()]
+    return []
+
+
+def function_callees(f: FunctionDeclaration) -> List[FunctionData]:
+    callees = []
+    exprs = f.body.expressions[:]
+    while exprs:
+        e = exprs.pop()
+        callees += expression_callees(e)
+        exprs += expression_children(e)
+    return callees
+
+
+def function_types(f: FunctionDeclaration) -> List[TypeData]:
+    types = [f.data.type] + [t for t, _ in f.arguments]
+    exprs = f.body.expressions[:]
+    while exprs:
+        e = exprs.pop()
+        types += expression_types(e)
+        exprs += expression_children(e)
+    return types
+
+
+def data_packages(d: Data) -> List[Package]:
+    # packages of the data and of types it was applied with
+    if isinstance(d, AppliedFunctionData):
+        return data_packages(d.src_function) + [p for t in d.applied_templates for p in data_packages(t.data)]
+    elif isinstance(d, AppliedStructData):
+        return data_packages(d.src_sd) + [p for t in d.applied_templates for p in data_packages(t.data)]
+    return [d.package]
+
+
+class DeclarationIndex:
+    # declarations of datas from expressions and types.
+    # Applied datas there aren't the ones of declarations, but have the same hashes
+    def __init__(self, storage: GlobalStorage):
+        self.storage = storage
+        self._applied_functions: Dict[int, AppliedFunctionDeclarationContainer] = {}
+        for declarations in storage.applied_function_declarations.values():
+            for a in declarations:
+                self._applied_functions.setdefault(a.data.hash, a)
+        self._applied_structs: Dict[int, AppliedStructDeclaration] = {}
+        for declarations in storage.applied_struct_declarations.values():
+            for a in declarations:
+                self._applied_structs.setdefault(a.data.hash, a)
+
+    def function_declaration(self, f: FunctionData) -> Optional[FunctionDeclaration]:
+        if isinstance(f, AppliedFunctionData):
+            return self._applied_functions.get(f.hash)
+        return self.storage.get_declaration_by_data(f)
+
+    def struct_declaration(self, s: StructData) -> Optional[StructDeclaration]:
+        if isinstance(s, AppliedStructData):
+            return self._applied_structs.get(s.hash)
+        return self.storage.get_declaration_by_data(s)
+
+
+class Reachability:
+    # functions and structs reachable from the roots through calls, signatures and struct fields.
+    # callees and types are the hooks for edges the expressions don't show
+    def __init__(self, storage: GlobalStorage,
+                 callees: Callable[[FunctionDeclaration], List[FunctionData]] = function_callees,
+                 types: Callable[[FunctionDeclaration], List[TypeData]] = function_types):
+        self.index = DeclarationIndex(storage)
+        self.callees = callees
+        self.types = types
+        self.functions: Set[int] = set()
+        self.structs: Set[int] = set()
+
+    def add_type(self, t: TypeData):
+        structs = [t.data]
+        while structs:
+            s = structs.pop()
+            if s is None or s.hash in self.structs:
+                continue
+            self.structs.add(s.hash)
+            decl = self.index.struct_declaration(s)
+            if decl is not None:
+                structs += [ft.data for _, ft, _ in decl.fields]
+
+    def run(self, roots: List[FunctionDeclaration]) -> 'Reachability':
+        functions = roots[:]
+        while functions:
+            f = functions.pop()
+            if f.data.hash in self.functions:
+                continue
+            self.functions.add(f.data.hash)
+            if f.is_extern():
+                for t in [f.data.type] + [t for t, _ in f.arguments]:
+                    self.add_type(t)
+                continue
+            for t in self.types(f):
+                self.add_type(t)
+            for c in self.callees(f):
+                decl = self.index.function_declaration(c)
+                if decl is not None:
+                    functions.append(decl)
+        return self
+
+    def is_function_reachable(self, f: FunctionDeclaration) -> bool:
+        return f.data.hash in self.functions
+
+    def is_struct_reachable(self, s: StructDeclaration) -> bool:
+        return s.data.hash in self.structs
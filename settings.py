@@ -1,26 +1,40 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
 class SettingsSwitch:
+    # safe/unsafe mode is per context, so bodies analyzed in different threads or tasks don't see each other's mode
     def __init__(self):
         self.safe = Settings()
         self.unsafe = UnsafeSettings()
-        self.is_safe = True
+        self._is_safe: ContextVar[bool] = ContextVar('is_safe', default=True)
 
     def get_current(self) -> 'Settings':
-        if self.is_safe:
+        if self._is_safe.get():
             return self.safe
         else:
             return self.unsafe
 
     def switch_safe(self):
-        self.is_safe = True
+        self._is_safe.set(True)
 
     def switch_unsafe(self):
-        self.is_safe = False
+        self._is_safe.set(False)
+
+    @contextmanager
+    def scope(self, is_safe: bool):
+        # mode of the block, the previous one is back after it even if analysis raised
+        token = self._is_safe.set(is_safe)
+        try:
+            yield
+        finally:
+            self._is_safe.reset(token)
 
     def curr_is_safe(self) -> bool:
-        return self.is_safe
+        return self._is_safe.get()
 
     def curr_is_unsafe(self) -> bool:
-        return not self.is_safe
+        return not self._is_safe.get()
 
 class Settings:
     def __init__(self):
@@ -0,0 +1,135 @@
+# a build with the database has to give the same validity, errors and C as a clean build,
+# whatever was edited since the database was written
+import contextlib
+import io
+import os
+import sys
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from codegen2 import gen_c_code
+from build_db import BuildDatabase
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MAIN = '''package main;
+
+using std;
+using std:io;
+using other;
+
+i32 main() {
+    var p = point<i32>(5);
+    io:println(p.getX());
+    var s = pair {1, 2i64};
+    io:println(s.sum());
+    io:println(seven());
+    return 0;
+}
+'''
+
+# pair is declared last, so editing it doesn't move functions
+OTHER = '''package other;
+
+using std;
+
+struct point<T> {
+    internal T x;
+}
+
+point<T> point<T>(T x) {
+    return point<T> {x};
+}
+
+T getX<T>(point<T>* p) {
+    return p.x;
+}
+
+i64 sum(pair* p) {
+    return p.b + 1i64;
+}
+
+i64 seven() {
+    return 7i64;
+}
+
+struct pair {
+    internal i32 a;
+    internal i64 b;
+}
+'''
+
+
+def _build(sources: List[str], directory: Optional[str]) -> Tuple[bool, str, str, Optional[BuildDatabase]]:
+    # as main2 does it
+    sys.setrecursionlimit(10000)
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(read_sources(os.path.join(ROOT, 'build-in')) + sources, storage, workers=1)
+    build = BuildDatabase(directory) if directory is not None else None
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        valid = bool(storage.is_valid(build))
+    code = ''
+    if valid:
+        code = gen_c_code(storage, build=build)
+        if build is not None:
+            build.save()
+    return valid, out.getvalue(), code, build
+
+
+def _rebuild(directory: str, sources: List[str]) -> BuildDatabase:
+    valid, output, code, build = _build(sources, directory)
+    assert (valid, output, code) == _build(sources, None)[:3]
+    return build
+
+
+def _reused(build: BuildDatabase) -> Set[str]:
+    return {str(f.data) for f in build.reused}
+
+
+def test_unchanged_run_reuses_everything(tmp_path):
+    first = _rebuild(str(tmp_path), [MAIN, OTHER])
+    assert first.hits == 0 and first.misses > 0
+
+    build = _rebuild(str(tmp_path), [MAIN, OTHER])
+    assert build.misses == 0
+    assert build.hits == first.misses
+    assert 'main:main()' in _reused(build)
+
+
+def test_body_edit_reanalyzes_only_the_function(tmp_path):
+    _rebuild(str(tmp_path), [MAIN, OTHER])
+    build = _rebuild(str(tmp_path), [MAIN, OTHER.replace('return 7i64;', 'return 8i64;')])
+    assert build.misses == 1
+    assert 'other:seven()' not in _reused(build)
+    assert {'main:main()', 'other:sum(other:pair*)'} <= _reused(build)
+
+
+def test_edit_moving_later_functions(tmp_path):
+    # offsets are a part of generated names, functions after the edit are analyzed again
+    _rebuild(str(tmp_path), [MAIN, OTHER])
+    build = _rebuild(str(tmp_path), [MAIN, OTHER.replace('return p.b + 1i64;', 'return p.b + 10i64;')])
+    assert build.misses == 2
+    assert not {'other:sum(other:pair*)', 'other:seven()'} & _reused(build)
+    assert 'main:main()' in _reused(build)
+
+
+def test_struct_field_edit_reanalyzes_users(tmp_path):
+    # only the struct is edited, main doesn't fit it anymore
+    _rebuild(str(tmp_path), [MAIN, OTHER])
+    build = _rebuild(str(tmp_path), [MAIN, OTHER.replace('internal i64 b;', 'internal i32 b;')])
+    assert build.hits > 0
+    assert not {'main:main()', 'other:sum(other:pair*)'} & _reused(build)
+
+    _rebuild(str(tmp_path), [MAIN, OTHER])
+    build = _rebuild(str(tmp_path), [MAIN, OTHER.replace('    internal i64 b;\n', '    internal i64 b;\n    internal i64 c;\n')])
+    assert not {'main:main()', 'other:sum(other:pair*)'} & _reused(build)
+
+
+def test_signature_edit_reanalyzes_callers(tmp_path):
+    _rebuild(str(tmp_path), [MAIN, OTHER])
+    changed = OTHER.replace('i64 seven() {\n    return 7i64;', 'i32 seven() {\n    return 7;')
+    build = _rebuild(str(tmp_path), [MAIN, changed])
+    assert build.hits > 0
+    assert not {'main:main()', 'other:seven()'} & _reused(build)
@@ -0,0 +1,124 @@
+# match_image re-derives hashes of applied argument types instead of applying templates,
+# every answer it gives has to be the one _eq_image gets by applying them
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from bench_templates import gen_source
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# explicit templates on arguments made of template structs, overloads told apart by them
+EXPLICIT = '''package explicit;
+
+using std;
+using std:box;
+
+struct point<T> {
+    internal T x;
+}
+
+struct pair<A, B> {
+    internal A a;
+    internal B b;
+}
+
+point<T> point<T>(T x) {
+    return point<T> {x};
+}
+
+T getX<T>(point<T>* p) {
+    return p.x;
+}
+
+A first<A, B>(pair<A, B>* p) {
+    return p.a;
+}
+
+T id<T>(T x) {
+    return x;
+}
+
+T value<T>(point<T> p) {
+    return p.x;
+}
+
+T value<T>(pair<T, T> p) {
+    return p.b;
+}
+
+T value<T>(box<T> b) {
+    return b.getValue();
+}
+
+i32 f() {
+    var p = point<i32>(1);
+    var q = point<i64>(2i64);
+    i32 a = getX<i32>(p);
+    i64 b = getX<i64>(q);
+    var r = pair<i32, i64> {1, 2i64};
+    i32 c = first<i32, i64>(r);
+    i32 e = id<i32>(a);
+    i32 g = value<i32>(p);
+    var s = pair<i32, i32> {3, 4};
+    i32 h = value<i32>(s);
+    var bx = box<i32>(5);
+    i32 k = value<i32>(bx);
+    i64 m = value<i64>(q);
+    return a + c + e + g + h + k;
+}
+'''
+
+
+def _corpus(name: str) -> List[str]:
+    sources = read_sources(os.path.join(ROOT, 'build-in'))
+    if name == 'src':
+        # the same as main2 builds with unsafe block enabled
+        sources += [s.replace('//unsafe {', 'unsafe {').replace('//}', '}')
+                    for s in read_sources(os.path.join(ROOT, 'src'))]
+    elif name == 'templates':
+        sources.append(gen_source())
+    elif name == 'explicit':
+        sources.append(EXPLICIT)
+    return sources
+
+
+def _packed_types(arg_types: List[TypeData], packed: int) -> List[TypeData]:
+    # what _find_function compares with when an argument is passed by pointer
+    ts = [t.copy() for t in arg_types]
+    for i, t in enumerate(ts):
+        if packed >> i & 1:
+            t.pointer_level += 1
+            t.raw.pointer_level += 1
+            t.gen_hash()
+    return ts
+
+
+@pytest.mark.parametrize('corpus', ['build-in', 'src', 'templates', 'explicit'])
+def test_match_image_agrees_with_applied_templates(monkeypatch, corpus):
+    sys.setrecursionlimit(10000)
+    match_image = FunctionData.match_image
+    compared = []
+
+    def checked(self, name, templates, arg_types, packed=0):
+        m = match_image(self, name, templates, arg_types, packed)
+        if m is not None:
+            expected = self._eq_image(FunctionImage(name, _packed_types(arg_types, packed), templates))
+            assert m == expected, f"{self} and {name}({', '.join([str(t) for t in arg_types])}), packed {packed}"
+            compared.append(self.is_template())
+        return m
+
+    monkeypatch.setattr(FunctionData, 'match_image', checked)
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(_corpus(corpus), storage, workers=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert storage.is_valid()
+
+    assert len(compared) > 100
+    assert any(compared)
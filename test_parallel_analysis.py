@@ -0,0 +1,56 @@
+# bodies analyzed by worker processes have to give the same validity, errors and C as serial analysis
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from codegen2 import gen_c_code
+from build_db import BuildDatabase
+from bench_templates import gen_source, MAIN
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# an error in every other function, errors are printed in order of functions
+BROKEN = ''.join([f'''
+i32 broken{n}() {{
+    return {"undefined" if n % 2 else ""}{n};
+}}
+''' for n in range(MIN_PARALLEL_FUNCTIONS)])
+
+pytestmark = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="no fork")
+
+
+def _analyze(sources: List[str], workers: int, directory: Optional[str] = None) -> Tuple[bool, str, str]:
+    sys.setrecursionlimit(10000)
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(read_sources(os.path.join(ROOT, 'build-in')) + sources, storage, workers=1)
+    build = BuildDatabase(directory) if directory is not None else None
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        valid = bool(storage.is_valid(build, workers))
+    code = gen_c_code(storage, eliminate_dead_code=False, build=build) if valid else ''
+    if build is not None and valid:
+        build.save()
+    return valid, out.getvalue(), code
+
+
+@pytest.mark.parametrize('source', ['templates', 'broken'])
+def test_workers_give_serial_results(source):
+    sources = [gen_source() + MAIN] if source == 'templates' else [gen_source() + MAIN + BROKEN]
+    serial = _analyze(sources, 1)
+    assert serial[0] == (source == 'templates')
+    assert _analyze(sources, 2) == serial
+
+
+def test_workers_with_build_database(tmp_path):
+    sources = [gen_source() + MAIN]
+    serial = _analyze(sources, 1)
+    assert _analyze(sources, 2, str(tmp_path)) == serial
+    edited = [sources[0].replace('point<i32>(7);', 'point<i32>(8);', 1)]
+    assert _analyze(edited, 2, str(tmp_path)) == _analyze(edited, 1)
@@ -0,0 +1,154 @@
+# after any edit, answers of the query engine have to be the ones of a new engine,
+# and only queries which depend on the edit are computed again
+import os
+import sys
+
+from helpers2 import *
+from queries import QueryEngine
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MAIN = '''package main;
+
+using std;
+using other;
+
+i32 main() {
+    i64 s = seven();
+    var p = pair {1, 2i64};
+    return first(p);
+}
+
+i32 twice(i32 x) {
+    return id<i32>(x) * 2;
+}
+
+i32 getA(pair* p) {
+    return p.a;
+}
+'''
+
+OTHER = '''package other;
+
+using std;
+
+struct pair {
+    public i32 a;
+    internal i64 b;
+}
+
+i32 first(pair* p) {
+    return p.a;
+}
+
+i64 seven() {
+    return 7i64;
+}
+
+T id<T>(T x) {
+    return x;
+}
+'''
+
+BAD = '''package main;
+
+using std;
+
+T bad<T>(T x) {
+    return undefinedThing(x);
+}
+
+i32 f1() {
+    return bad<i32>(1);
+}
+
+i32 f2() {
+    return bad<i32>(2);
+}
+'''
+
+
+def _engine(sources: Dict[str, str]) -> QueryEngine:
+    sys.setrecursionlimit(10000)
+    engine = QueryEngine()
+    for n in sorted(os.listdir(os.path.join(ROOT, 'build-in'))):
+        with open(os.path.join(ROOT, 'build-in', n)) as file:
+            engine.set_source(n, file.read())
+    for name, source in sources.items():
+        engine.set_source(name, source)
+    return engine
+
+
+def _checks(engine: QueryEngine, names: List[str]) -> Dict[Tuple[str, str], Tuple[bool, str]]:
+    return {(n, f): engine.check(n, f) for n in names for f in engine.functions(n) if '<' not in f}
+
+
+def _edited(engine: QueryEngine, sources: Dict[str, str]) -> Dict[Tuple[str, str], Tuple[bool, str]]:
+    for name, source in sources.items():
+        engine.set_source(name, source)
+    checks = _checks(engine, list(sources))
+    assert checks == _checks(_engine(sources), list(sources))
+    return checks
+
+
+def test_instantiation_errors_are_reported_by_callers():
+    for order in [['main:f1()', 'main:f2()'], ['main:f2()', 'main:f1()']]:
+        engine = _engine({'bad.fl': BAD})
+        for f in order:
+            valid, output = engine.check('bad.fl', f)
+            assert not valid
+            assert "function undefinedThing(:i32) doesn't exists" in output
+
+
+def test_body_edit_checks_only_its_function():
+    engine = _engine({'main.fl': MAIN, 'other.fl': OTHER})
+    assert all([valid for valid, _ in _checks(engine, ['main.fl', 'other.fl']).values()])
+    storage = engine.storage()
+    checks = engine.executions['check']
+
+    _edited(engine, {'main.fl': MAIN, 'other.fl': OTHER.replace('return 7i64;', 'return 8i64;')})
+    assert engine.executions['check'] == checks + 1
+    # installed packages are kept
+    assert engine.storage() is storage
+
+
+def test_template_body_edit_checks_callers():
+    engine = _engine({'main.fl': MAIN, 'other.fl': OTHER})
+    _checks(engine, ['main.fl', 'other.fl'])
+    checks = _edited(engine, {'main.fl': MAIN, 'other.fl': OTHER.replace('    return x;', '    return y;')})
+    assert not checks[('main.fl', 'main:twice(:i32)')][0]
+    assert checks[('main.fl', 'main:main()')][0]
+
+
+def test_interface_edit_checks_users():
+    engine = _engine({'main.fl': MAIN, 'other.fl': OTHER})
+    _checks(engine, ['main.fl', 'other.fl'])
+    checks = _edited(engine, {'main.fl': MAIN, 'other.fl': OTHER.replace('public i32 a;', 'public i64 a;')})
+    assert not checks[('main.fl', 'main:main()')][0]
+    assert not checks[('other.fl', 'other:first(:pair*)')][0]
+    assert not checks[('main.fl', 'main:getA(:pair*)')][0]
+    assert checks[('other.fl', 'other:seven()')][0]
+
+
+def test_signature_edit_checks_callers():
+    engine = _engine({'main.fl': MAIN, 'other.fl': OTHER})
+    _checks(engine, ['main.fl', 'other.fl'])
+    changed = OTHER.replace('i64 seven() {\n    return 7i64;', 'i32 seven() {\n    return 7;')
+    checks = _edited(engine, {'main.fl': MAIN, 'other.fl': changed})
+    assert not checks[('main.fl', 'main:main()')][0]
+    assert checks[('other.fl', 'other:seven()')][0]
+
+    _edited(engine, {'main.fl': MAIN, 'other.fl': OTHER})
+    assert all([valid for valid, _ in _checks(engine, ['main.fl', 'other.fl']).values()])
+
+
+def test_file_removal_checks_users():
+    engine = _engine({'main.fl': MAIN, 'other.fl': OTHER})
+    _checks(engine, ['main.fl', 'other.fl'])
+    engine.remove_source('other.fl')
+    checks = _edited(engine, {'main.fl': MAIN})
+    assert not any([valid for valid, _ in checks.values()])
+
+    engine.set_source('other.fl', OTHER)
+    _edited(engine, {'main.fl': MAIN, 'other.fl': OTHER})
+    assert all([valid for valid, _ in _checks(engine, ['main.fl', 'other.fl']).values()])
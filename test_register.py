@@ -0,0 +1,39 @@
+# every applied data is registered once, whether it's a new object or one the instantiation cache gives again
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_same_applied_data_is_registered_once():
+    p = Package(Path(['reg']), [])
+    s = StructData(p, 'box', [RawType(Path([]), 'T', 0, [])])
+    p.register(s)
+    applied = AppliedStructData(p, 'box', s, [I32_T])
+    p.register(applied)
+    with pytest.raises(KeyError):
+        p.register(applied)
+    with pytest.raises(KeyError):
+        p.register(AppliedStructData(p, 'box', s, [I32_T]))
+    assert p.applied_struct_datas[s] == [applied]
+
+
+def test_src_instantiations_are_pending_once():
+    sys.setrecursionlimit(10000)
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    # the same as main2 builds with unsafe block enabled
+    sources = [s.replace('//unsafe {', 'unsafe {').replace('//}', '}') for s in read_sources(os.path.join(ROOT, 'src'))]
+    parse_all(read_sources(os.path.join(ROOT, 'build-in')) + sources, storage, workers=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert storage.is_valid()
+    for p in storage.all_packages:
+        for applied in list(p.applied_function_datas.values()) + list(p.applied_struct_datas.values()):
+            assert len({id(d) for d in applied}) == len(applied), [str(d) for d in applied]
@@ -0,0 +1,75 @@
+# resolution of raw types is cached per storage, instantiations of one generic body
+# have to get their own types from it
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from helpers2 import *
+from frontend import parse_all, read_sources
+from codegen2 import gen_c_code
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SOURCE = '''package main;
+
+using std;
+using std:exception;
+
+struct pair<A, B> {
+    A a;
+    B b;
+}
+
+pair<A, B> mk<A, B>(A a, B b) {
+    return pair<A, B> {a, b};
+}
+
+i32 main() {
+    var e = exception<i64>();
+    var f = exception<i32>();
+    var p = mk(3, 'c');
+    var q = mk<i64, i32>(4i64, 5);
+    return p.a + q.b - 8;
+}
+'''
+
+
+def _storage() -> GlobalStorage:
+    sys.setrecursionlimit(10000)
+    storage = GlobalStorage()
+    storage.add_package(BUILD_IN_PACK)
+    parse_all(read_sources(os.path.join(ROOT, 'build-in')) + [SOURCE], storage, workers=1)
+    return storage
+
+
+def test_substituted_templates_are_resolved_apart():
+    storage = _storage()
+    p = storage.path_to_package[Path(['main'])]
+    a, b = RawType(Path([]), 'A', 0, [], p), RawType(Path([]), 'B', 0, [], p)
+    raw = RawType(Path([]), 'pair', 0, [a, b], p)
+    types = []
+    for x, y in [('i32', 'char'), ('i64', 'i32')]:
+        applied = TypeData.new_raw_templates(raw, {a: TypeData.new_raw(p, RawType(Path([]), x, 0, [], p)),
+                                                   b: TypeData.new_raw(p, RawType(Path([]), y, 0, [], p))})
+        # as types of copied bodies are resolved
+        t = TypeData.new_raw(p, applied.raw)
+        t.make_not_raw()
+        types.append(str(t))
+    assert types == ['main:pair<:i32, :char>', 'main:pair<:i64, :i32>']
+
+
+@pytest.mark.skipif(shutil.which('gcc') is None, reason="no gcc")
+def test_instantiations_compile(tmp_path):
+    storage = _storage()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert storage.is_valid()
+    source = tmp_path / 'test.c'
+    source.write_text(gen_c_code(storage))
+    binary = tmp_path / 'test'
+    subprocess.run(['gcc', '-w', str(source), '-I', os.path.join(ROOT, 'gcc_gens'), '-o', str(binary)], check=True)
+    assert subprocess.run([str(binary)]).returncode == 0